@@ -0,0 +1,180 @@
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContainerClient
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from StorageBackends import create_state_container
+import threading
+from Telemetry import stage
+
+#list (default) pages through every blob under the prefix on every run. changefeed reads the storage account's blob
+#change feed (needs change feed enabled on the account and the azure-storage-blob-changefeed package) and tags finds
+#blobs whose BLOB_LISTING_TAG index tag is past the high-water mark, both only touch blobs that changed since the last run
+BLOB_LISTING = os.environ.get('BLOB_LISTING', 'list').lower()
+#index tag the uploader sets to the time the blob was written, in UTC as 2024-05-01T12:00:00Z so the values sort as text
+BLOB_LISTING_TAG = os.environ.get('BLOB_LISTING_TAG', 'modified')
+BLOB_LISTING_PAGE_SIZE = int(os.environ.get('BLOB_LISTING_PAGE_SIZE', '5000'))
+#container in the function app's storage account holding the high-water mark of every listing
+BLOB_LISTING_STATE_CONTAINER = os.environ.get('BLOB_LISTING_STATE_CONTAINER', 'blob-listing')
+
+CHANGED_BLOB_EVENTS = {'BlobCreated'}
+TAG_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+CONTINUATION_TOKEN = 'continuation_token'
+TAG_VALUE = 'tag_value'
+LISTED_AT_TAG_VALUE = 'listed_at_tag_value'
+SINCE = 'since'
+
+_state_containers = {}
+_change_feed_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_state_container(connection_string:str):
+    with _clients_lock:
+        container_client = _state_containers.get(connection_string)
+        if container_client is None:
+            container_client = create_state_container(connection_string, BLOB_LISTING_STATE_CONTAINER)
+            _state_containers[connection_string] = container_client
+    return container_client
+
+
+def get_change_feed_client(connection_string:str):
+    #raises ImportError when the change feed package isn't installed
+    with _clients_lock:
+        change_feed_client = _change_feed_clients.get(connection_string)
+        if change_feed_client is None:
+            from azure.storage.blob.changefeed import ChangeFeedClient
+            change_feed_client = ChangeFeedClient.from_connection_string(conn_str=connection_string)
+            _change_feed_clients[connection_string] = change_feed_client
+    return change_feed_client
+
+
+def to_utc(time:datetime):
+    #naive times are local, like the ones the timer triggers pass in
+    return time.astimezone(timezone.utc)
+
+
+class BlobListing:
+    """
+    The blobs under prefix in a container that changed since the last committed listing, read with BLOB_LISTING.
+    The first listing (no high-water mark saved yet) starts from last_processed_time, without either it is a full
+    paged listing, which is also used when the change feed or tag query can't be read.
+    list_blobs() returns blob properties like ContainerClient.list_blobs. commit() saves the high-water mark once what was listed
+    has been processed, so blobs listed by a run that fails are listed again by the next one.
+    Runs that use the same container for different targets (e.g. every index a delete runs against) need their
+    own state_name so one committing doesn't hide the changes from the others
+    """
+    def __init__(self, container_client:ContainerClient, connection_string:str, prefix:str, last_processed_time:datetime, state_name:str):
+        self.container_client = container_client
+        self.connection_string = connection_string
+        self.prefix = prefix
+        self.mode = BLOB_LISTING
+        self.state_blob_name = f'{self.mode}/{state_name.strip("/")}/high-water-mark.json'
+        #blobs listed may still be older than this (full listings and change feed reads by time), None when they all changed
+        self.last_processed_time = last_processed_time
+        self.state = None
+        self.next_state = None
+        if self.mode != 'list':
+            self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            return json.loads(get_state_container(self.connection_string).download_blob(self.state_blob_name).readall())
+        except ResourceNotFoundError:
+            return {}
+
+    def commit(self):
+        if self.next_state is None:
+            return
+        get_state_container(self.connection_string).upload_blob(self.state_blob_name, json.dumps(self.next_state), overwrite=True)
+        self.state = self.next_state
+        self.next_state = None
+
+    def list_blobs(self):
+        #the change feed or tag query is read here, last_processed_time is up to date once this returns
+        listing_start = datetime.now(timezone.utc)
+        blob_names = None
+        if self.mode in ('changefeed', 'tags'):
+            try:
+                with stage('list changes', blob_listing=self.mode):
+                    blob_names = self.list_changed_blob_names()
+            except Exception as e:
+                logging.log(logging.WARNING, f'Unable to list changed blobs in {self.container_client.container_name} with {self.mode}, listing every blob instead: {str(e)}')
+        if blob_names is None:
+            if self.mode != 'list':
+                #filtered by time like the list mode, from the saved high-water mark when there is one,
+                #and the next run reads changes from when this listing started
+                self.last_processed_time = self.get_since()
+                self.next_state = {SINCE: listing_start.isoformat()}
+            return self.container_client.list_blobs(name_starts_with=self.prefix, results_per_page=BLOB_LISTING_PAGE_SIZE)
+        return self.iter_blob_properties(blob_names)
+
+    def iter_blob_properties(self, blob_names:list):
+        for blob_name in blob_names:
+            try:
+                yield self.container_client.get_blob_client(blob_name).get_blob_properties()
+            except ResourceNotFoundError:
+                #deleted again after it was changed
+                pass
+
+    def get_since(self):
+        if self.state.get(SINCE):
+            return datetime.fromisoformat(self.state[SINCE])
+        if self.last_processed_time is not None:
+            return to_utc(self.last_processed_time)
+        return None
+
+    def list_changed_blob_names(self):
+        #None when there is nothing to start from and every blob has to be listed
+        if self.mode == 'changefeed':
+            return self.list_change_feed_blob_names()
+        return self.list_tagged_blob_names()
+
+    def list_change_feed_blob_names(self):
+        #the change feed covers the whole storage account, events are filtered to this container and prefix here
+        continuation_token = self.state.get(CONTINUATION_TOKEN)
+        change_feed_client = get_change_feed_client(self.connection_string)
+        if continuation_token is not None:
+            pages = change_feed_client.list_changes(results_per_page=BLOB_LISTING_PAGE_SIZE).by_page(continuation_token=continuation_token)
+            since = None
+        else:
+            since = self.get_since()
+            if since is None:
+                return None
+            #reads start at the hour since falls in, older blobs are left out by last_processed_time
+            pages = change_feed_client.list_changes(start_time=since, results_per_page=BLOB_LISTING_PAGE_SIZE).by_page()
+        subject_prefix = f'/blobServices/default/containers/{self.container_client.container_name}/blobs/{self.prefix or ""}'
+        blob_names = {}
+        for page in pages:
+            for event in page:
+                if event.get('eventType') in CHANGED_BLOB_EVENTS and event.get('subject', '').startswith(subject_prefix):
+                    #a blob written several times is loaded once, at its current version
+                    blob_names[event['subject'].split('/blobs/', 1)[1]] = None
+        self.next_state = {CONTINUATION_TOKEN: pages.continuation_token}
+        self.last_processed_time = since
+        return list(blob_names)
+
+    def list_tagged_blob_names(self):
+        tag_value = self.state.get(TAG_VALUE)
+        listed_at_tag_value = set(self.state.get(LISTED_AT_TAG_VALUE, []))
+        if tag_value is None:
+            since = self.get_since()
+            if since is None:
+                return None
+            tag_value = since.strftime(TAG_TIME_FORMAT)
+        #tags only have second precision, so the query includes the high-water mark itself and the blobs the last
+        #run already listed at it are left out. Tag queries can't filter on the name, the prefix is applied here
+        blob_names = []
+        tag_values = {}
+        for blob in self.container_client.find_blobs_by_tags(f'"{BLOB_LISTING_TAG}" >= \'{tag_value}\'', results_per_page=BLOB_LISTING_PAGE_SIZE):
+            blob_tag_value = (blob.tags or {}).get(BLOB_LISTING_TAG, tag_value)
+            tag_values[blob.name] = blob_tag_value
+            if blob_tag_value == tag_value and blob.name in listed_at_tag_value:
+                continue
+            if self.prefix is None or blob.name.startswith(self.prefix):
+                blob_names.append(blob.name)
+        next_tag_value = max(tag_values.values(), default=tag_value)
+        self.next_state = {TAG_VALUE: next_tag_value, LISTED_AT_TAG_VALUE: sorted(blob_name for blob_name, blob_tag_value in tag_values.items() if blob_tag_value == next_tag_value)}
+        self.last_processed_time = None
+        return blob_names
@@ -0,0 +1,62 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+
+#queue the timer fills with one message per changed blob when UPLOAD_MODE is queue
+BLOB_INGESTION_QUEUE = 'blob-ingestion'
+#keep in step with extensions.queues.maxDequeueCount in host.json
+MAX_DEQUEUE_COUNT = int(os.environ.get('BLOB_QUEUE_MAX_DEQUEUE_COUNT', '5'))
+#keep in step with extensions.queues.batchSize in host.json
+BATCH_SIZE = int(os.environ.get('BLOB_QUEUE_BATCH_SIZE', '16'))
+
+PRODUCT_AREA = 'product_area'
+BLOB_NAME = 'blob_name'
+ETAG = 'etag'
+
+
+def create_blob_message(product_area:str, blob_name:str, etag:str):
+    return json.dumps({PRODUCT_AREA: product_area, BLOB_NAME: blob_name, ETAG: etag})
+
+
+def parse_blob_message(message_body:str):
+    message = json.loads(message_body)
+    if not message.get(PRODUCT_AREA) or not message.get(BLOB_NAME):
+        raise ValueError(f'Blob message is missing {PRODUCT_AREA} or {BLOB_NAME}: {message_body}')
+    return message
+
+
+class InProcessBlobQueue:
+    """
+    Stand-in for the storage queue when running locally without Azurite. set() matches func.Out so it can be
+    passed where the timer writes its messages, run() handles up to batch_size messages at once, retries failed
+    messages and moves them to poison_messages after MAX_DEQUEUE_COUNT attempts the same way the queue trigger does
+    """
+    def __init__(self, max_dequeue_count:int = MAX_DEQUEUE_COUNT, batch_size:int = BATCH_SIZE):
+        self.max_dequeue_count = max_dequeue_count
+        self.batch_size = batch_size
+        self.messages = deque()
+        self.poison_messages = []
+
+    def set(self, message_bodies:list):
+        self.messages.extend((message_body, 1) for message_body in message_bodies)
+
+    def run(self, handle_message):
+        processed_count = 0
+        with ThreadPoolExecutor(max_workers=self.batch_size) as executor:
+            while self.messages:
+                batch = [self.messages.popleft() for _ in range(min(self.batch_size, len(self.messages)))]
+                futures = [(executor.submit(handle_message, message_body), message_body, dequeue_count) for message_body, dequeue_count in batch]
+                for future, message_body, dequeue_count in futures:
+                    try:
+                        future.result()
+                        processed_count = processed_count + 1
+                    except Exception:
+                        logging.exception(f'Blob message failed on attempt {dequeue_count}: {message_body}')
+                        if dequeue_count >= self.max_dequeue_count:
+                            self.poison_messages.append(message_body)
+                        else:
+                            self.messages.append((message_body, dequeue_count + 1))
+        print(f'Processed {processed_count} blob messages, {len(self.poison_messages)} moved to poison')
+        return processed_count
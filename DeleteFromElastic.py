@@ -1,14 +1,32 @@
 import os
 import logging
+import time
 from datetime import datetime
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 from azure.storage.blob import ContainerClient
+from BlobListing import BlobListing
+from ElasticClient import get_elastic_client
+from ElasticIndexes import DYNAMIC_KEYWORD_MAX_LENGTH, has_exact_file_names
+from ProductAreaScheduler import run_for_product_areas
+from Telemetry import add, attributes, iterate, stage, BLOBS_CHANGED, BLOBS_LISTED, CHUNKS_DELETED, CHUNKS_UPDATED
 from datetime import timezone
 
-ELASTIC_CLOUD_ID = os.environ['ELASTIC_CLOUD_ID']
-ELASTIC_USERNAME = os.environ['ELASTIC_USERNAME']
-ELASTIC_PASSWORD = os.environ['ELASTIC_PASSWORD']
-AZURE_CONNECTION_STRING = os.environ['askmaddiknowledgeset_STORAGE']
+# server (update_by_query, default) or client (point in time search feeding _bulk)
+SOFT_DELETE_MODE = os.environ.get('SOFT_DELETE_MODE', 'server').lower()
+TASK_POLL_SECONDS = int(os.environ.get('TASK_POLL_SECONDS', '5'))
+# number of archived file names sent in each hard delete terms query
+HARD_DELETE_BATCH_SIZE = int(os.environ.get('HARD_DELETE_BATCH_SIZE', '1000'))
+# times a client side source removal is retried when an upload changed the chunk in between
+SOURCE_UPDATE_RETRY_ON_CONFLICT = int(os.environ.get('SOURCE_UPDATE_RETRY_ON_CONFLICT', '10'))
+
+# removes the matching file from metadata.source, deletes the chunk once no source is left
+REMOVE_SOURCE_SCRIPT = """
+List sources = ctx._source.metadata.source;
+if (sources == null) { ctx.op = 'noop'; return; }
+int before = sources.size();
+sources.removeIf(s -> params.search_text.equals(s.get('file_name')));
+if (sources.isEmpty()) { ctx.op = 'delete'; } else if (sources.size() == before) { ctx.op = 'noop'; }
+"""
 
 PRODUCT_AREAS = ['ATO', 'BillBlast', 'Docketing', 'Expert', 'Handshake', 'iTimekeep', 'Rainmaker', 'vibyaderant']
 PRODUCT_INDEXES = {
@@ -31,37 +49,120 @@ def ensure_timezone_aware(dt: datetime) -> datetime:
 
 def delete_from_elastic_by_source_filename(file_name_to_delete:str, index_name:str, elastic_client:Elasticsearch):
     logging.log(logging.INFO, f'Running delete by query on index {index_name} for metadata.source.file_name {file_name_to_delete}')
-    delete_query = {
-        "query_string": {
-            "default_field": "metadata.source.file_name", 
-            "query": f"\"{file_name_to_delete}\"",
-            "default_operator": "AND"
+    delete_query = source_filename_query(file_name_to_delete, has_exact_file_names(elastic_client, index_name))
+    logging.log(logging.INFO, f'Delete query: {delete_query}')
+    delete_response = elastic_client.delete_by_query(index=index_name, query=delete_query)
+    add(CHUNKS_DELETED, delete_response.body.get('deleted', 0))
+
+def delete_from_elastic_by_source_filenames(file_names_to_delete:list, index_name:str, elastic_client:Elasticsearch):
+    # exact matches on the keyword sub-field, sent as a few sliced background tasks instead of one synchronous query per file
+    if not has_exact_file_names(elastic_client, index_name):
+        # names the keyword sub-field of an index not on the index template left out are deleted one at a time
+        long_file_names = [file_name for file_name in file_names_to_delete if len(file_name) > DYNAMIC_KEYWORD_MAX_LENGTH]
+        for file_name in long_file_names:
+            delete_from_elastic_by_source_filename(file_name, index_name, elastic_client)
+        file_names_to_delete = [file_name for file_name in file_names_to_delete if len(file_name) <= DYNAMIC_KEYWORD_MAX_LENGTH]
+    task_ids = []
+    for x in range(0, len(file_names_to_delete), HARD_DELETE_BATCH_SIZE):
+        file_name_batch = file_names_to_delete[x:x+HARD_DELETE_BATCH_SIZE]
+        logging.log(logging.INFO, f'Running delete by query on index {index_name} for {len(file_name_batch)} metadata.source.file_name values')
+        task = elastic_client.delete_by_query(
+            index=index_name,
+            query={"terms": {"metadata.source.file_name.keyword": file_name_batch}},
+            conflicts='proceed',
+            slices='auto',
+            wait_for_completion=False
+        )
+        task_ids.append(task.body['task'])
+    total_deleted = 0
+    for i, task_id in enumerate(task_ids):
+        print(f'Waiting for delete task {i + 1} of {len(task_ids)} on index {index_name}')
+        total_deleted = total_deleted + wait_for_task(elastic_client, task_id).get('deleted', 0)
+    deleted_message = f'Deleted {total_deleted} chunks for {len(file_names_to_delete)} archived files from index {index_name}'
+    print(deleted_message)
+    logging.log(logging.INFO, deleted_message)
+
+def source_filename_query(search_text:str, exact_file_names:bool):
+    # exact match on the keyword sub-field of the index template (and of dynamic mappings) instead of a phrase query on the analysed text.
+    # Dynamic mappings leave names over 256 characters out of the keyword sub-field, on indexes not yet migrated to the
+    # template (exact_file_names false) those are still found with the phrase query
+    if exact_file_names or len(search_text) <= DYNAMIC_KEYWORD_MAX_LENGTH:
+        return {
+            "term": { "metadata.source.file_name.keyword": search_text }
         }
+    return {
+        "query_string": { "default_field": "metadata.source.file_name", "query": f"\"{search_text}\"", "default_operator": "AND" }
     }
-    logging.log(logging.INFO, f'Delete query: {delete_query}')
-    elastic_client.delete_by_query(index=index_name, query=delete_query)
+
+def wait_for_task(elastic_client:Elasticsearch, task_id:str):
+    """
+    Polls a task started with wait_for_completion=False, logging its progress until it finishes
+    """
+    while True:
+        task_response = elastic_client.tasks.get(task_id=task_id)
+        status = task_response.body['task'].get('status', {})
+        progress_message = f'Task {task_id}: {status.get("updated", 0)} updated, {status.get("deleted", 0)} deleted, {status.get("noops", 0)} unchanged of {status.get("total", 0)}'
+        logging.log(logging.INFO, progress_message)
+        if task_response.body.get('completed'):
+            print(progress_message)
+            if task_response.body.get('error'):
+                raise RuntimeError(f'Task {task_id} failed: {task_response.body["error"]}')
+            add(CHUNKS_DELETED, status.get('deleted', 0))
+            add(CHUNKS_UPDATED, status.get('updated', 0))
+            return task_response.body.get('response', {})
+        time.sleep(TASK_POLL_SECONDS)
 
 def update_or_remove_from_elastic(search_text:str, index_name:str, elastic_client:Elasticsearch):
-    search_size=100
+    if SOFT_DELETE_MODE == 'client':
+        update_or_remove_from_elastic_client_side(search_text, index_name, elastic_client)
+        return
+    logging.log(logging.INFO, f'Running update by query on index {index_name} for metadata.source.file_name {search_text}')
+    # one server side pass strips the file from every matching chunk instead of a delete or update call per chunk
+    task = elastic_client.update_by_query(
+        index=index_name,
+        query=source_filename_query(search_text, has_exact_file_names(elastic_client, index_name)),
+        script={'source': REMOVE_SOURCE_SCRIPT, 'lang': 'painless', 'params': {'search_text': search_text}},
+        conflicts='proceed',
+        slices='auto',
+        refresh=True,
+        wait_for_completion=False
+    )
+    wait_for_task(elastic_client, task.body['task'])
+
+def update_or_remove_from_elastic_client_side(search_text:str, index_name:str, elastic_client:Elasticsearch):
+    search_size=1000
     logging.log(logging.INFO, f'Searching elastic index {index_name} for metadata.source.file_name {search_text}')
-    search_response = elastic_client.search(index=index_name, size=search_size, query={
-        "query_string": { "default_field": "metadata.source.file_name", "query": f"\"{search_text}\"", "default_operator": "AND" }
-    })
-    search_results = search_response.body['hits']['hits']
-    for result in search_results:
-        existing_id_with_hash = result["_id"]
-        existing_source = result['_source']['metadata']['source']
-        for source in existing_source:
-            if search_text in source:
-                existing_source.remove(source)
-        if len(existing_source) <= 1:
-            logging.log(logging.INFO, f'Deleting chunk with id: {existing_id_with_hash}')
-            elastic_client.delete(index=index_name, id=existing_id_with_hash)
-        else:
-            update_script = {'source':"ctx._source.metadata.source = params.source", 'lang':'painless', 'params':{'source': existing_source}}
-            elastic_client.update(index=index_name, id=existing_id_with_hash, script=update_script)
-    if len(search_results) == search_size:
-        update_or_remove_from_elastic(search_text, index_name, elastic_client)
+    query = source_filename_query(search_text, has_exact_file_names(elastic_client, index_name))
+    # a point in time keeps paging stable while the chunks it has already returned are changed
+    pit_id = elastic_client.open_point_in_time(index=index_name, keep_alive='5m').body['id']
+    try:
+        search_after = None
+        while True:
+            search_response = elastic_client.search(size=search_size, query=query, pit={'id': pit_id, 'keep_alive': '5m'},
+                sort=['_shard_doc'], search_after=search_after, source=['metadata.source'])
+            search_results = search_response.body['hits']['hits']
+            if len(search_results) == 0:
+                break
+            pit_id = search_response.body.get('pit_id', pit_id)
+            search_after = search_results[-1]['sort']
+            bulk_actions = []
+            for result in search_results:
+                existing_id_with_hash = result["_id"]
+                existing_source = result['_source']['metadata']['source']
+                remaining_source = [source for source in existing_source if source.get('file_name') != search_text]
+                if len(remaining_source) == 0:
+                    logging.log(logging.INFO, f'Deleting chunk with id: {existing_id_with_hash}')
+                    bulk_actions.append({'_op_type': 'delete', '_index': index_name, '_id': existing_id_with_hash})
+                elif len(remaining_source) < len(existing_source):
+                    # removes the file from the list the chunk has when the update runs, not the one read here
+                    update_script = {'source': REMOVE_SOURCE_SCRIPT, 'lang': 'painless', 'params': {'search_text': search_text}}
+                    bulk_actions.append({'_op_type': 'update', '_index': index_name, '_id': existing_id_with_hash, 'retry_on_conflict': SOURCE_UPDATE_RETRY_ON_CONFLICT, 'script': update_script})
+            if len(bulk_actions) > 0:
+                helpers.bulk(elastic_client, bulk_actions)
+                add(CHUNKS_DELETED, sum(1 for action in bulk_actions if action['_op_type'] == 'delete'))
+                add(CHUNKS_UPDATED, sum(1 for action in bulk_actions if action['_op_type'] == 'update'))
+    finally:
+        elastic_client.close_point_in_time(id=pit_id)
 
 def delete_by_search_text(search_text:str, index_name:str, es_connection:Elasticsearch, hard_delete:bool):
     if search_text is None or search_text == '':
@@ -82,11 +183,14 @@ def delete_by_azure_container(date_to_process_from: datetime, hard_delete:bool,
     prefix = f'{product_area}/Archive/'
     
     container_client = ContainerClient.from_connection_string(
-        conn_str=AZURE_CONNECTION_STRING,
+        conn_str=os.environ['askmaddiknowledgeset_STORAGE'],
         container_name=container_name
     )
     
-    blobs = container_client.list_blobs(name_starts_with=prefix)
+    # with BLOB_LISTING set only the files archived since the last delete run for this index are listed
+    blob_listing = BlobListing(container_client, os.environ['askmaddiknowledgeset_STORAGE'], prefix, date_to_process_from, f'delete/{index_name}/{container_name}/{prefix}')
+    blobs = iterate('list', blob_listing.list_blobs(), BLOBS_LISTED)
+    date_to_process_from = blob_listing.last_processed_time
     blobs_list = sorted(
         [blob for blob in blobs], 
         key=lambda x: x.last_modified,
@@ -95,25 +199,35 @@ def delete_by_azure_container(date_to_process_from: datetime, hard_delete:bool,
     
     if len(blobs_list) == 0:
         print(f'No files found in container {container_name} with prefix {prefix}')
+        blob_listing.commit()
         return
         
+    full_blob_paths = []
     for blob in blobs_list:
         # Azure blob's last_modified is already timezone-aware (UTC)
-        if blob.last_modified > date_to_process_from:
-            print(f'Deleting using {blob.name} as search text')
-            full_blob_path = f"{container_name}/{blob.name}"
-            delete_by_search_text(full_blob_path, index_name, es_connection, hard_delete)
+        if date_to_process_from is None or blob.last_modified > date_to_process_from:
+            full_blob_paths.append(f"{container_name}/{blob.name}")
         else:
             print('Finished processing files modified after: ' + date_to_process_from.strftime('%Y-%m-%d %H:%M:%S %Z'))
             break
 
+    add(BLOBS_CHANGED, len(full_blob_paths))
+    if hard_delete:
+        if len(full_blob_paths) > 0:
+            delete_from_elastic_by_source_filenames(full_blob_paths, index_name, es_connection)
+    else:
+        for full_blob_path in full_blob_paths:
+            print(f'Deleting using {full_blob_path} as search text')
+            delete_by_search_text(full_blob_path, index_name, es_connection, hard_delete)
+    blob_listing.commit()
+
 def run_delete(index_to_delete_from:str, hard_delete:bool, product_area:str, last_modified_date:datetime):
-    elastic_cloud_id = os.environ['ELASTIC_CLOUD_ID']
-    elastic_basic_auth = [os.environ['ELASTIC_USERNAME'], os.environ['ELASTIC_PASSWORD']]    
-    logging.log(logging.INFO, f'elastic_cloud_id: [{elastic_cloud_id}]\telastic_basic_auth: [{str(elastic_basic_auth)}]')
+    logging.log(logging.INFO, f'elastic_cloud_id: [{os.environ.get("ELASTIC_CLOUD_ID", os.environ.get("ELASTIC_URL"))}]')
     logging.log(logging.INFO, f'attempting to delete from index_name: [{index_to_delete_from}]')
-    es_connection = Elasticsearch(cloud_id=elastic_cloud_id, basic_auth=elastic_basic_auth)
-    delete_by_azure_container(last_modified_date, hard_delete, index_to_delete_from, es_connection, product_area)
+    #reuse the worker's client instead of opening new connections for every index
+    es_connection = get_elastic_client()
+    with attributes(product_area=product_area, index=index_to_delete_from), stage('delete', hard_delete=hard_delete):
+        delete_by_azure_container(last_modified_date, hard_delete, index_to_delete_from, es_connection, product_area)
 
 def validate_delete_run(product_area: str):
     if product_area not in PRODUCT_AREAS:
@@ -123,24 +237,27 @@ def validate_delete_run(product_area: str):
     else:
         return True
 
+def run_delete_for_product_area(product_area:str, last_modified_date:datetime, hard_delete:bool):
+    product_area_message = f'Running delete for product area: {product_area}'
+    print(product_area_message)
+    logging.log(logging.INFO, product_area_message)
+    
+    for product_index in PRODUCT_INDEXES[product_area]:
+        product_index_message = f'Running delete for index: {product_index}'
+        print(product_index_message)
+        logging.log(logging.INFO, product_index_message)
+        
+        run_delete(
+            index_to_delete_from=product_index,
+            hard_delete=hard_delete,
+            product_area=product_area,
+            last_modified_date=last_modified_date
+        )
+
 def run_delete_for_all_product_areas(last_modified_date:datetime, hard_delete:bool):
     logging.log(logging.INFO, 'Running delete for all product areas')
-    for product_area in PRODUCT_AREAS:
-        product_area_message = f'Running delete for product area: {product_area}'
-        print(product_area_message)
-        logging.log(logging.INFO, product_area_message)
-        
-        for product_index in PRODUCT_INDEXES[product_area]:
-            product_index_message = f'Running delete for index: {product_index}'
-            print(product_index_message)
-            logging.log(logging.INFO, product_index_message)
-            
-            run_delete(
-                index_to_delete_from=product_index,
-                hard_delete=hard_delete,
-                product_area=product_area,
-                last_modified_date=last_modified_date
-            )
+    # product areas run concurrently, one failing doesn't stop the others
+    return run_for_product_areas('Delete from elastic', PRODUCT_AREAS, lambda product_area: run_delete_for_product_area(product_area, last_modified_date, hard_delete))
 
 def single_delete_run(product_area:str, hard_delete:bool, last_modified_date:datetime):    
     if validate_delete_run(product_area):
@@ -0,0 +1,75 @@
+import importlib
+import logging
+import os
+
+#bump when a loader changes what it returns so cached parse results aren't reused
+LOADER_VERSION = '1'
+#settings read by the loaders that change what they return, they are part of the loader version too
+LOADER_SETTINGS = ['EXCEL_ROWS_PER_DOCUMENT']
+
+EXTENSION = 'extension'
+NAME_CONTAINS = 'name_contains'
+MODULE = 'module'
+FUNCTION = 'function'
+SOURCE = 'source'
+
+#loaders by file type, a loader's module (and the parser it uses) is only imported the first time a file needs it
+#the first entry whose extension matches and whose name_contains (if set) is in the file name is used
+DOCUMENT_LOADERS = []
+#everything without a matching loader goes through Unstructured
+DEFAULT_LOADER = {MODULE: 'DocumentLoaders', FUNCTION: 'load_unstructured_document'}
+
+
+def register_loader(extension:str, module_name:str, function_name:str, name_contains:str = None):
+    DOCUMENT_LOADERS.append({EXTENSION: extension.lower(), NAME_CONTAINS: name_contains, MODULE: module_name, FUNCTION: function_name})
+
+
+register_loader('.json', 'JsonLoader', 'load_json_file')
+register_loader('.ndjson', 'JsonLoader', 'load_ndjson_file')
+register_loader('.jsonl', 'JsonLoader', 'load_ndjson_file')
+register_loader('.xlsx', 'ExcelLoader', 'load_excel_document', name_contains='Resolved Issues in Updates')
+
+
+def find_loader(full_file_name:str):
+    file_extension_lower = os.path.splitext(full_file_name)[1].lower()
+    for loader in DOCUMENT_LOADERS:
+        if loader[EXTENSION] != file_extension_lower:
+            continue
+        if loader[NAME_CONTAINS] is not None and loader[NAME_CONTAINS].casefold() not in full_file_name.casefold():
+            continue
+        return loader
+    return DEFAULT_LOADER
+
+
+def get_document_loader(full_file_name:str):
+    #returns the function that loads full_file_name into a list of documents
+    #every loader takes the file name and optionally file=, the content as a binary stream, so it can parse from memory
+    loader = find_loader(full_file_name)
+    return getattr(importlib.import_module(loader[MODULE]), loader[FUNCTION])
+
+
+def get_loader_version():
+    return '-'.join([LOADER_VERSION] + [f'{setting}={os.environ.get(setting, "")}' for setting in LOADER_SETTINGS])
+
+
+def load_unstructured_document(full_file_name:str, file = None):
+    #importing Unstructured loads its layout/OCR stack, only pay for it when a file needs it
+    import langchain.document_loaders
+    loaded_document = []
+    # if file_extension_lower == '.pdf':
+    #     document_loader = langchain.document_loaders.PyPDFLoader(full_file_name)
+    if file is None:
+        document_loader = langchain.document_loaders.UnstructuredFileLoader(full_file_name)
+    else:
+        #metadata_filename lets Unstructured detect the file type from the name like it does for files on disk
+        document_loader = langchain.document_loaders.UnstructuredFileIOLoader(file, metadata_filename=full_file_name)
+    try:
+        loaded_document = document_loader.load()
+        #the stream loader doesn't know where the content came from
+        for document in loaded_document:
+            document.metadata.setdefault(SOURCE, full_file_name)
+    except Exception as e:
+        print("Unable to load file: " + full_file_name + 'with error: ' + str(e))
+        logging.exception("Unable to load file: " + full_file_name)
+
+    return loaded_document
@@ -0,0 +1,37 @@
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
+#size of the http connection pool per elastic node, should cover the upload and delete concurrency settings
+ELASTIC_CONNECTIONS_PER_NODE = int(os.environ.get('ELASTIC_CONNECTIONS_PER_NODE', '16'))
+
+_elastic_client = None
+_elastic_client_lock = threading.Lock()
+
+
+def get_elastic_client() -> 'Elasticsearch':
+    """
+    Returns the worker's shared Elasticsearch client. It is created on first use and then reused by every
+    index, product area and trigger invocation in the same worker so connections are only set up once
+    """
+    global _elastic_client
+    with _elastic_client_lock:
+        if _elastic_client is None:
+            from elasticsearch import Elasticsearch
+            logging.log(logging.INFO, f'Creating elastic client with {ELASTIC_CONNECTIONS_PER_NODE} connections per node')
+            elastic_url = os.environ.get('ELASTIC_URL')
+            if elastic_url:
+                #a self-managed or local cluster (e.g. the offline benchmarks) instead of Elastic Cloud, credentials are optional
+                basic_auth = [os.environ['ELASTIC_USERNAME'], os.environ['ELASTIC_PASSWORD']] if os.environ.get('ELASTIC_USERNAME') else None
+                _elastic_client = Elasticsearch(elastic_url, basic_auth=basic_auth, connections_per_node=ELASTIC_CONNECTIONS_PER_NODE)
+            else:
+                _elastic_client = Elasticsearch(
+                    cloud_id=os.environ['ELASTIC_CLOUD_ID'],
+                    basic_auth=[os.environ['ELASTIC_USERNAME'], os.environ['ELASTIC_PASSWORD']],
+                    connections_per_node=ELASTIC_CONNECTIONS_PER_NODE
+                )
+    return _elastic_client
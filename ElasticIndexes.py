@@ -0,0 +1,260 @@
+#annotations are only evaluated by type checkers, so the elasticsearch client type can be named without importing it at startup
+from __future__ import annotations
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
+#put an index template for every product index and create missing indexes from it, false leaves index creation to langchain
+MANAGE_INDEX_TEMPLATES = os.environ.get('MANAGE_INDEX_TEMPLATES', 'true').lower() == 'true'
+#dense_vector index_options type: int8_hnsw (default, a quarter of the memory of float vectors), int4_hnsw, bbq_hnsw, hnsw or a flat type
+ELASTIC_VECTOR_INDEX_TYPE = os.environ.get('ELASTIC_VECTOR_INDEX_TYPE', 'int8_hnsw').lower()
+#graph connections per vector and candidates considered while building the graph, higher gives better recall for slower indexing
+ELASTIC_HNSW_M = int(os.environ.get('ELASTIC_HNSW_M', '16'))
+ELASTIC_HNSW_EF_CONSTRUCTION = int(os.environ.get('ELASTIC_HNSW_EF_CONSTRUCTION', '100'))
+#must match the distance strategy of the ElasticsearchStore that queries the index, cosine is its default
+ELASTIC_VECTOR_SIMILARITY = os.environ.get('ELASTIC_VECTOR_SIMILARITY', 'cosine').lower()
+#auto (clusters from 9.2 on), true or false. Vectors are left out of _source with the index.mapping.exclude_source_vectors
+#setting, not _source excludes, because the source merges and soft deletes update chunks by script and an update
+#rebuilds the document from _source, which would drop a vector excluded that way
+ELASTIC_EXCLUDE_SOURCE_VECTORS = os.environ.get('ELASTIC_EXCLUDE_SOURCE_VECTORS', 'auto').lower()
+ELASTIC_INDEX_TEMPLATE_PRIORITY = int(os.environ.get('ELASTIC_INDEX_TEMPLATE_PRIORITY', '200'))
+TASK_POLL_SECONDS = int(os.environ.get('TASK_POLL_SECONDS', '5'))
+
+#the fields ElasticsearchStore and UploadToElastic.upload_to_elastic write
+TEXT_FIELD = 'text'
+VECTOR_FIELD = 'vector'
+TEMPLATE_OWNER = 'askmaddi-ingestion'
+#file names are container_name/blob_name, longer than the 256 characters dynamic keyword mappings keep
+FILE_NAME_MAX_LENGTH = 1024
+DYNAMIC_KEYWORD_MAX_LENGTH = 256
+
+_ensured_indexes = set()
+#indexes found with the template's file_name keyword mapping, an index keeps it once it has it
+_exact_file_name_indexes = set()
+_ensured_indexes_lock = threading.Lock()
+
+
+def index_template_name(index_name:str):
+    return f'{TEMPLATE_OWNER}-{index_name}'
+
+
+def get_cluster_version(elastic_client:Elasticsearch):
+    version_number = elastic_client.info().body['version']['number']
+    return tuple(int(part) for part in version_number.split('-')[0].split('.')[:2])
+
+
+def exclude_source_vectors(elastic_client:Elasticsearch):
+    if ELASTIC_EXCLUDE_SOURCE_VECTORS == 'auto':
+        return get_cluster_version(elastic_client) >= (9, 2)
+    return ELASTIC_EXCLUDE_SOURCE_VECTORS == 'true'
+
+
+def vector_index_options():
+    index_options = {'type': ELASTIC_VECTOR_INDEX_TYPE}
+    if ELASTIC_VECTOR_INDEX_TYPE.endswith('hnsw'):
+        index_options['m'] = ELASTIC_HNSW_M
+        index_options['ef_construction'] = ELASTIC_HNSW_EF_CONSTRUCTION
+    return index_options
+
+
+def create_index_template(index_name:str, exclude_vectors:bool):
+    """
+    Template for index_name and the versioned indexes migrate_index creates for it (index_name-*).
+    The lookup fields keep the text field dynamic mapping would give them plus a keyword sub-field, so the
+    .keyword queries work the same on indexes created before the template. dims is set by the first chunk indexed
+    """
+    settings = {'index.mapping.exclude_source_vectors': True} if exclude_vectors else {}
+    return {
+        'index_patterns': [index_name, f'{index_name}-*'],
+        'priority': ELASTIC_INDEX_TEMPLATE_PRIORITY,
+        'template': {
+            'settings': settings,
+            'mappings': {
+                'properties': {
+                    TEXT_FIELD: {'type': 'text'},
+                    VECTOR_FIELD: {'type': 'dense_vector', 'index': True, 'similarity': ELASTIC_VECTOR_SIMILARITY, 'index_options': vector_index_options()},
+                    'metadata': {
+                        'properties': {
+                            'md5HexHash': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}},
+                            'source': {
+                                'properties': {
+                                    'file_name': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': FILE_NAME_MAX_LENGTH}}},
+                                    'page': {'type': 'long'},
+                                    'application': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        'meta': {'managed_by': TEMPLATE_OWNER}
+    }
+
+
+def put_index_templates(elastic_client:Elasticsearch, index_names:list):
+    exclude_vectors = exclude_source_vectors(elastic_client)
+    for index_name in index_names:
+        elastic_client.indices.put_index_template(name=index_template_name(index_name), **create_index_template(index_name, exclude_vectors))
+        logging.log(logging.INFO, f'Put index template {index_template_name(index_name)} ({ELASTIC_VECTOR_INDEX_TYPE}, exclude source vectors: {exclude_vectors})')
+
+
+def get_mapping_properties(elastic_client:Elasticsearch, index_name:str):
+    #of the index an alias points to when index_name is one
+    for index_mapping in elastic_client.indices.get_mapping(index=index_name).body.values():
+        return index_mapping.get('mappings', {}).get('properties', {})
+    return {}
+
+
+def get_vector_index_type(properties:dict):
+    #None when the index has no vectors yet
+    vector_mapping = properties.get(VECTOR_FIELD)
+    if vector_mapping is not None:
+        return vector_mapping.get('index_options', {}).get('type')
+    return None
+
+
+def get_file_name_keyword_length(properties:dict):
+    #ignore_above of metadata.source.file_name.keyword, longer file names are left out of it. None without the field
+    file_name_mapping = properties.get('metadata', {}).get('properties', {}).get('source', {}).get('properties', {}).get('file_name', {})
+    keyword_mapping = file_name_mapping.get('fields', {}).get('keyword')
+    if keyword_mapping is None:
+        return None
+    return keyword_mapping.get('ignore_above', DYNAMIC_KEYWORD_MAX_LENGTH)
+
+
+def has_exact_file_names(elastic_client:Elasticsearch, index_name:str):
+    """
+    Whether term queries on metadata.source.file_name.keyword find every file name in the index, true for indexes
+    created from or migrated to the index template. Other indexes leave names over 256 characters out of it.
+    Only reads the mapping, an index that doesn't exist (yet) has nothing to find and isn't created here
+    """
+    if index_name in _exact_file_name_indexes:
+        return True
+    from elasticsearch import NotFoundError
+    try:
+        properties = get_mapping_properties(elastic_client, index_name)
+    except NotFoundError:
+        return False
+    if (get_file_name_keyword_length(properties) or 0) >= FILE_NAME_MAX_LENGTH:
+        _exact_file_name_indexes.add(index_name)
+        return True
+    return False
+
+
+def create_index(elastic_client:Elasticsearch, index_name:str, mappings:dict = None):
+    from elasticsearch import BadRequestError
+    try:
+        elastic_client.indices.create(index=index_name, mappings=mappings)
+        return True
+    except BadRequestError as e:
+        #created by another worker in the meantime
+        if e.error != 'resource_already_exists_exception':
+            raise
+        return False
+
+
+def ensure_index(elastic_client:Elasticsearch, index_name:str, dims_length:int = None):
+    """
+    Puts the index's template and creates the index from it when it doesn't exist yet, once per worker.
+    An existing index keeps its mappings, a warning is logged when its vectors aren't indexed as configured.
+    Without managed templates a missing index is created with the mapping ElasticsearchStore would give it
+    """
+    if index_name in _ensured_indexes:
+        return
+    with _ensured_indexes_lock:
+        if index_name in _ensured_indexes:
+            return
+        if not MANAGE_INDEX_TEMPLATES:
+            if not elastic_client.indices.exists(index=index_name):
+                vector_mapping = {'type': 'dense_vector', 'index': True, 'similarity': ELASTIC_VECTOR_SIMILARITY}
+                if dims_length is not None:
+                    vector_mapping['dims'] = dims_length
+                create_index(elastic_client, index_name, {'properties': {VECTOR_FIELD: vector_mapping}})
+            _ensured_indexes.add(index_name)
+            return
+        put_index_templates(elastic_client, [index_name])
+        if not elastic_client.indices.exists(index=index_name) and create_index(elastic_client, index_name):
+            print(f'Created index {index_name} from its index template')
+        properties = get_mapping_properties(elastic_client, index_name)
+        vector_index_type = get_vector_index_type(properties)
+        if vector_index_type is not None and vector_index_type != ELASTIC_VECTOR_INDEX_TYPE:
+            logging.log(logging.WARNING, f'Index {index_name} indexes vectors as {vector_index_type} instead of {ELASTIC_VECTOR_INDEX_TYPE}, run python ElasticIndexes.py migrate {index_name} to move it to the index template')
+        if (get_file_name_keyword_length(properties) or 0) >= FILE_NAME_MAX_LENGTH:
+            _exact_file_name_indexes.add(index_name)
+        _ensured_indexes.add(index_name)
+
+
+def wait_for_reindex(elastic_client:Elasticsearch, task_id:str):
+    while True:
+        task_response = elastic_client.tasks.get(task_id=task_id)
+        status = task_response.body['task'].get('status', {})
+        logging.log(logging.INFO, f'Task {task_id}: {status.get("created", 0) + status.get("updated", 0)} of {status.get("total", 0)} chunks copied')
+        if task_response.body.get('completed'):
+            response = task_response.body.get('response', {})
+            if task_response.body.get('error') or response.get('failures'):
+                raise RuntimeError(f'Task {task_id} failed: {task_response.body.get("error") or response["failures"]}')
+            return response
+        time.sleep(TASK_POLL_SECONDS)
+
+
+def migrate_index(elastic_client:Elasticsearch, index_name:str):
+    """
+    Moves index_name onto its index template: copies its chunks into a new index_name-<timestamp> index created
+    from the template, then makes index_name an alias of the new index and deletes the old one in one atomic
+    alias update, so searches never see a missing index. The old index is write blocked while the chunks are
+    copied, uploads and deletes that run meanwhile fail and are picked up again by the next run
+    """
+    from elasticsearch import NotFoundError
+    try:
+        old_index = next(iter(elastic_client.indices.get_alias(name=index_name).body))
+    except NotFoundError:
+        old_index = index_name
+    new_index = f'{index_name}-{datetime.now().strftime("%Y%m%d%H%M%S")}'
+    put_index_templates(elastic_client, [index_name])
+    print(f'Migrating {old_index} to {new_index}')
+    elastic_client.indices.add_block(index=old_index, block='write')
+    try:
+        elastic_client.indices.create(index=new_index)
+        task = elastic_client.reindex(source={'index': old_index}, dest={'index': new_index}, slices='auto', wait_for_completion=False)
+        wait_for_reindex(elastic_client, task.body['task'])
+        elastic_client.indices.refresh(index=new_index)
+        old_count = elastic_client.count(index=old_index).body['count']
+        new_count = elastic_client.count(index=new_index).body['count']
+        if new_count != old_count:
+            raise RuntimeError(f'{new_index} has {new_count} chunks after reindexing, {old_index} has {old_count}')
+        elastic_client.indices.update_aliases(actions=[{'add': {'index': new_index, 'alias': index_name}}, {'remove_index': {'index': old_index}}])
+    except Exception:
+        #the old index stays in place and writable
+        elastic_client.indices.delete(index=new_index, ignore_unavailable=True)
+        elastic_client.indices.put_settings(index=old_index, settings={'index.blocks.write': False})
+        raise
+    migrated_message = f'Migrated {new_count} chunks from {old_index} to {new_index}, {index_name} is now an alias of {new_index}'
+    print(migrated_message)
+    logging.log(logging.INFO, migrated_message)
+    return new_index
+
+
+if __name__ == '__main__':
+    import argparse
+    from ElasticClient import get_elastic_client
+    from UploadToElastic import PRODUCT_INDEXES
+    product_index_names = [index_name for index_names in PRODUCT_INDEXES.values() for index_name in index_names]
+    parser = argparse.ArgumentParser(description='Manage the index templates of the product indexes')
+    parser.add_argument('command', choices=['templates', 'migrate'], help='templates puts the index templates, migrate also moves existing indexes onto them')
+    parser.add_argument('index_names', nargs='*', default=product_index_names, help='defaults to every index in PRODUCT_INDEXES')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    put_index_templates(get_elastic_client(), args.index_names)
+    if args.command == 'migrate':
+        for index_name in args.index_names:
+            if not get_elastic_client().indices.exists(index=index_name):
+                print(f'Index {index_name} does not exist yet, it is created from its template by the next upload')
+                continue
+            migrate_index(get_elastic_client(), index_name)
@@ -0,0 +1,176 @@
+from array import array
+from azure.core.exceptions import ResourceNotFoundError
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from langchain_core.embeddings import Embeddings
+import logging
+import os
+from StorageBackends import BlobStore, SqliteStore, WorkerSingleton, local_cache_max_bytes, log_cache_size
+import tempfile
+import time
+
+#none (default), sqlite or blob. set EMBEDDING_CACHE=sqlite to keep vectors in a local file on the worker,
+#or blob to share them between workers through EMBEDDING_CACHE_CONTAINER
+EMBEDDING_CACHE = os.environ.get('EMBEDDING_CACHE', 'none').lower()
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'embedding_cache.sqlite'))
+#least recently used vectors are removed once the local cache holds more than this many bytes,
+#unset uses a tenth of the free space in the cache's directory up to 256MB
+EMBEDDING_CACHE_MAX_BYTES = os.environ.get('EMBEDDING_CACHE_MAX_BYTES', '')
+EMBEDDING_CACHE_CONTAINER = os.environ.get('EMBEDDING_CACHE_CONTAINER', 'embedding-cache')
+
+
+def md5_hex_hash(text:str):
+    #same hash update_metadata stores as md5HexHash
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def vector_to_bytes(vector:list):
+    return array('f', vector).tobytes()
+
+
+def bytes_to_vector(data:bytes):
+    vector = array('f')
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class SqliteEmbeddingCache(SqliteStore):
+    """
+    Local on-disk cache of embedding vectors with least recently used eviction by total size
+    """
+    def __init__(self, path:str = EMBEDDING_CACHE_PATH, max_bytes:int = None):
+        super().__init__(path, ['CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)',
+                                'CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)'])
+        self.max_bytes = max_bytes if max_bytes is not None else local_cache_max_bytes(path, EMBEDDING_CACHE_MAX_BYTES)
+        entry_count, total_size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()
+        log_cache_size('Embedding cache', path, entry_count, total_size, self.max_bytes)
+
+    def get_many(self, keys:list):
+        found = {}
+        with self.lock:
+            #stay well below sqlite's limit on query parameters
+            for x in range(0, len(keys), 500):
+                key_batch = keys[x:x+500]
+                placeholders = ','.join('?' * len(key_batch))
+                rows = self.connection.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', key_batch).fetchall()
+                found.update({key: bytes_to_vector(vector) for key, vector in rows})
+            if found:
+                now = time.time()
+                self.connection.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+                self.connection.commit()
+        return found
+
+    def set_many(self, vectors_by_key:dict):
+        if not vectors_by_key:
+            return
+        with self.lock:
+            now = time.time()
+            self.connection.executemany('INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)', [(key, vector_to_bytes(vector), now) for key, vector in vectors_by_key.items()])
+            total_size = self.connection.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()[0]
+            if total_size > self.max_bytes:
+                evict_keys = []
+                for evict_key, size in self.connection.execute('SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used'):
+                    if total_size <= self.max_bytes:
+                        break
+                    evict_keys.append((evict_key,))
+                    total_size = total_size - size
+                self.connection.executemany('DELETE FROM embeddings WHERE key = ?', evict_keys)
+                logging.log(logging.INFO, f'Evicted {len(evict_keys)} vectors from embedding cache')
+            self.connection.commit()
+
+
+class BlobEmbeddingCache(BlobStore):
+    """
+    Embedding cache shared between workers, one blob per vector
+    """
+    def __init__(self, connection_string:str, container_name:str = EMBEDDING_CACHE_CONTAINER, max_concurrency:int = 8):
+        super().__init__(connection_string, container_name)
+        self.max_concurrency = max_concurrency
+
+    def get_one(self, key:str):
+        try:
+            return key, bytes_to_vector(self.container_client.download_blob(key).readall())
+        except ResourceNotFoundError:
+            return key, None
+
+    def get_many(self, keys:list):
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return {key: vector for key, vector in pool.map(self.get_one, keys) if vector is not None}
+
+    def set_one(self, key:str, vector:list):
+        self.container_client.upload_blob(key, vector_to_bytes(vector), overwrite=True)
+
+    def set_many(self, vectors_by_key:dict):
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            list(pool.map(self.set_one, vectors_by_key.keys(), vectors_by_key.values()))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings client so chunks whose text was embedded before reuse the stored vector.
+    Keys are model/deployment/md5HexHash so changing either one never returns stale vectors
+    """
+    def __init__(self, embedding:Embeddings, cache, namespace:str):
+        self.embedding = embedding
+        self.cache = cache
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text:str):
+        return f'{self.namespace}/{md5_hex_hash(text)}'
+
+    def get_cached_vectors(self, texts:list[str]):
+        #the stored vector of every text, None for texts that haven't been embedded before
+        keys = [self.key(text) for text in texts]
+        vectors_by_key = self.cache.get_many(list(set(keys)))
+        self.hits = self.hits + sum(1 for key in keys if key in vectors_by_key)
+        self.misses = self.misses + len(set(keys) - vectors_by_key.keys())
+        return [vectors_by_key.get(key) for key in keys]
+
+    def cache_vectors(self, vectors_by_text:dict):
+        self.cache.set_many({self.key(text): vector for text, vector in vectors_by_text.items()})
+
+    def embed_with(self, texts:list[str], embed_missing) -> list[list[float]]:
+        #vectors of texts in the same order, embed_missing(texts) embeds the ones the cache doesn't have yet
+        vectors = self.get_cached_vectors(texts)
+        #identical texts in the same call are only embedded once
+        missing_texts = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing_texts:
+            new_vectors = dict(zip(missing_texts, embed_missing(missing_texts)))
+            self.cache_vectors(new_vectors)
+            vectors = [vector if vector is not None else new_vectors[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_documents(self, texts:list[str]) -> list[list[float]]:
+        return self.embed_with(texts, self.embedding.embed_documents)
+
+    def embed_query(self, text:str) -> list[float]:
+        return self.embedding.embed_query(text)
+
+    def log_stats(self):
+        stats_message = f'Embedding cache hits: {self.hits}, misses: {self.misses}'
+        print(stats_message)
+        logging.log(logging.INFO, stats_message)
+
+
+def create_embedding_cache(connection_string:str):
+    if EMBEDDING_CACHE == 'none':
+        return None
+    if EMBEDDING_CACHE == 'blob':
+        return BlobEmbeddingCache(connection_string)
+    return SqliteEmbeddingCache()
+
+
+_embedding_cache = WorkerSingleton(create_embedding_cache)
+
+
+def get_embedding_cache(connection_string:str):
+    return _embedding_cache.get(connection_string)
+
+
+def with_embedding_cache(embedding:Embeddings, namespace:str, connection_string:str):
+    cache = get_embedding_cache(connection_string)
+    if cache is None:
+        return embedding
+    return CachedEmbeddings(embedding, cache, namespace)
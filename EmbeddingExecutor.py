@@ -0,0 +1,212 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+import os
+import threading
+import time
+from Telemetry import add, RETRIES, THROTTLED, TOKENS
+from Tokenizer import count_text_tokens
+
+#number of embedding requests kept in flight at the same time
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', '4'))
+#provisioned quota of the embedding deployment, 0 means no limit
+EMBEDDING_TPM_LIMIT = int(os.environ.get('EMBEDDING_TPM_LIMIT', '0'))
+EMBEDDING_RPM_LIMIT = int(os.environ.get('EMBEDDING_RPM_LIMIT', '0'))
+#number of texts sent per embedding request to start with, grows while requests succeed and halves on 429/413
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '16'))
+#most inputs the embedding deployment accepts in one request
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get('EMBEDDING_MAX_BATCH_SIZE', '2048'))
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', '6'))
+#most tokens packed into one embedding request, the API rejects requests over 300k tokens and smaller requests
+#spread more evenly over the TPM quota
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get('EMBEDDING_BATCH_MAX_TOKENS', '100000'))
+
+
+class TokenBucket:
+    """
+    Allows up to per_minute units a minute, refilled continuously
+    """
+    def __init__(self, per_minute:int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until_available(self, amount:int):
+        #a request bigger than the whole bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        self.refill()
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount:int):
+        self.tokens = self.tokens - min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Request and token limits for the embedding deployment, shared by every thread in the worker.
+    pause holds back all requests, used when the service answers with Retry-After
+    """
+    def __init__(self, requests_per_minute:int = EMBEDDING_RPM_LIMIT, tokens_per_minute:int = EMBEDDING_TPM_LIMIT):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, token_count:int):
+        while True:
+            with self.lock:
+                wait_seconds = self.paused_until - time.monotonic()
+                if self.request_bucket is not None:
+                    wait_seconds = max(wait_seconds, self.request_bucket.seconds_until_available(1))
+                if self.token_bucket is not None:
+                    wait_seconds = max(wait_seconds, self.token_bucket.seconds_until_available(token_count))
+                if wait_seconds <= 0:
+                    if self.request_bucket is not None:
+                        self.request_bucket.take(1)
+                    if self.token_bucket is not None:
+                        self.token_bucket.take(token_count)
+                    return
+            time.sleep(wait_seconds)
+
+    def pause(self, seconds:float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    #one limiter per worker process so concurrent runs share the same quota
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+    return _rate_limiter
+
+
+def get_status_code(e:Exception):
+    return getattr(e, 'status_code', None) or getattr(getattr(e, 'response', None), 'status_code', None)
+
+
+def is_rate_limited_or_too_large(e:Exception):
+    status_code = get_status_code(e)
+    #older Azure deployments reject large batches with a 400 (Too many inputs. The max number of inputs is 16.)
+    return status_code in (413, 429) or 'Too many inputs' in str(e)
+
+
+def get_retry_after(e:Exception):
+    headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers.get('retry-after-ms')) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers.get('retry-after'))
+    except ValueError:
+        pass
+    return None
+
+
+def embed_batch(embedding, texts:list, token_count:int, rate_limiter:RateLimiter):
+    rate_limiter.acquire(token_count)
+    return embedding.embed_documents(texts)
+
+
+def get_batch_end(token_counts:list, start:int, batch_size:int, max_tokens:int = EMBEDDING_BATCH_MAX_TOKENS):
+    #the batch starting at start holds up to batch_size texts and max_tokens tokens, and always at least one text
+    end = start
+    batch_tokens = 0
+    while end < len(token_counts) and end - start < batch_size:
+        if end > start and batch_tokens + token_counts[end] > max_tokens:
+            break
+        batch_tokens = batch_tokens + token_counts[end]
+        end = end + 1
+    return end
+
+
+def count_embedding_requests(token_counts:list):
+    #requests embed_texts would send for texts with these token counts if none were throttled, for planning runs
+    #like embed_texts, EMBEDDING_CONCURRENCY batches are sent before the first one finishes and can grow the batch size
+    batch_size = _embedding_batch_size
+    requests = 0
+    position = 0
+    in_flight = deque()
+    while position < len(token_counts) or in_flight:
+        while len(in_flight) < EMBEDDING_CONCURRENCY and position < len(token_counts):
+            end = get_batch_end(token_counts, position, batch_size)
+            in_flight.append(end - position)
+            position = end
+            requests = requests + 1
+        if in_flight.popleft() == batch_size:
+            batch_size = min(EMBEDDING_MAX_BATCH_SIZE, batch_size * 2)
+    return requests
+
+
+#embedding batch size learned from earlier requests, shared by every call in the worker
+_embedding_batch_size = EMBEDDING_BATCH_SIZE
+
+
+def embed_texts(embedding, texts:list):
+    #vectors of texts in the same order. With an embedding cache the texts it already has are looked up first and only
+    #the others are sent, so cache hits never wait on or use up the rate limits and don't grow the batch size
+    from EmbeddingCache import CachedEmbeddings
+    if not isinstance(embedding, CachedEmbeddings):
+        return embed_texts_with_requests(embedding, texts)
+    return embedding.embed_with(texts, lambda missing_texts: embed_texts_with_requests(embedding.embedding, missing_texts))
+
+
+def embed_texts_with_requests(embedding, texts:list):
+    #embeds texts with up to EMBEDDING_CONCURRENCY requests in flight, vectors are returned in the same order as texts
+    global _embedding_batch_size
+    rate_limiter = get_rate_limiter()
+    #counted once, they size the batches and are what the rate limiter is charged
+    token_counts = [count_text_tokens(text) for text in texts]
+    vectors = [None] * len(texts)
+    position = 0
+    retry_ranges = deque()
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+        while position < len(texts) or retry_ranges or in_flight:
+            while len(in_flight) < EMBEDDING_CONCURRENCY and (retry_ranges or position < len(texts)):
+                if retry_ranges:
+                    start, end, attempt = retry_ranges.popleft()
+                else:
+                    start, end, attempt = position, get_batch_end(token_counts, position, _embedding_batch_size), 0
+                    position = end
+                in_flight[pool.submit(embed_batch, embedding, texts[start:end], sum(token_counts[start:end]), rate_limiter)] = (start, end, attempt)
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, end, attempt = in_flight.pop(future)
+                try:
+                    vectors[start:end] = future.result()
+                except Exception as e:
+                    if not is_rate_limited_or_too_large(e) or attempt >= EMBEDDING_MAX_RETRIES:
+                        raise
+                    add(RETRIES)
+                    if get_status_code(e) == 429:
+                        add(THROTTLED)
+                    #several failures of batches sent at the same size only shrink it once
+                    _embedding_batch_size = max(1, min(_embedding_batch_size, (end - start) // 2))
+                    #retry the failed batch as two halves so it fits the smaller size
+                    middle = (start + end) // 2
+                    if start < middle:
+                        retry_ranges.append((start, middle, attempt + 1))
+                    retry_ranges.append((middle, end, attempt + 1))
+                    retry_after = get_retry_after(e)
+                    rate_limiter.pause(retry_after if retry_after is not None else min(60, 2 ** (attempt + 1)))
+                    logging.log(logging.WARNING, f'Embedding request throttled or too large, retrying with batch size {_embedding_batch_size}: {str(e)}')
+                    continue
+                #a batch cut short by the token budget says nothing about whether more texts would fit
+                if end - start == _embedding_batch_size:
+                    _embedding_batch_size = min(EMBEDDING_MAX_BATCH_SIZE, _embedding_batch_size * 2)
+    add(TOKENS, sum(token_counts))
+    return vectors
@@ -0,0 +1,75 @@
+from langchain.schema import Document
+import logging
+import os
+import pandas as pd
+
+#rows of a "Resolved Issues in Updates" sheet put in one document, 0 keeps one document per sheet
+EXCEL_ROWS_PER_DOCUMENT = int(os.environ.get('EXCEL_ROWS_PER_DOCUMENT', '0'))
+
+#rows used to be rendered with row.to_string() under display.max_colwidth 1000, the layout below reproduces it
+MAX_COLWIDTH = 1000
+ESCAPE_CHARS = {'\t': '\\t', '\r': '\\r', '\n': '\\n'}
+COLUMN_SEPARATOR = '   '
+
+
+def format_column_names(columns:pd.Index):
+    #column names are the same on every row, so pandas formats them once per sheet
+    with pd.option_context('display.max_colwidth', MAX_COLWIDTH):
+        lines = pd.Series('', index=columns.rename(None), dtype=object).to_string().split('\n')
+    #each line is the padded name, the separator and an empty value (a single leading space)
+    return [line[:-(len(COLUMN_SEPARATOR) + 1)] for line in lines]
+
+
+def format_column_values(column:pd.Series):
+    values = column.astype(str)
+    for escape_char, replacement in ESCAPE_CHARS.items():
+        values = values.str.replace(escape_char, replacement, regex=False)
+    return ' ' + values
+
+
+def render_excel_rows(frame:pd.DataFrame):
+    """
+    Returns one string per row of frame, the same text row.to_string().replace("  ", "") gave for every row
+    of an iterrows loop, built column by column instead of formatting each row separately
+    """
+    if len(frame.index) == 0 or len(frame.columns) == 0:
+        return pd.Series([], dtype=object)
+    column_names = format_column_names(frame.columns)
+    values = [format_column_values(frame.iloc[:, i]) for i in range(len(frame.columns))]
+    #every row is right aligned to its own longest value, capped at MAX_COLWIDTH
+    width = pd.concat([value.str.len() for value in values], axis=1).max(axis=1).clip(upper=MAX_COLWIDTH)
+    rows = None
+    for column_name, value in zip(column_names, values):
+        value = value.where(value.str.len() <= width, value.str.slice(0, MAX_COLWIDTH - 3) + '...')
+        padding = pd.Series(' ', index=value.index).str.repeat((width - value.str.len()).tolist())
+        line = column_name + COLUMN_SEPARATOR + padding + value
+        rows = line if rows is None else rows + '\n' + line
+    return rows.str.replace('  ', '', regex=False)
+
+
+def iter_row_groups(rows:pd.Series, rows_per_document:int):
+    if rows_per_document <= 0:
+        rows_per_document = max(1, len(rows))
+    for start in range(0, len(rows), rows_per_document):
+        yield rows.iloc[start:start + rows_per_document]
+
+
+def load_excel_document(full_file_name:str, rows_per_document:int = EXCEL_ROWS_PER_DOCUMENT, file = None):
+    """
+    Loads every sheet of a "Resolved Issues in Updates" workbook as text with one line per cell. A sheet
+    becomes one document, or one document per rows_per_document rows so the splitter isn't handed
+    the whole sheet as a single string. file, when given, is the workbook as a binary stream
+    """
+    excel_documents: list[Document] = []
+    sheets = pd.read_excel(full_file_name if file is None else file, sheet_name=None, dtype=str)
+    for sheet_name, frame in sheets.items():
+        rows = render_excel_rows(frame.fillna(''))
+        logging.log(logging.DEBUG, f'Rendered {len(rows)} rows of sheet {sheet_name} in {full_file_name}')
+        if len(rows) == 0:
+            #empty sheets still gave an empty document
+            excel_documents.append(Document(page_content='', metadata={'source': full_file_name}))
+            continue
+        for row_group in iter_row_groups(rows, rows_per_document):
+            text = '\n'.join(row_group) + '\n'
+            excel_documents.append(Document(page_content=text, metadata={'source': full_file_name}))
+    return excel_documents
@@ -0,0 +1,143 @@
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from datetime import datetime
+import json
+import os
+import random
+from StorageBackends import BlobStore, SqliteStore, WorkerSingleton
+import tempfile
+import time
+
+#none (default, uploads use the last_processed_time window), sqlite or blob
+INGESTION_MANIFEST = os.environ.get('INGESTION_MANIFEST', 'none').lower()
+INGESTION_MANIFEST_PATH = os.environ.get('INGESTION_MANIFEST_PATH', os.path.join(tempfile.gettempdir(), 'ingestion_manifest.sqlite'))
+INGESTION_MANIFEST_CONTAINER = os.environ.get('INGESTION_MANIFEST_CONTAINER', 'ingestion-manifest')
+#times a blob manifest update is read and merged again after another run wrote the manifest in between
+INGESTION_MANIFEST_MAX_RETRIES = int(os.environ.get('INGESTION_MANIFEST_MAX_RETRIES', '10'))
+
+ETAG = 'etag'
+LAST_MODIFIED = 'last_modified'
+CHUNK_IDS = 'chunk_ids'
+
+
+class SqliteIngestionManifest(SqliteStore):
+    """
+    Manifest of processed blobs in a local sqlite file, keyed by container and blob name
+    """
+    def __init__(self, path:str = INGESTION_MANIFEST_PATH):
+        super().__init__(path, ['CREATE TABLE IF NOT EXISTS manifest (container TEXT NOT NULL, blob_name TEXT NOT NULL, etag TEXT, last_modified TEXT, chunk_ids TEXT, PRIMARY KEY (container, blob_name))'])
+
+    def get(self, container_name:str, blob_names:list = None):
+        #every entry of the container, or only those of blob_names
+        with self.lock:
+            if blob_names is None:
+                rows = self.connection.execute('SELECT blob_name, etag, last_modified, chunk_ids FROM manifest WHERE container = ?', (container_name,)).fetchall()
+            else:
+                rows = self.connection.execute(f'SELECT blob_name, etag, last_modified, chunk_ids FROM manifest WHERE container = ? AND blob_name IN ({", ".join("?" * len(blob_names))})', (container_name, *blob_names)).fetchall()
+        return {blob_name: {ETAG: etag, LAST_MODIFIED: last_modified, CHUNK_IDS: json.loads(chunk_ids)} for blob_name, etag, last_modified, chunk_ids in rows}
+
+    def update(self, container_name:str, entries:dict):
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO manifest (container, blob_name, etag, last_modified, chunk_ids) VALUES (?, ?, ?, ?, ?)',
+                [(container_name, blob_name, entry[ETAG], entry[LAST_MODIFIED], json.dumps(entry[CHUNK_IDS])) for blob_name, entry in entries.items()])
+            self.connection.commit()
+
+    def update_rows(self, container_name:str, entries:dict):
+        #rows are already written one per blob
+        self.update(container_name, entries)
+
+
+class BlobIngestionManifest(BlobStore):
+    """
+    Manifest of processed blobs, so it survives worker restarts and is shared between instances.
+    Timer runs keep it as one json blob per container (container_name.json). Queue messages each process one blob
+    and write their own row instead (container_name/blob_name, the entry as json with its etag and last_modified
+    also in the blob's metadata), so concurrent messages don't rewrite the whole manifest or conflict over it.
+    get() lays the rows over the json, the timer's update() drops the rows of the blobs it records
+    """
+    def __init__(self, connection_string:str, container_name:str = INGESTION_MANIFEST_CONTAINER):
+        super().__init__(connection_string, container_name)
+
+    def read(self, container_name:str):
+        #the entries and the etag they were read at, None when the manifest doesn't exist yet
+        try:
+            downloader = self.container_client.download_blob(f'{container_name}.json')
+        except ResourceNotFoundError:
+            return {}, None
+        return json.loads(downloader.readall()), downloader.properties.etag
+
+    def list_rows(self, container_name:str):
+        #entries from the rows' metadata, which is all change detection needs, their chunk ids are only in the rows themselves
+        return {row.name[len(container_name) + 1:]: {ETAG: row.metadata.get(ETAG), LAST_MODIFIED: row.metadata.get(LAST_MODIFIED) or None, CHUNK_IDS: None}
+                for row in self.container_client.list_blobs(name_starts_with=f'{container_name}/', include=['metadata'])}
+
+    def get_row(self, container_name:str, blob_name:str):
+        try:
+            return json.loads(self.container_client.download_blob(f'{container_name}/{blob_name}').readall())
+        except ResourceNotFoundError:
+            return None
+
+    def get(self, container_name:str, blob_names:list = None):
+        #every entry of the container, or only the rows of blob_names, which is what a queue message reads
+        if blob_names is not None:
+            rows = {blob_name: self.get_row(container_name, blob_name) for blob_name in blob_names}
+            return {blob_name: entry for blob_name, entry in rows.items() if entry is not None}
+        manifest_entries = self.read(container_name)[0]
+        manifest_entries.update(self.list_rows(container_name))
+        return manifest_entries
+
+    def update(self, container_name:str, entries:dict):
+        #read-modify-write guarded by the etag of this read, so two overlapping runs can't drop each other's entries.
+        #When another run wrote the manifest in between, it is read and merged again
+        blob_name = f'{container_name}.json'
+        for attempt in range(INGESTION_MANIFEST_MAX_RETRIES + 1):
+            manifest_entries, etag = self.read(container_name)
+            manifest_entries.update(entries)
+            try:
+                if etag is None:
+                    self.container_client.upload_blob(blob_name, json.dumps(manifest_entries), overwrite=False)
+                else:
+                    self.container_client.upload_blob(blob_name, json.dumps(manifest_entries), overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+                break
+            except (ResourceModifiedError, ResourceExistsError):
+                if attempt >= INGESTION_MANIFEST_MAX_RETRIES:
+                    raise
+                #spread out the runs that collided so they don't read and collide again
+                time.sleep(random.uniform(0, 0.1 * (attempt + 1)))
+        #older rows of these blobs would otherwise be laid over the entries just written
+        for row_blob_name in self.list_rows(container_name).keys() & entries.keys():
+            try:
+                self.container_client.delete_blob(f'{container_name}/{row_blob_name}')
+            except ResourceNotFoundError:
+                pass
+
+    def update_rows(self, container_name:str, entries:dict):
+        #each blob's row is written on its own and only by the message processing it, so there is nothing to merge
+        for blob_name, entry in entries.items():
+            self.container_client.upload_blob(f'{container_name}/{blob_name}', json.dumps(entry), overwrite=True,
+                metadata={ETAG: entry[ETAG] or '', LAST_MODIFIED: entry[LAST_MODIFIED] or ''})
+
+
+def create_ingestion_manifest(connection_string:str):
+    #None when uploads should use the time window instead
+    if INGESTION_MANIFEST == 'none':
+        return None
+    if INGESTION_MANIFEST == 'blob':
+        return BlobIngestionManifest(connection_string)
+    return SqliteIngestionManifest()
+
+
+_ingestion_manifest = WorkerSingleton(create_ingestion_manifest)
+
+
+def get_ingestion_manifest(connection_string:str):
+    return _ingestion_manifest.get(connection_string)
+
+
+def is_blob_changed(manifest_entries:dict, blob_name:str, etag:str):
+    entry = manifest_entries.get(blob_name)
+    return entry is None or entry[ETAG] != etag
+
+
+def manifest_entry(etag:str, last_modified:datetime, chunk_ids:list):
+    return {ETAG: etag, LAST_MODIFIED: last_modified.isoformat() if last_modified is not None else None, CHUNK_IDS: chunk_ids}
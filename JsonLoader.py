@@ -0,0 +1,174 @@
+from langchain.schema import Document
+from io import BytesIO, TextIOWrapper
+import json
+import logging
+import os
+
+SOURCE = 'source'
+RECORD_ID = 'record_id'
+TEAMS = 'teams'
+SALESFORCE = 'salesforce'
+#field that identifies a record of each export, used as the record_id of records in a bundle
+RECORD_ID_FIELDS = {TEAMS: 'MessageId', SALESFORCE: 'ID'}
+
+
+def load_teams_json(record: dict, metadata:dict):
+    teams_metadata_include = set(['TeamId', 'ChannelId', 'MessageId', 'Date', 'Url'])
+    metadata['doc_type'] = 'teams'
+    metadata.update({k: v for k, v in record.items() if k in teams_metadata_include})
+    text = record['Conversation']
+    return text, metadata
+
+
+
+
+def load_salesforce_json(record: dict, metadata:dict):
+    meta_include = set(["TITLE", "URLNAME"])
+    text_exclude = set(["AUTHOR__C", "CREATEDBYID", "ID", "KNOWLEDGEARTICLEID", "ARTICLENUMBER", "PUBLISHSTATUS", "RECORDTYPEID", "VERSIONNUMBER", "OWNERID" ])
+    metadata['doc_type'] = 'salesforce'
+    metadata.update({key: val for key, val in record.items() if (key in text_exclude) or (key in meta_include)})
+    text = "\n\n".join(["{}: {}".format(key, val) for key, val in record.items() if (isinstance(val, str)) and (key not in text_exclude)])
+    return text, metadata
+
+
+
+
+def read_json(json_file_path:str, file = None):
+    #file can be the file's content as bytes or a binary stream, otherwise json_file_path is read from disk
+    if file is None:
+        with open(json_file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    if isinstance(file, (bytes, bytearray)):
+        file = BytesIO(file)
+    return json.loads(file.read().decode('utf-8'))
+
+
+
+
+def load_json_document(json_file_path:str, json_loader_func, file = None) -> list[Document]:
+    logging.log(logging.DEBUG, 'load_json_document')
+    documents: list[Document] = []
+    record = read_json(json_file_path, file)
+    metadata = {}
+    text, metadata = json_loader_func(record, metadata)
+    metadata[SOURCE] = json_file_path
+    documents.append(Document(page_content=text, metadata=metadata))
+    return documents
+
+
+
+
+def get_export_type(json_file_path:str):
+    #the file name says which kind of export it is, e.g. ..._teams.json or ..._salesforce.ndjson
+    file_name = os.path.splitext(json_file_path)[0]
+    if file_name.endswith(TEAMS):
+        return TEAMS
+    elif file_name.endswith(SALESFORCE):
+        return SALESFORCE
+    raise ValueError(f'Unknown json export, file name should end with {TEAMS} or {SALESFORCE}: {json_file_path}')
+
+
+
+
+def get_json_loader_func(export_type:str):
+    return load_teams_json if export_type == TEAMS else load_salesforce_json
+
+
+
+
+def open_binary(json_file_path:str, file = None):
+    if file is None:
+        return open(json_file_path, 'rb')
+    if isinstance(file, (bytes, bytearray)):
+        return BytesIO(file)
+    return file
+
+
+
+
+def skip_bom(stream):
+    #exports saved from Excel/PowerShell start with a utf-8 byte order mark that json parsers reject
+    position = stream.tell()
+    if stream.read(3) != b'\xef\xbb\xbf':
+        stream.seek(position)
+    return stream
+
+
+
+
+def is_json_array(stream):
+    #peeks at the first character without consuming the stream
+    position = stream.tell()
+    first_characters = stream.read(64).lstrip(b' \t\r\n')
+    stream.seek(position)
+    return first_characters[:1] == b'['
+
+
+
+
+def iter_ndjson_records(stream):
+    #one record per line, read line by line so the whole bundle is never decoded at once
+    for line in TextIOWrapper(stream, encoding='utf-8-sig'):
+        if line.strip():
+            yield json.loads(line)
+
+
+
+
+def iter_json_array_records(stream):
+    try:
+        import ijson
+    except ImportError:
+        #without ijson the array is parsed in one go
+        logging.log(logging.WARNING, 'ijson is not installed, loading the whole json array bundle into memory')
+        yield from json.load(TextIOWrapper(stream, encoding='utf-8-sig'))
+        return
+    yield from ijson.items(stream, 'item', use_float=True)
+
+
+
+
+def load_json_bundle(json_file_path:str, export_type:str, records) -> list[Document]:
+    """
+    One document per record of a bundle file, each loaded by the same function as a single record file.
+    The bundle is the source of every record, record_id (the record's own id, or its position when it
+    has none) keeps their chunk ids apart and stable when records are added to or removed from the bundle
+    """
+    json_loader_func = get_json_loader_func(export_type)
+    documents: list[Document] = []
+    for position, record in enumerate(records, start=1):
+        text, metadata = json_loader_func(record, {})
+        record_id = record.get(RECORD_ID_FIELDS[export_type])
+        metadata[RECORD_ID] = str(record_id) if record_id is not None else str(position)
+        metadata[SOURCE] = json_file_path
+        documents.append(Document(page_content=text, metadata=metadata))
+    logging.log(logging.DEBUG, f'Loaded {len(documents)} records from json bundle {json_file_path}')
+    return documents
+
+
+
+
+def load_json_file(json_file_path:str, file = None) -> list[Document]:
+    #a .json file holds either a single record or an array of records
+    export_type = get_export_type(json_file_path)
+    stream = skip_bom(open_binary(json_file_path, file))
+    try:
+        if is_json_array(stream):
+            return load_json_bundle(json_file_path, export_type, iter_json_array_records(stream))
+        return load_json_document(json_file_path, get_json_loader_func(export_type), stream)
+    finally:
+        if file is None:
+            stream.close()
+
+
+
+
+def load_ndjson_file(json_file_path:str, file = None) -> list[Document]:
+    #.ndjson/.jsonl bundles hold one record per line
+    export_type = get_export_type(json_file_path)
+    stream = skip_bom(open_binary(json_file_path, file))
+    try:
+        return load_json_bundle(json_file_path, export_type, iter_ndjson_records(stream))
+    finally:
+        if file is None:
+            stream.close()
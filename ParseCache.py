@@ -0,0 +1,150 @@
+from azure.core.exceptions import ResourceNotFoundError
+import hashlib
+import json
+import logging
+import os
+from StorageBackends import BlobStore, SqliteStore, WorkerSingleton, local_cache_max_bytes, log_cache_size
+import tempfile
+import time
+import zlib
+
+#none (default), sqlite or blob. set PARSE_CACHE=sqlite to keep parse results in a local file on the worker,
+#or blob to share them between workers through PARSE_CACHE_CONTAINER
+PARSE_CACHE = os.environ.get('PARSE_CACHE', 'none').lower()
+PARSE_CACHE_PATH = os.environ.get('PARSE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'parse_cache.sqlite'))
+#least recently used parse results are removed once the local cache holds more than this many (compressed) bytes,
+#unset uses a tenth of the free space in the cache's directory up to 256MB
+PARSE_CACHE_MAX_BYTES = os.environ.get('PARSE_CACHE_MAX_BYTES', '')
+PARSE_CACHE_CONTAINER = os.environ.get('PARSE_CACHE_CONTAINER', 'parse-cache')
+
+SOURCE = 'source'
+PAGE_CONTENT = 'page_content'
+METADATA = 'metadata'
+DOCUMENTS = 'documents'
+
+
+def parse_cache_key(container_name:str, blob, loader_version:str):
+    #the content md5 stays the same when an identical file is uploaded again, the etag doesn't
+    content_md5 = getattr(getattr(blob, 'content_settings', None), 'content_md5', None)
+    content_version = bytes(content_md5).hex() if content_md5 else blob.etag.strip('"')
+    return hashlib.md5(f'{loader_version}/{container_name}/{blob.name}/{content_version}'.encode()).hexdigest()
+
+
+def documents_to_bytes(documents:list, full_file_path:str):
+    #the temp path differs on every run, it is stored as an empty source and put back when loading
+    return zlib.compress(json.dumps({DOCUMENTS: [{PAGE_CONTENT: document.page_content,
+        METADATA: {**document.metadata, SOURCE: ''} if document.metadata.get(SOURCE) == full_file_path else document.metadata}
+        for document in documents]}).encode())
+
+
+def bytes_to_documents(data:bytes, full_file_path:str):
+    from langchain.schema import Document
+    documents = []
+    for document in json.loads(zlib.decompress(data))[DOCUMENTS]:
+        metadata = document[METADATA]
+        if metadata.get(SOURCE) == '':
+            metadata[SOURCE] = full_file_path
+        documents.append(Document(page_content=document[PAGE_CONTENT], metadata=metadata))
+    return documents
+
+
+class SqliteParseCache(SqliteStore):
+    """
+    Local on-disk cache of parsed documents with least recently used eviction by total size
+    """
+    def __init__(self, path:str = PARSE_CACHE_PATH, max_bytes:int = None):
+        super().__init__(path, ['CREATE TABLE IF NOT EXISTS parse_results (key TEXT PRIMARY KEY, documents BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)',
+                                'CREATE INDEX IF NOT EXISTS parse_results_last_used ON parse_results (last_used)'])
+        self.max_bytes = max_bytes if max_bytes is not None else local_cache_max_bytes(path, PARSE_CACHE_MAX_BYTES)
+        entry_count, total_size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM parse_results').fetchone()
+        log_cache_size('Parse cache', path, entry_count, total_size, self.max_bytes)
+
+    def get(self, key:str):
+        with self.lock:
+            row = self.connection.execute('SELECT documents FROM parse_results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE parse_results SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+        return row[0]
+
+    def set(self, key:str, data:bytes):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO parse_results (key, documents, size, last_used) VALUES (?, ?, ?, ?)', (key, data, len(data), time.time()))
+            total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM parse_results').fetchone()[0]
+            if total_size > self.max_bytes:
+                evict_keys = []
+                for evict_key, size in self.connection.execute('SELECT key, size FROM parse_results ORDER BY last_used'):
+                    if total_size <= self.max_bytes:
+                        break
+                    evict_keys.append((evict_key,))
+                    total_size = total_size - size
+                self.connection.executemany('DELETE FROM parse_results WHERE key = ?', evict_keys)
+                logging.log(logging.INFO, f'Evicted {len(evict_keys)} parse results from parse cache')
+            self.connection.commit()
+
+
+class BlobParseCache(BlobStore):
+    """
+    Parse cache shared between workers, one blob per parsed file
+    """
+    def __init__(self, connection_string:str, container_name:str = PARSE_CACHE_CONTAINER):
+        super().__init__(connection_string, container_name)
+
+    def get(self, key:str):
+        try:
+            return self.container_client.download_blob(key).readall()
+        except ResourceNotFoundError:
+            return None
+
+    def set(self, key:str, data:bytes):
+        self.container_client.upload_blob(key, data, overwrite=True)
+
+
+class ParseCache:
+    """
+    Parsed documents of a blob keyed by container, blob name, content md5 (or etag) and loader version, so a file
+    that has not changed since it was last parsed is neither downloaded nor parsed again
+    """
+    def __init__(self, cache, loader_version:str):
+        self.cache = cache
+        self.loader_version = loader_version
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, container_name:str, blob, full_file_path:str):
+        data = self.cache.get(parse_cache_key(container_name, blob, self.loader_version))
+        if data is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return bytes_to_documents(data, full_file_path)
+
+    def set(self, container_name:str, blob, full_file_path:str, documents:list):
+        #a failed parse returns no documents, don't keep that so the next run tries again
+        if len(documents) == 0:
+            return
+        try:
+            self.cache.set(parse_cache_key(container_name, blob, self.loader_version), documents_to_bytes(documents, full_file_path))
+        except Exception:
+            logging.exception(f'Unable to cache parse result of {blob.name}')
+
+    def log_stats(self):
+        stats_message = f'Parse cache hits: {self.hits}, misses: {self.misses}'
+        print(stats_message)
+        logging.log(logging.INFO, stats_message)
+
+
+def create_parse_cache(connection_string:str, loader_version:str):
+    if PARSE_CACHE == 'none':
+        return None
+    if PARSE_CACHE == 'blob':
+        return ParseCache(BlobParseCache(connection_string), loader_version)
+    return ParseCache(SqliteParseCache(), loader_version)
+
+
+_parse_cache = WorkerSingleton(create_parse_cache)
+
+
+def get_parse_cache(connection_string:str, loader_version:str):
+    return _parse_cache.get(connection_string, loader_version)
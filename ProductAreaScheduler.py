@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+from Telemetry import attributes, bind, stage
+
+#number of product areas processed at the same time, each has its own container and index so they don't contend
+PRODUCT_AREA_CONCURRENCY = int(os.environ.get('PRODUCT_AREA_CONCURRENCY', '3'))
+
+STATUS = 'status'
+SECONDS = 'seconds'
+ERROR = 'error'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+def run_product_area(run_name:str, run_function, product_area:str):
+    #a failure only stops its own product area, it is recorded and reported in the summary
+    start = time.perf_counter()
+    try:
+        #everything the product area does is traced and counted under it
+        with attributes(product_area=product_area), stage(run_name):
+            run_function(product_area)
+        return {STATUS: SUCCEEDED, SECONDS: time.perf_counter() - start, ERROR: None}
+    except Exception as e:
+        logging.exception(f'Product area {product_area} failed')
+        return {STATUS: FAILED, SECONDS: time.perf_counter() - start, ERROR: str(e)}
+
+
+def log_summary(run_name:str, results:dict):
+    summary_lines = [f'{run_name} summary:']
+    for product_area, result in results.items():
+        summary_line = f'  {product_area}: {result[STATUS]} in {result[SECONDS]:.1f}s'
+        if result[ERROR] is not None:
+            summary_line = summary_line + f' ({result[ERROR]})'
+        summary_lines.append(summary_line)
+    summary_message = '\n'.join(summary_lines)
+    print(summary_message)
+    logging.log(logging.INFO, summary_message)
+
+
+def run_for_product_areas(run_name:str, product_areas:list, run_function, max_concurrency:int = PRODUCT_AREA_CONCURRENCY):
+    """
+    Calls run_function(product_area) for every product area with at most max_concurrency running at once.
+    Every product area runs even if others fail, a summary is logged at the end and a RuntimeError
+    naming the failed product areas is raised so the trigger invocation is still marked as failed
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        results = dict(zip(product_areas, pool.map(bind(lambda product_area: run_product_area(run_name, run_function, product_area)), product_areas)))
+    log_summary(run_name, results)
+    failed_product_areas = [product_area for product_area, result in results.items() if result[STATUS] == FAILED]
+    if len(failed_product_areas) > 0:
+        raise RuntimeError(f'{run_name} failed for product areas: {", ".join(failed_product_areas)}')
+    return results
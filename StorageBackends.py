@@ -0,0 +1,72 @@
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import ContainerClient
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+
+def create_state_container(connection_string:str, container_name:str):
+    #a container in the function app's storage account for the pipeline's own state, created on first use
+    container_client = ContainerClient.from_connection_string(conn_str=connection_string, container_name=container_name)
+    try:
+        container_client.create_container()
+    except ResourceExistsError:
+        pass
+    return container_client
+
+
+def local_cache_max_bytes(path:str, max_bytes:str, max_disk_share:float = 0.1):
+    #an explicit setting wins, otherwise a share of the free space where the file lives, never more than 256MB
+    if max_bytes:
+        return int(max_bytes)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    return min(256 * 1024 * 1024, int(shutil.disk_usage(directory).free * max_disk_share))
+
+
+def log_cache_size(name:str, path:str, entries:int, size:int, max_bytes:int):
+    size_message = f'{name} at {path}: {entries} entries, {size / 1024 / 1024:.1f}MB of {max_bytes / 1024 / 1024:.1f}MB'
+    print(size_message)
+    logging.log(logging.INFO, size_message)
+
+
+class SqliteStore:
+    """
+    Local sqlite file shared by every thread in the worker, subclasses run their statements holding lock.
+    schema is the CREATE statements run when the file is opened
+    """
+    def __init__(self, path:str, schema:list):
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        for statement in schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+
+class BlobStore:
+    """
+    Container in the function app's storage account, shared between workers and kept across restarts.
+    Nothing here removes old blobs, containers used as caches are kept in size with a lifecycle management rule
+    """
+    def __init__(self, connection_string:str, container_name:str):
+        self.container_client = create_state_container(connection_string, container_name)
+
+
+class WorkerSingleton:
+    """
+    One instance per worker process, made by create(*args) the first time get() is called and shared by every
+    product area and trigger invocation after that. create returns None when the feature is turned off
+    """
+    def __init__(self, create):
+        self.create = create
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def get(self, *args):
+        with self.lock:
+            if self.instance is None:
+                self.instance = self.create(*args)
+        return self.instance
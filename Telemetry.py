@@ -0,0 +1,246 @@
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+#auto, azure, otel (whatever OpenTelemetry providers are already configured, e.g. by opentelemetry-instrument or OTEL_*
+#settings) or none. auto is azure (Application Insights) when APPLICATIONINSIGHTS_CONNECTION_STRING is set and the host runs
+#in OpenTelemetry mode, which takes the AzureFunctionsJobHost__telemetryMode=OpenTelemetry app setting. In that mode the
+#host stops sending the worker's logs so the worker exports them with its spans and metrics, in the default mode the host
+#sends them itself and exporting them here too would log everything twice
+TELEMETRY = os.environ.get('TELEMETRY', 'auto').lower()
+HOST_TELEMETRY_MODE = os.environ.get('AzureFunctionsJobHost__telemetryMode', '').lower()
+TELEMETRY_NAME = 'askmaddi.ingestion'
+
+PRODUCT_AREA = 'product_area'
+INDEX = 'index'
+STAGE = 'stage'
+STATUS = 'status'
+
+#counters, added with add() and attributed to the current product area, index and stage
+BYTES = 'bytes'
+DOCUMENTS = 'documents'
+CHUNKS = 'chunks'
+TOKENS = 'tokens'
+RETRIES = 'retries'
+THROTTLED = 'throttled'
+BLOBS_LISTED = 'blobs_listed'
+BLOBS_CHANGED = 'blobs_changed'
+CHUNKS_DELETED = 'chunks_deleted'
+CHUNKS_UPDATED = 'chunks_updated'
+COUNTER_UNITS = {BYTES: 'By', DOCUMENTS: '{document}', CHUNKS: '{chunk}', TOKENS: '{token}', RETRIES: '{retry}', THROTTLED: '{response}',
+                 BLOBS_LISTED: '{blob}', BLOBS_CHANGED: '{blob}', CHUNKS_DELETED: '{chunk}', CHUNKS_UPDATED: '{chunk}'}
+
+#attributes of whatever is running in this thread (product area, index, stage), stages and counters are tagged with them
+_attributes = contextvars.ContextVar('telemetry_attributes', default={})
+
+
+class NoopStage:
+    """
+    Returned by stage() and attributes() when telemetry is off, so instrumented code costs a function call
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_STAGE = NoopStage()
+
+
+class Attributes:
+    def __init__(self, attributes:dict):
+        self.attributes = attributes
+        self.token = None
+
+    def __enter__(self):
+        self.token = _attributes.set({**_attributes.get(), **self.attributes})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _attributes.reset(self.token)
+        return False
+
+
+class Stage:
+    """
+    A span named after the stage plus its duration in the stage duration histogram, both tagged with the
+    current attributes. Counters added while it is open are attributed to the stage
+    """
+    def __init__(self, telemetry, name:str, attributes:dict):
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+        self.token = None
+        self.span_context = None
+        self.span = None
+
+    def __enter__(self):
+        self.token = _attributes.set({**_attributes.get(), **self.attributes, STAGE: self.name})
+        self.span_context = self.telemetry.tracer.start_as_current_span(self.name, attributes=_attributes.get())
+        self.span = self.span_context.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        milliseconds = (time.perf_counter() - self.start) * 1000
+        attributes = {**_attributes.get(), STATUS: 'error' if exc_type is not None else 'ok'}
+        _attributes.reset(self.token)
+        self.telemetry.stage_duration.record(milliseconds, attributes)
+        #records the exception on the span and ends it
+        self.span_context.__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def set(self, **attributes):
+        #extra span attributes that are only known once the stage has run, e.g. whether the parse cache was hit
+        self.span.set_attributes(attributes)
+
+
+class Telemetry:
+    def __init__(self, tracer, meter):
+        self.tracer = tracer
+        self.meter = meter
+        self.stage_duration = meter.create_histogram(f'{TELEMETRY_NAME}.stage.duration', unit='ms', description='Time spent in each ingestion stage')
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+
+    def counter(self, metric:str):
+        counter = self.counters.get(metric)
+        if counter is None:
+            with self.counters_lock:
+                counter = self.counters.get(metric)
+                if counter is None:
+                    counter = self.meter.create_counter(f'{TELEMETRY_NAME}.{metric}', unit=COUNTER_UNITS.get(metric, '1'))
+                    self.counters[metric] = counter
+        return counter
+
+
+_telemetry = None
+_telemetry_initialized = False
+_telemetry_lock = threading.Lock()
+
+
+def create_telemetry():
+    #returns None when telemetry is off or the OpenTelemetry packages aren't installed
+    mode = TELEMETRY
+    if mode == 'auto':
+        mode = 'azure' if os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING') and HOST_TELEMETRY_MODE == 'opentelemetry' else 'none'
+    if mode == 'none':
+        return None
+    if mode == 'azure' and HOST_TELEMETRY_MODE != 'opentelemetry':
+        logging.log(logging.WARNING, 'Telemetry is set to azure but AzureFunctionsJobHost__telemetryMode is not OpenTelemetry, the host and the worker will both send its logs')
+    try:
+        from opentelemetry import metrics, trace
+        if mode == 'azure':
+            from azure.monitor.opentelemetry import configure_azure_monitor
+            #exports the root logger the pipeline logs to, along with the spans and metrics
+            configure_azure_monitor(connection_string=os.environ['APPLICATIONINSIGHTS_CONNECTION_STRING'])
+    except ImportError as e:
+        logging.log(logging.WARNING, f'Telemetry is set to {mode} but OpenTelemetry is not installed, continuing without it: {str(e)}')
+        return None
+    logging.log(logging.INFO, f'Exporting ingestion telemetry through OpenTelemetry ({mode})')
+    return Telemetry(trace.get_tracer(TELEMETRY_NAME), metrics.get_meter(TELEMETRY_NAME))
+
+
+def get_telemetry():
+    #set up once per worker on first use, so importing this module never loads OpenTelemetry
+    global _telemetry, _telemetry_initialized
+    if _telemetry_initialized:
+        return _telemetry
+    with _telemetry_lock:
+        if not _telemetry_initialized:
+            try:
+                _telemetry = create_telemetry()
+            except Exception:
+                logging.exception('Unable to set up telemetry, continuing without it')
+            _telemetry_initialized = True
+    return _telemetry
+
+
+def stage(name:str, **attributes):
+    """
+    with stage('embed'): ... times the block as a span and in the stage duration histogram.
+    Keyword arguments are added to the current attributes for the block and anything it calls
+    """
+    telemetry = get_telemetry()
+    if telemetry is None:
+        return NOOP_STAGE
+    return Stage(telemetry, name, attributes)
+
+
+def attributes(**attributes):
+    #tags the stages and counters of the block with e.g. product_area or index, without timing it
+    if get_telemetry() is None:
+        return NOOP_STAGE
+    return Attributes(attributes)
+
+
+def staged(name:str):
+    #decorator for functions that are a stage as a whole
+    def decorator(function):
+        @functools.wraps(function)
+        def run_stage(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return run_stage
+    return decorator
+
+
+def iterate(name:str, iterable, metric:str = None):
+    """
+    Yields from iterable (e.g. a paged blob listing that is consumed while other stages run) and records the
+    time spent waiting on it as the duration of stage name once it is exhausted, and the number of items to metric
+    """
+    telemetry = get_telemetry()
+    if telemetry is None:
+        return iterable
+    return iterate_timed(telemetry, name, iterable, metric)
+
+
+def iterate_timed(telemetry, name:str, iterable, metric:str):
+    seconds = 0
+    count = 0
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            seconds = seconds + time.perf_counter() - start
+        count = count + 1
+        yield item
+    attributes = {**_attributes.get(), STAGE: name}
+    telemetry.stage_duration.record(seconds * 1000, {**attributes, STATUS: 'ok'})
+    if metric is not None:
+        telemetry.counter(metric).add(count, attributes)
+
+
+def add(metric:str, value:int = 1, **attributes):
+    telemetry = get_telemetry()
+    if telemetry is None or value == 0:
+        return
+    telemetry.counter(metric).add(value, {**_attributes.get(), **attributes})
+
+
+def bind(function):
+    """
+    Thread pools don't carry the caller's context, submit bind(function) instead of function so work done on
+    the pool is attributed to the caller's product area and stage and its spans are children of the caller's span
+    """
+    if get_telemetry() is None:
+        return function
+    context = contextvars.copy_context()
+
+    def run_in_context(*args, **kwargs):
+        #a context can only be entered by one thread at a time, each call runs in its own copy
+        return context.copy().run(function, *args, **kwargs)
+    return run_in_context
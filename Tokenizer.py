@@ -0,0 +1,49 @@
+import logging
+import os
+import threading
+
+#tokenizer used when tiktoken doesn't know OPEN_AI_MODEL, the encoding of every current OpenAI embedding model
+DEFAULT_ENCODING = os.environ.get('TOKENIZER_ENCODING', 'cl100k_base')
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    The tiktoken encoding of the embedding model (OPEN_AI_MODEL), loaded once per worker.
+    None when tiktoken isn't installed or its encoding file can't be downloaded, token counts are estimated then
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                try:
+                    _encoding = tiktoken.encoding_for_model(os.environ.get('OPEN_AI_MODEL', ''))
+                except KeyError:
+                    _encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+            except Exception as e:
+                #the encoding file is downloaded on first use (cached in TIKTOKEN_CACHE_DIR)
+                logging.log(logging.WARNING, f'Unable to load the tiktoken encoding, estimating token counts instead: {str(e)}')
+            _encoding_loaded = True
+    return _encoding
+
+
+def estimate_text_tokens(text:str):
+    #roughly 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def count_text_tokens(text:str):
+    encoding = get_encoding()
+    if encoding is None:
+        return estimate_text_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(texts:list):
+    return sum(count_text_tokens(text) for text in texts)
@@ -1,36 +1,72 @@
-from azure.storage.blob import ContainerClient, BlobClient
+#annotations are only evaluated by type checkers, so langchain/elasticsearch types can be named without importing them at startup
+from __future__ import annotations
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import ContainerClient
+from BlobListing import BlobListing
+from BlobQueue import create_blob_message, parse_blob_message, PRODUCT_AREA, BLOB_NAME
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from elasticsearch import Elasticsearch
+from io import BytesIO
+from DocumentLoaders import get_document_loader, get_loader_version
+from ElasticClient import get_elastic_client
+from ElasticIndexes import ensure_index
+from EmbeddingExecutor import count_embedding_requests, embed_texts, EMBEDDING_CONCURRENCY, EMBEDDING_TPM_LIMIT
+from IngestionManifest import get_ingestion_manifest, is_blob_changed, manifest_entry
+from ParseCache import get_parse_cache
+from ProductAreaScheduler import run_for_product_areas
+from Telemetry import add, attributes, bind, iterate, stage, staged, BLOBS_CHANGED, BLOBS_LISTED, BYTES, CHUNKS, DOCUMENTS
+from Tokenizer import count_text_tokens
 import hashlib
 from io import StringIO
-import json
-import langchain.document_loaders
-from langchain_community.vectorstores.elasticsearch import ElasticsearchStore
-from langchain_openai.embeddings import OpenAIEmbeddings, AzureOpenAIEmbeddings
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import logging
 import os
-import pandas as pd
 from pathlib import Path
+import requests
 import tempfile
+import threading
 import time
+from typing import TYPE_CHECKING
 
-# Constants - now reading directly from environment variables
-ELASTIC_CLOUD_ID = os.environ['ELASTIC_CLOUD_ID']
-ELASTIC_USERNAME = os.environ['ELASTIC_USERNAME']
-ELASTIC_PASSWORD = os.environ['ELASTIC_PASSWORD']
+#langchain, the embeddings client and the elasticsearch helpers take seconds to import, they are imported by the
+#functions that use them so listing blobs (queue mode) and the delete trigger start without them
+if TYPE_CHECKING:
+    from langchain.schema import Document
+    from langchain_community.vectorstores.elasticsearch import ElasticsearchStore
 
-OPEN_AI_KEY = os.environ['OPEN_AI_KEY']
-OPEN_AI_DEPLOYMENT = os.environ['OPEN_AI_DEPLOYMENT']
-OPEN_AI_MODEL = os.environ['OPEN_AI_MODEL']
-OPEN_AI_BASE = os.environ['OPEN_AI_BASE']
-OPEN_AI_TYPE = os.environ['OPEN_AI_TYPE']
-OPEN_AI_VERSION = os.environ['OPEN_AI_VERSION']
-
-AZURE_CONNECTION_STRING = os.environ['askmaddiknowledgeset_STORAGE'] # Using the connection string from function app
+# Required settings (elastic, open ai and the storage connection string) are read when they are used, not at import
 DIRECTORY_CONNECTION_STRING = os.environ.get('DIRECTORY_CONNECTION_STRING', '')  # Optional for directory-based loading
 
+#number of blobs downloaded at the same time, also used to size the blob http connection pool
+BLOB_DOWNLOAD_CONCURRENCY = int(os.environ.get('BLOB_DOWNLOAD_CONCURRENCY', '8'))
+#number of processes used to parse downloaded files by timer runs, 0 parses on the download threads instead.
+#queue messages always parse their blob on their own thread, see start_parse_pool
+DOCUMENT_PARSE_WORKERS = int(os.environ.get('DOCUMENT_PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+#max number of blobs downloaded or parsed but not yet handed back, keeps memory and temp disk usage flat
+BLOB_PIPELINE_MAX_IN_FLIGHT = int(os.environ.get('BLOB_PIPELINE_MAX_IN_FLIGHT', str(BLOB_DOWNLOAD_CONCURRENCY * 2)))
+#number of chunks embedded and indexed together when streaming, bounds the texts, vectors and metadata held at a time
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '256'))
+#number of chunk hashes looked up in elastic per search request when checking for duplicates
+DUPLICATE_CHECK_BATCH_SIZE = int(os.environ.get('DUPLICATE_CHECK_BATCH_SIZE', '500'))
+#compare new chunks of each processed file with the ones already in elastic, skip unchanged chunks and remove ones that no longer exist
+RECONCILE_CHUNKS = os.environ.get('RECONCILE_CHUNKS', 'true').lower() == 'true'
+#indexing batches are bounded by both document count and request size
+INDEX_BULK_MAX_DOCS = int(os.environ.get('INDEX_BULK_MAX_DOCS', '500'))
+INDEX_BULK_MAX_BYTES = int(os.environ.get('INDEX_BULK_MAX_BYTES', str(10 * 1024 * 1024)))
+#more than one thread uses parallel_bulk, otherwise streaming_bulk which also retries rejected (429) documents
+INDEX_BULK_THREADS = int(os.environ.get('INDEX_BULK_THREADS', '1'))
+INDEX_BULK_MAX_RETRIES = int(os.environ.get('INDEX_BULK_MAX_RETRIES', '5'))
+#times a source update is retried when another writer (e.g. a concurrent queue message) changed the chunk in between
+SOURCE_UPDATE_RETRY_ON_CONFLICT = int(os.environ.get('SOURCE_UPDATE_RETRY_ON_CONFLICT', '10'))
+#blobs up to this size are parsed from memory, bigger ones are written to a temp file first
+IN_MEMORY_PARSE_MAX_BYTES = int(os.environ.get('IN_MEMORY_PARSE_MAX_BYTES', str(8 * 1024 * 1024)))
+#characters (default) or tokens of the embedding model (OPEN_AI_MODEL), so every chunk costs about the same to embed
+#changing how chunks are split changes their ids and hashes, files are only re-chunked when they change or are reprocessed
+CHUNK_SIZE_UNIT = os.environ.get('CHUNK_SIZE_UNIT', 'characters').lower()
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '400' if CHUNK_SIZE_UNIT == 'tokens' else '1500'))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '40' if CHUNK_SIZE_UNIT == 'tokens' else '150'))
+
 
 PRODUCT_NAME='PRODUCT_NAME'
 PREFIX = 'PREFIX'
@@ -38,15 +74,27 @@ PREFIX = 'PREFIX'
 SOURCE = 'source'
 PAGE = 'page'
 DOC_TYPE = 'doc_type'
+RECORD_ID = 'record_id'
 MD5HEXHASH = 'md5HexHash'
 FILE_NAME = 'file_name'
 APPLICATION = 'application'
 HITS = 'hits'
 ACCESS_LEVEL = 'access_level' #Internal Or External Access for a document
+NAME = 'name'
+ETAG = 'etag'
+LAST_MODIFIED = 'last_modified'
 
 DOCUMENTATION = 'documentation'
-TEAMS = 'teams'
-SALESFORCE = 'salesforce'
+
+#removes the files in params.file_names from metadata.source and adds the params.sources it doesn't list yet, on the list the
+#chunk has when the update runs so writers changing the same chunk meanwhile keep their sources. Deletes the chunk once no source is left
+UPDATE_SOURCES_SCRIPT = """
+List sources = ctx._source.metadata.source;
+int before = sources.size();
+boolean removed = sources.removeIf(s -> params.file_names.contains(s.get('file_name')));
+for (def s : params.sources) { if (!sources.contains(s)) { sources.add(s); } }
+if (sources.isEmpty()) { ctx.op = 'delete'; } else if (!removed && sources.size() == before) { ctx.op = 'noop'; }
+"""
 
 PRODUCT_AREAS = ['ATO', 'BillBlast', 'Docketing', 'Expert', 'Handshake', 'iTimekeep', 'Rainmaker', 'vibyaderant', 'testing']
 PRODUCT_CONTAINERS = {
@@ -74,7 +122,16 @@ PRODUCT_INDEXES = {
 
 
 
+def get_azure_connection_string():
+    # Using the connection string from function app
+    return os.environ['askmaddiknowledgeset_STORAGE']
+
+
+
+
+
 def split_sample_questions_by_line(split_documents:list[Document]):
+    from langchain.schema import Document
     logging.log(logging.DEBUG, 'split_sample_questions_by_line')
     split_by_line_documents: list[Document]=[]
     for doc in split_documents:
@@ -94,90 +151,32 @@ def split_sample_questions_by_line(split_documents:list[Document]):
 
 
 
-def load_teams_json(record: dict, metadata:dict):
-    teams_metadata_include = set(['TeamId', 'ChannelId', 'MessageId', 'Date', 'Url'])
-    metadata['doc_type'] = 'teams'
-    metadata.update({k: v for k, v in record.items() if k in teams_metadata_include})
-    text = record['Conversation']
-    return text, metadata
-
-
-
-
-def load_salesforce_json(record: dict, metadata:dict):
-    meta_include = set(["TITLE", "URLNAME"])
-    text_exclude = set(["AUTHOR__C", "CREATEDBYID", "ID", "KNOWLEDGEARTICLEID", "ARTICLENUMBER", "PUBLISHSTATUS", "RECORDTYPEID", "VERSIONNUMBER", "OWNERID" ])
-    metadata['doc_type'] = 'salesforce'
-    metadata.update({key: val for key, val in record.items() if (key in text_exclude) or (key in meta_include)})
-    text = "\n\n".join(["{}: {}".format(key, val) for key, val in record.items() if (isinstance(val, str)) and (key not in text_exclude)])
-    return text, metadata
-
-
-
-
-def load_json_document(json_file_path:str, json_loader_func) -> list[Document]:
-    logging.log(logging.DEBUG, 'load_json_document')
-    documents: list[Document] = []
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        record = json.load(f)
-        metadata = {}
-        text, metadata = json_loader_func(record, metadata)
-        metadata[SOURCE] = json_file_path
-        documents.append(Document(page_content=text, metadata=metadata))
-    return documents
-
-
-
-
-def langchain_load_document(full_file_name:str):
+def langchain_load_document(full_file_name:str, data:bytes = None):
+    #data, when given, is the file's content and full_file_name is only used as its name and source
     logging.log(logging.DEBUG, 'langchain_load_document for file: ' + full_file_name)
-    loaded_document = []
-    split_name = os.path.splitext(full_file_name)
-    file_extension_lower = split_name[1].lower()
-    # if file_extension_lower == '.pdf':
-    #     document_loader = langchain.document_loaders.PyPDFLoader(full_file_name)
-    if file_extension_lower == '.json':
-        if split_name[0].endswith(TEAMS):
-            json_load_func = load_teams_json
-        elif split_name[0].endswith(SALESFORCE):
-            json_load_func = load_salesforce_json
-        return load_json_document(full_file_name, json_load_func)
-    elif file_extension_lower == '.xlsx' and "Resolved Issues in Updates".casefold() in full_file_name.casefold(): 
-        excel_documents: list[Document] = []
-        df = pd.read_excel(full_file_name, sheet_name=None, dtype=str)
-        pd.options.display.max_colwidth = 1000
-        for frame in df:
-            df[frame]=df[frame].fillna('')
-            text = ''
-            for _, row in df[frame].iterrows():
-                text = text + row.to_string().replace("  ", "")+ '\n'
-            metadata = {}
-            metadata['source'] = full_file_name
-            excel_documents.append(Document(page_content=text, metadata=metadata))       
-        return excel_documents
-    else:
-        document_loader = langchain.document_loaders.UnstructuredFileLoader(full_file_name)
-    try:
-        loaded_document = document_loader.load()
-    except Exception as e:
-        print("Unable to load file: " + full_file_name + 'with error: ' + str(e))
-        logging.exception("Unable to load file: " + full_file_name)
-    
-    return loaded_document
+    #the loader registry picks the loader for the file type and only then imports the parser it needs
+    document_loader = get_document_loader(full_file_name)
+    if data is None:
+        return document_loader(full_file_name)
+    return document_loader(full_file_name, file=BytesIO(data))
 
 
 
 
 
+@staged('split')
 def langchain_split_documents(loaded_documents: list[Document], is_sample_questions:bool):
     logging.log(logging.DEBUG, 'langchain_split_documents')
     if is_sample_questions:
         split_documents = split_sample_questions_by_line(loaded_documents)
     else:
-        chunk_size = 1500
-        chunk_overlap = 150
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        if CHUNK_SIZE_UNIT == 'tokens':
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=count_text_tokens)
+        else:
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
         split_documents = text_splitter.split_documents(loaded_documents)
+    add(CHUNKS, len(split_documents))
     return split_documents
 
 
@@ -185,58 +184,231 @@ def langchain_split_documents(loaded_documents: list[Document], is_sample_questi
 
 
 #may need to be running as admin to access network location
-def load_from_directory(is_sample_questions:bool):
+def iter_documents_from_directory():
     path = os.getenv(DIRECTORY_CONNECTION_STRING)
     logging.log(logging.DEBUG, 'load_from_directory')   
     path = Path(path)
     #gets all non hidden files(**/[!,]*) in given path, for entire subtree of path, return full path of file
-    files_to_process = [str(file) for file in path.glob('**/[!.]*') if file.is_file()]
+    for file in path.glob('**/[!.]*'):
+        if file.is_file():
+            document = langchain_load_document(str(file))
+            if len(document) > 0:
+                yield document
+
+
+
+
+
+def load_from_directory(is_sample_questions:bool):
     documents: list[Document] = []
-    for file_name in files_to_process:
-        document = langchain_load_document(file_name)
-        if len(document) > 0:
-            documents.extend(document)
+    for document in iter_documents_from_directory():
+        documents.extend(document)
     return langchain_split_documents(documents, is_sample_questions)
 
 
 
 
 
-def load_from_azure_container(container_name:str, is_sample_questions:bool, prefix:str, last_processed_time:datetime):
-    if is_sample_questions:
-        connection_string = AZURE_CONNECTION_STRING
-        prefix = None
+def create_container_client(container_name:str, connection_string:str = None):
+    if connection_string is None:
+        connection_string = get_azure_connection_string()
+    #one client per container, blob clients created from it share its connection pool
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=BLOB_DOWNLOAD_CONCURRENCY, pool_maxsize=BLOB_DOWNLOAD_CONCURRENCY)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return ContainerClient.from_connection_string(conn_str=connection_string, container_name=container_name, transport=RequestsTransport(session=session))
+
+
+
+
+
+def download_blob_to_file(azure_container:ContainerClient, blob_name:str, full_file_path:str):
+    os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+    with open(full_file_path, "wb") as file:
+        blob_data = azure_container.get_blob_client(blob_name).download_blob()
+        blob_data.readinto(file)
+
+
+
+
+
+def parse_document(full_file_path:str, data:bytes, parse_pool:ProcessPoolExecutor):
+    if parse_pool is None:
+        return langchain_load_document(full_file_path, data)
+    #Unstructured and pandas parsing is CPU bound so hand it to a separate process
+    return parse_pool.submit(langchain_load_document, full_file_path, data).result()
+
+
+
+
+
+def download_and_load_blob(azure_container:ContainerClient, container_name:str, blob, full_file_path:str, parse_pool:ProcessPoolExecutor, parse_cache):
+    if parse_cache is not None:
+        #an unchanged file parsed before (by an earlier run or for another index) is neither downloaded nor parsed again
+        documents = parse_cache.get(container_name, blob, full_file_path)
+        if documents is not None:
+            return documents
+    if blob.size is not None and blob.size <= IN_MEMORY_PARSE_MAX_BYTES:
+        #small blobs (most json records) never touch the disk, full_file_path is only their source
+        with stage('download'):
+            data = azure_container.get_blob_client(blob.name).download_blob().readall()
+            add(BYTES, len(data))
+        with stage('parse'):
+            documents = parse_document(full_file_path, data, parse_pool)
+            add(DOCUMENTS, len(documents))
     else:
-        connection_string = AZURE_CONNECTION_STRING
-    logging.info(f'Loading from Azure container: {container_name}')
-    azure_container = ContainerClient.from_connection_string(conn_str=connection_string, container_name=container_name)
-    #set prefix if you only want to grab specific items or folders in container (i.e. Billing of Billing/Teams)
-    blob_list = azure_container.list_blobs(name_starts_with=prefix)
-    documents: list[Document] = []
+        with stage('download'):
+            download_blob_to_file(azure_container, blob.name, full_file_path)
+            add(BYTES, blob.size)
+        try:
+            with stage('parse'):
+                documents = parse_document(full_file_path, None, parse_pool)
+                add(DOCUMENTS, len(documents))
+        finally:
+            #the file is only needed for parsing, remove it so temp disk usage stays bounded
+            os.remove(full_file_path)
+    if parse_cache is not None:
+        parse_cache.set(container_name, blob, full_file_path, documents)
+    return documents
+
+
+
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+
+
+
+def start_parse_pool():
+    #one process pool per worker shared by every product area, started by the timer runs before their product area threads.
+    #queue messages run on the host's threads from the start so they never start it, forking then could copy a lock another
+    #thread holds into the workers
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None and DOCUMENT_PARSE_WORKERS > 0:
+            _parse_pool = ProcessPoolExecutor(max_workers=DOCUMENT_PARSE_WORKERS)
+            #the first task starts every worker process, do it now so they are forked before product area threads start
+            _parse_pool.submit(os.getpid).result()
+    return _parse_pool
+
+
+
+
+
+def get_parse_pool():
+    #the pool start_parse_pool started, None when parsing on the download threads
+    return _parse_pool
+
+
+
+
+
+def iter_loaded_blobs(azure_container:ContainerClient, container_name:str, blobs, temp_dir:str):
+    #downloads and parses blobs concurrently, yields (full_file_path, documents) in the same order as blobs
+    #at most BLOB_PIPELINE_MAX_IN_FLIGHT blobs are pending at a time so blobs is only consumed as results are used
+    parse_pool = get_parse_pool()
+    parse_cache = get_parse_cache(get_azure_connection_string(), get_loader_version())
+    #downloads run on the pool but are attributed to this product area
+    load_blob = bind(download_and_load_blob)
+    with ThreadPoolExecutor(max_workers=BLOB_DOWNLOAD_CONCURRENCY) as download_pool:
+        in_flight = deque()
+        for blob in blobs:
+            full_file_path = f"{temp_dir}/{container_name}/{blob.name}"
+            in_flight.append((full_file_path, download_pool.submit(load_blob, azure_container, container_name, blob, full_file_path, parse_pool, parse_cache)))
+            if len(in_flight) >= BLOB_PIPELINE_MAX_IN_FLIGHT:
+                full_file_path, future = in_flight.popleft()
+                yield full_file_path, future.result()
+        while in_flight:
+            full_file_path, future = in_flight.popleft()
+            yield full_file_path, future.result()
+
+
+
+
+
+def iter_changed_blobs(blob_list, last_processed_time:datetime, manifest_entries:dict = None, processed_blobs:list = None):
     for blob in blob_list:
+        if manifest_entries is not None:
+            #with an ingestion manifest only blobs that are new or whose etag changed since they were processed are loaded
+            if not is_blob_changed(manifest_entries, blob.name, blob.etag):
+                continue
         #filter on blob.last_modified and if it isn't newer than the last time it was processed skip it
-        if blob.last_modified.timestamp() < last_processed_time.timestamp():
+        elif last_processed_time is not None and blob.last_modified.timestamp() < last_processed_time.timestamp():
             continue
-        client = BlobClient.from_connection_string(conn_str=connection_string, container_name=container_name, blob_name=blob.name)
-        with tempfile.TemporaryDirectory() as temp_dir:
-            full_file_path = f"{temp_dir}/{container_name}/{blob.name}"
-            os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
-            with open(f"{full_file_path}", "wb") as file:
-                blob_data = client.download_blob()
-                blob_data.readinto(file)
-            document = langchain_load_document(full_file_path)
+        if processed_blobs is not None:
+            processed_blobs.append({NAME: blob.name, ETAG: blob.etag, LAST_MODIFIED: blob.last_modified})
+        add(BLOBS_CHANGED)
+        yield blob
+
+
+
+
+
+def iter_blob_properties(azure_container:ContainerClient, blob_names:list):
+    for blob_name in blob_names:
+        try:
+            yield azure_container.get_blob_client(blob_name).get_blob_properties()
+        except ResourceNotFoundError:
+            #the blob was removed after it was queued, nothing left to load
+            logging.log(logging.WARNING, f'Blob not found, skipping: {blob_name}')
+
+
+
+
+
+def iter_documents_from_azure_container(container_name:str, is_sample_questions:bool, prefix:str, last_processed_time:datetime, manifest_entries:dict = None, processed_blobs:list = None, blob_names:list = None, blob_listings:list = None, list_changed_first:bool = False):
+    #yields the loaded documents of one blob at a time
+    #processed_blobs, when given, gets the name, etag and last_modified of every blob that is loaded
+    #blob_names, when given, loads just those blobs instead of listing the container
+    #blob_listings, when given, gets the listing used so the caller can commit it once the blobs are uploaded
+    #list_changed_first reads the whole listing before the first blob is loaded, so processed_blobs holds every changed blob from the start
+    if is_sample_questions:
+        connection_string = get_azure_connection_string()
+        prefix = None
+    else:
+        connection_string = get_azure_connection_string()
+    logging.info(f'Loading from Azure container: {container_name}')
+    azure_container = create_container_client(container_name, connection_string)
+    if blob_names is not None:
+        blob_list = iter_blob_properties(azure_container, blob_names)
+    else:
+        #set prefix if you only want to grab specific items or folders in container (i.e. Billing of Billing/Teams)
+        blob_listing = BlobListing(azure_container, connection_string, prefix, last_processed_time, f'upload/{container_name}/{prefix or ""}')
+        blob_list = iterate('list', blob_listing.list_blobs(), BLOBS_LISTED)
+        #None when only changed blobs were listed, otherwise the time to filter the listing on
+        last_processed_time = blob_listing.last_processed_time
+        if blob_listings is not None:
+            blob_listings.append(blob_listing)
+    changed_blobs = iter_changed_blobs(blob_list, last_processed_time, manifest_entries, processed_blobs)
+    if list_changed_first:
+        changed_blobs = list(changed_blobs)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for full_file_path, document in iter_loaded_blobs(azure_container, container_name, changed_blobs, temp_dir):
             print(full_file_path)
             logging.log(logging.INFO, f'Loaded document: {full_file_path}')
-            documents.extend(document)
+            yield document
+
+
+
+
+
+def load_from_azure_container(container_name:str, is_sample_questions:bool, prefix:str, last_processed_time:datetime, manifest_entries:dict = None, processed_blobs:list = None, blob_names:list = None, blob_listings:list = None):
+    documents: list[Document] = []
+    for document in iter_documents_from_azure_container(container_name, is_sample_questions, prefix, last_processed_time, manifest_entries, processed_blobs, blob_names, blob_listings):
+        documents.extend(document)
     return langchain_split_documents(documents, is_sample_questions)
 
 
 
 
 
-def load_documents(from_azure_container:bool, from_directory:bool, is_sample_questions:bool, container_name:str, prefix:str, last_processed_time:datetime):
+def load_documents(from_azure_container:bool, from_directory:bool, is_sample_questions:bool, container_name:str, prefix:str, last_processed_time:datetime, manifest_entries:dict = None, processed_blobs:list = None, blob_names:list = None, blob_listings:list = None):
     if from_azure_container:
-        split_documents = load_from_azure_container(container_name, is_sample_questions, prefix, last_processed_time)
+        split_documents = load_from_azure_container(container_name, is_sample_questions, prefix, last_processed_time, manifest_entries, processed_blobs, blob_names, blob_listings)
     elif from_directory:
         split_documents = load_from_directory(is_sample_questions)
     else:
@@ -247,18 +419,47 @@ def load_documents(from_azure_container:bool, from_directory:bool, is_sample_que
 
 
 
-def update_metadata(split_documents: list[Document], container_name:str, from_azure_container:bool):
+def iter_split_document_batches(from_azure_container:bool, from_directory:bool, is_sample_questions:bool, container_name:str, prefix:str, last_processed_time:datetime, batch_size:int = STREAM_BATCH_SIZE, manifest_entries:dict = None, processed_blobs:list = None, blob_listings:list = None, list_changed_first:bool = False):
+    #streaming version of load_documents, splits each file as soon as it is loaded and yields lists of at most batch_size chunks
+    if from_azure_container:
+        loaded_documents = iter_documents_from_azure_container(container_name, is_sample_questions, prefix, last_processed_time, manifest_entries, processed_blobs, None, blob_listings, list_changed_first)
+    elif from_directory:
+        loaded_documents = iter_documents_from_directory()
+    else:
+        raise Exception("Unknown source to load documents from")
+    batch: list[Document] = []
+    for document in loaded_documents:
+        batch.extend(langchain_split_documents(document, is_sample_questions))
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if len(batch) > 0:
+        yield batch
+
+
+
+
+
+@staged('metadata')
+def update_metadata(split_documents: list[Document], container_name:str, from_azure_container:bool, previous_ids:set = None):
+    #previous_ids holds ids handed out to earlier batches when streaming, new ids are added to it
+    used_ids = previous_ids if previous_ids is not None else set()
+    #next suffix to try for each source+page so chunks of the same page don't rescan the suffixes already handed out
+    next_suffix = {}
     ids = []
     texts = [doc.page_content for doc in split_documents]
     metadata = [doc.metadata for doc in split_documents]
 
     for doc in split_documents:       
-        docId = os.path.basename(doc.metadata.get(SOURCE)) + '.' + str(doc.metadata.get(PAGE))
-        newDocId = docId
-        count = 0
-        while newDocId in ids:
+        #records of a json bundle share the bundle as their source, their record_id takes the place of the page
+        docId = os.path.basename(doc.metadata.get(SOURCE)) + '.' + str(doc.metadata.get(RECORD_ID, doc.metadata.get(PAGE)))
+        count = next_suffix.get(docId, 0)
+        newDocId = docId if count == 0 else docId + '.' + str(count)
+        while newDocId in used_ids:
             count = count + 1
             newDocId = docId + '.' + str(count)
+        next_suffix[docId] = count + 1
+        used_ids.add(newDocId)
         ids.append(newDocId)
 
     for t, m in zip(texts, metadata):
@@ -294,67 +495,170 @@ def update_metadata(split_documents: list[Document], container_name:str, from_az
 
 
 
+def remove_chunks(texts, metadata, ids, indexes_to_remove):
+    #rebuilds the lists in place in a single pass, deleting one index at a time is quadratic on large containers
+    if len(indexes_to_remove) == 0:
+        return
+    indexes_to_remove = set(indexes_to_remove)
+    texts[:] = [t for i, t in enumerate(texts) if i not in indexes_to_remove]
+    metadata[:] = [m for i, m in enumerate(metadata) if i not in indexes_to_remove]
+    ids[:] = [d for i, d in enumerate(ids) if i not in indexes_to_remove]
+
+
+
+
+@staged('dedup')
 def check_for_duplicates(texts, metadata, ids):    
     #checks selected documents for any chunks that have the same hash and updates the metadata to show both files and removes the second instance of them
     #if you rerun this without resetting/rerunning previous code the source value will get messed up
-    hashes = []
+    #uses the md5HexHash set by update_metadata so each chunk is only hashed once
+    first_index_by_hash = {}
     indexesToRemove = []
-    for i, text in enumerate(texts):
-        md5Hash = hashlib.md5(text.encode()).hexdigest()
-        if md5Hash in hashes:
-            matchFound = False
-            for j, metadatum in enumerate(metadata):
-                if metadatum.get(MD5HEXHASH) == md5Hash:
-                    indexesToRemove.append(i)
-                    matchFound = True
-                    break
-            if matchFound:
-                metadata[j][SOURCE].extend(metadata[i][SOURCE])
+    for i, metadatum in enumerate(metadata):
+        md5Hash = metadatum.get(MD5HEXHASH)
+        if md5Hash is None:
+            md5Hash = hashlib.md5(texts[i].encode()).hexdigest()
+            metadatum[MD5HEXHASH] = md5Hash
+        j = first_index_by_hash.get(md5Hash)
+        if j is None:
+            first_index_by_hash[md5Hash] = i
         else:
-            hashes.append(md5Hash)
-            metadata[i][MD5HEXHASH] = md5Hash
+            metadata[j][SOURCE].extend(metadatum[SOURCE])
+            indexesToRemove.append(i)
             
-    indexesToRemove.reverse()
     print("Removing duplicates: " + str(len(indexesToRemove)))
-    for index in indexesToRemove:
-        del texts[index]
-        del metadata[index]
-        del ids[index]
+    remove_chunks(texts, metadata, ids, indexesToRemove)
     
 
 
 
-def create_vector_store(index_name:str):
-    logging.info(f'Creating vector store for index: {index_name}')
-    
+@staged('dedup')
+def check_for_duplicates_in_previous_batches(texts, metadata, ids, previous_hashes:set):
+    #when streaming, chunks whose hash was already uploaded in an earlier batch are removed and their metadata returned,
+    #update_held_sources adds their source to the chunk each index holds for the hash. Which chunk that is differs
+    #between indexes (elastic dedup can merge the first chunk into an existing one) so only the hashes are kept here
+    duplicates = []
+    indexesToRemove = []
+    for i, metadatum in enumerate(metadata):
+        md5Hash = metadatum[MD5HEXHASH]
+        if md5Hash in previous_hashes:
+            duplicates.append(metadatum)
+            indexesToRemove.append(i)
+        else:
+            previous_hashes.add(md5Hash)
+
+    remove_chunks(texts, metadata, ids, indexesToRemove)
+    return duplicates
+
+
+
+def update_held_sources(vectorElastic, elastic_index_name, held_chunks:dict, duplicates:list):
+    #the chunk an index holds for a hash is the one uploaded, or the existing chunk check_elastic_for_duplicates merged it into
+    sources_to_add = {}
+    for metadatum in duplicates:
+        compute_new_source_value(sources_to_add.setdefault(held_chunks[metadatum[MD5HEXHASH]], []), metadatum[SOURCE])
+    update_sources_in_elastic(vectorElastic, elastic_index_name, sources_to_add)
+
+
+
+
+def source_update_action(elastic_index_name:str, elastic_id:str, sources_to_add:list = None, file_names_to_remove = None):
+    #only the changes are sent, so writers updating the same chunk at the same time don't undo each other's sources
+    return {
+        '_op_type': 'update',
+        '_index': elastic_index_name,
+        '_id': elastic_id,
+        'retry_on_conflict': SOURCE_UPDATE_RETRY_ON_CONFLICT,
+        'script': {'source': UPDATE_SOURCES_SCRIPT, 'lang':'painless', 'params':{'sources': sources_to_add or [], 'file_names': sorted(file_names_to_remove or [])}}
+    }
+
+
+
+
+def update_sources_in_elastic(vectorElastic, elastic_index_name, sources_to_add:dict, file_names_to_remove:dict = None):
+    from elasticsearch import helpers
+    #sends every source update in a single _bulk request instead of one update call per chunk, refreshed so the chunks
+    #looked up next (by the next stream batch or another queue message) list the new sources
+    if file_names_to_remove is None:
+        file_names_to_remove = {}
+    elastic_ids = list(sources_to_add) + [elastic_id for elastic_id in file_names_to_remove if elastic_id not in sources_to_add]
+    if len(elastic_ids) == 0:
+        return
+    update_actions = [source_update_action(elastic_index_name, elastic_id, sources_to_add.get(elastic_id), file_names_to_remove.get(elastic_id)) for elastic_id in elastic_ids]
+    helpers.bulk(vectorElastic.client, update_actions, refresh=True)
+
+
+
+
+def create_embeddings():
+    from EmbeddingCache import with_embedding_cache
+    import httpx
+    from langchain_openai.embeddings import OpenAIEmbeddings, AzureOpenAIEmbeddings
+    open_ai_key = os.environ['OPEN_AI_KEY']
+    open_ai_deployment = os.environ['OPEN_AI_DEPLOYMENT']
+    open_ai_model = os.environ['OPEN_AI_MODEL']
+    open_ai_base = os.environ['OPEN_AI_BASE']
+    open_ai_type = os.environ['OPEN_AI_TYPE']
+    open_ai_version = os.environ['OPEN_AI_VERSION']
+    #connection pool big enough for every embedding request the executor keeps in flight
+    http_client = httpx.Client(limits=httpx.Limits(max_connections=EMBEDDING_CONCURRENCY, max_keepalive_connections=EMBEDDING_CONCURRENCY))
+    #max_retries=0: the executor retries 429s itself so every thread waits on the same Retry-After pause, the openai
+    #client would otherwise retry them on its own inside the request
     # Use environment variables directly
-    if OPEN_AI_TYPE == 'azure':
+    if open_ai_type == 'azure':
         embedding = AzureOpenAIEmbeddings(
-            openai_api_key=OPEN_AI_KEY,
-            deployment=OPEN_AI_DEPLOYMENT, 
-            model=OPEN_AI_MODEL, 
-            azure_endpoint=OPEN_AI_BASE,
-            openai_api_type=OPEN_AI_TYPE, 
-            openai_api_version=OPEN_AI_VERSION
+            openai_api_key=open_ai_key,
+            deployment=open_ai_deployment, 
+            model=open_ai_model, 
+            azure_endpoint=open_ai_base,
+            openai_api_type=open_ai_type, 
+            openai_api_version=open_ai_version,
+            http_client=http_client,
+            max_retries=0
         )
     else:
         embedding = OpenAIEmbeddings(
-            openai_api_key=OPEN_AI_KEY,
-            deployment=OPEN_AI_DEPLOYMENT, 
-            model=OPEN_AI_MODEL, 
-            openai_api_base=OPEN_AI_BASE,
-            openai_api_type=OPEN_AI_TYPE, 
-            openai_api_version=OPEN_AI_VERSION
+            openai_api_key=open_ai_key,
+            deployment=open_ai_deployment, 
+            model=open_ai_model, 
+            openai_api_base=open_ai_base,
+            openai_api_type=open_ai_type, 
+            openai_api_version=open_ai_version,
+            http_client=http_client,
+            max_retries=0
         )
+    #unchanged chunks reuse the vector stored under their md5HexHash instead of calling the embedding api again
+    return with_embedding_cache(embedding, f'{open_ai_model}/{open_ai_deployment}', get_azure_connection_string())
+
+
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+
+
+def get_embeddings():
+    #embeddings client shared by every product area and trigger invocation in the worker
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            _embeddings = create_embeddings()
+    return _embeddings
+
 
-    es_connection = Elasticsearch(
-        cloud_id=ELASTIC_CLOUD_ID,
-        basic_auth=[ELASTIC_USERNAME, ELASTIC_PASSWORD]
-    )
+
+
+def create_vector_store(index_name:str, embedding=None):
+    from langchain_community.vectorstores.elasticsearch import ElasticsearchStore
+    logging.info(f'Creating vector store for index: {index_name}')
+    if embedding is None:
+        embedding = get_embeddings()
 
     return ElasticsearchStore(
         index_name=index_name,
-        es_connection=es_connection,
+        es_connection=get_elastic_client(),
         embedding=embedding
     )
 
@@ -366,7 +670,7 @@ def compute_new_source_value(existing_source, new_file_source):
     if type(existing_source) is list and type(new_file_source) is list:
         for file_source in new_file_source:
             if file_source not in existing_source:
-                existing_source = existing_source.append(file_source)
+                existing_source.append(file_source)
                 need_to_run_update = True
     else:
         logging.log(logging.ERROR, 'Either existing or new source field not a list')
@@ -376,85 +680,526 @@ def compute_new_source_value(existing_source, new_file_source):
 
 
 
-def update_source_in_elastic(vectorElastic, elastic_id, elastic_index_name, existing_source, new_file_source):
-    need_to_run_update, existing_source = compute_new_source_value(existing_source, new_file_source)
-    if need_to_run_update:
-        update_script = {'source':"ctx._source.metadata.source = params.source", 'lang':'painless', 'params':{'source': existing_source}}
-        vectorElastic.client.update(index=elastic_index_name, id=elastic_id, script=update_script)
+@staged('elastic dedup')
+def check_elastic_for_duplicates(vectorElastic: ElasticsearchStore, elastic_index_name:str, metadata:list, texts:list, ids:list, held_chunks:dict = None, file_names:set = None):
+    #held_chunks, when given, gets md5HexHash -> id of the existing chunk each removed chunk was merged into
+    #file_names, when given, are the files being reconciled, see reconcile_hits. The ones a merged into chunk lists that
+    #aren't a source of the chunk merged into it are removed from it, their new versions don't have the text
+    from elasticsearch import helpers
+    logging.log(logging.DEBUG, 'check_elastic_for_duplicates')
+    if not vectorElastic.client.indices.exists(index=elastic_index_name):
+        return
+    indexes_in_elastic = []
+    sources_to_add = {}
+    file_names_to_remove = {}
+    if file_names is not None:
+        #chunk ids start with the base name of the file they were made from
+        reconciled_id_prefixes = tuple(os.path.basename(file_name) + '.' for file_name in file_names)
+    for x in range(0, len(metadata), DUPLICATE_CHECK_BATCH_SIZE):
+        #look up a whole batch of hashes with one terms query rather than one search per chunk, scrolled since
+        #a hash indexed many times can make a batch match more chunks than one search returns
+        batch_hashes = list({data.get(MD5HEXHASH) for data in metadata[x:x+DUPLICATE_CHECK_BATCH_SIZE]})
+        hits_by_hash = {}
+        for hit in helpers.scan(vectorElastic.client, index=elastic_index_name, query={'query': {'terms': {'metadata.md5HexHash.keyword': batch_hashes}}}, _source=['metadata.source', 'metadata.md5HexHash']):
+            hits_by_hash.setdefault(hit['_source']['metadata'][MD5HEXHASH], []).append(hit)
+        for i in range(x, min(x + DUPLICATE_CHECK_BATCH_SIZE, len(metadata))):
+            hash_hits = hits_by_hash.get(metadata[i].get(MD5HEXHASH), [])
+            if file_names is not None:
+                hash_hits = reconcile_hits(metadata, i, hash_hits, reconciled_id_prefixes, file_names)
+            if len(hash_hits) == 1:
+                existing_id_with_hash = hash_hits[0]["_id"]
+                if existing_id_with_hash != ids[i]:
+                    #several new chunks can share one existing chunk so keep building on the source already collected for it
+                    existing_source = hash_hits[0]['_source']['metadata'][SOURCE]
+                    need_to_run_update, existing_source = compute_new_source_value(existing_source, metadata[i].get(SOURCE))
+                    if need_to_run_update:
+                        compute_new_source_value(sources_to_add.setdefault(existing_id_with_hash, []), metadata[i].get(SOURCE))
+                    dropped_file_names = get_dropped_file_names(existing_source, metadata[i], file_names) if file_names is not None else set()
+                    if len(dropped_file_names) > 0:
+                        file_names_to_remove[existing_id_with_hash] = dropped_file_names
+                    if held_chunks is not None:
+                        held_chunks[metadata[i][MD5HEXHASH]] = existing_id_with_hash
+                    indexes_in_elastic.append(i)
+
+    #apply all source merges through one bulk request
+    update_sources_in_elastic(vectorElastic, elastic_index_name, sources_to_add, file_names_to_remove)
+    #now remove those whose hash already exists in elastic
+    remove_chunks(texts, metadata, ids, indexes_in_elastic)
+
+
+
+
+def reconcile_hits(metadata:list, i:int, hash_hits:list, reconciled_id_prefixes:tuple, file_names:set):
+    #the hits chunk i can be merged into. Chunks only the reconciled files list are rewritten or deleted by reconciliation,
+    #and a chunk under a reconciled file's id can be overwritten by that file's new version (in a later batch when
+    #streaming, which is why streams list every changed blob first), so neither is merged into. The files such a chunk
+    #lists besides the reconciled ones are moved onto chunk i, in a copy of its metadata as the other indexes share it
+    merge_targets = []
+    for hit in hash_hits:
+        other_source = [file_source for file_source in hit['_source']['metadata'][SOURCE] if file_source.get(FILE_NAME) not in file_names]
+        if hit['_id'].startswith(reconciled_id_prefixes):
+            moved_source = [file_source for file_source in other_source if file_source not in metadata[i][SOURCE]]
+            if len(moved_source) > 0:
+                metadata[i] = {**metadata[i], SOURCE: metadata[i][SOURCE] + moved_source}
+        elif len(other_source) > 0:
+            merge_targets.append(hit)
+    return merge_targets
+
+
+
+@staged('index')
+def upload_to_elastic(vectorElastic:ElasticsearchStore, texts:list, metadata:list, ids:list, vectors:list):
+    from elasticsearch import helpers
+    #texts, metadata, ids and vectors should all be the same length
+    if len(texts) == 0:
+        return
+    #same documents ElasticsearchStore.add_embeddings would create, but sent through the bulk helpers, into an index created
+    #from its index template (or with langchain's default mapping when templates aren't managed)
+    ensure_index(vectorElastic.client, vectorElastic.index_name, len(vectors[0]))
+    index_actions = ({
+        '_op_type': 'index',
+        '_index': vectorElastic.index_name,
+        '_id': i,
+        vectorElastic.query_field: t,
+        vectorElastic.vector_query_field: v,
+        'metadata': m
+    } for t, m, i, v in zip(texts, metadata, ids, vectors))
+    if INDEX_BULK_THREADS > 1:
+        results = helpers.parallel_bulk(vectorElastic.client, index_actions, thread_count=INDEX_BULK_THREADS, chunk_size=INDEX_BULK_MAX_DOCS, max_chunk_bytes=INDEX_BULK_MAX_BYTES)
+    else:
+        results = helpers.streaming_bulk(vectorElastic.client, index_actions, chunk_size=INDEX_BULK_MAX_DOCS, max_chunk_bytes=INDEX_BULK_MAX_BYTES, max_retries=INDEX_BULK_MAX_RETRIES, initial_backoff=2)
+    indexed_count = 0
+    for ok, _ in results:
+        if ok:
+            indexed_count = indexed_count + 1
+    vectorElastic.client.indices.refresh(index=vectorElastic.index_name)
+    add(CHUNKS, indexed_count)
+    print(f'Indexed {str(indexed_count)} chunks into {vectorElastic.index_name}')
+
+
+
+def get_dropped_file_names(existing_source:list, metadatum:dict, file_names:set):
+    #the reconciled files an existing chunk lists whose new version doesn't have its text, metadatum is the new chunk with
+    #that text and lists every reconciled file that does (those of later stream batches are added as duplicates)
+    kept_file_names = {file_source.get(FILE_NAME) for file_source in metadatum[SOURCE]}
+    return {file_source.get(FILE_NAME) for file_source in existing_source if file_source.get(FILE_NAME) in file_names and file_source.get(FILE_NAME) not in kept_file_names}
+
+
+
+def get_file_names(container_name:str, processed_blobs:list, metadata:list):
+    #file_name values (container_name/blob_name) of every processed file, including blobs that produced no chunks
+    file_names = {file_source[FILE_NAME] for m in metadata for file_source in m[SOURCE]}
+    file_names.update(container_name + '/' + blob[NAME] for blob in processed_blobs)
+    return file_names
+
+
+
+@staged('fetch existing chunks')
+def fetch_existing_chunks(vectorElastic:ElasticsearchStore, elastic_index_name:str, file_names:set):
+    from elasticsearch import helpers
+    #returns {id: (md5HexHash, source)} of every chunk in the index that lists one of the files as a source
+    existing_chunks = {}
+    if len(file_names) == 0 or not vectorElastic.client.indices.exists(index=elastic_index_name):
+        return existing_chunks
+    file_names = list(file_names)
+    for x in range(0, len(file_names), DUPLICATE_CHECK_BATCH_SIZE):
+        for hit in helpers.scan(vectorElastic.client, index=elastic_index_name, query={'query': {'terms': {'metadata.source.file_name.keyword': file_names[x:x+DUPLICATE_CHECK_BATCH_SIZE]}}}, _source=['metadata.md5HexHash', 'metadata.source']):
+            existing_chunks[hit['_id']] = (hit['_source']['metadata'].get(MD5HEXHASH), hit['_source']['metadata'][SOURCE])
+    return existing_chunks
+
+
+
+def remove_unchanged_chunks(texts:list, metadata:list, ids:list, existing_chunks:dict, held_chunks:dict = None, file_names:set = None, file_names_to_remove:dict = None):
+    #chunks already indexed under the same id with the same text don't need to be embedded or written again.
+    #file_names_to_remove, when given, gets the reconciled files (file_names) an unchanged chunk lists that no longer have it
+    indexes_unchanged = [i for i, (m, chunk_id) in enumerate(zip(metadata, ids)) if chunk_id in existing_chunks and existing_chunks[chunk_id][0] == m[MD5HEXHASH]]
+    if held_chunks is not None:
+        held_chunks.update((metadata[i][MD5HEXHASH], ids[i]) for i in indexes_unchanged)
+    if file_names_to_remove is not None:
+        for i in indexes_unchanged:
+            dropped_file_names = get_dropped_file_names(existing_chunks[ids[i]][1], metadata[i], file_names)
+            if len(dropped_file_names) > 0:
+                file_names_to_remove[ids[i]] = dropped_file_names
+    remove_chunks(texts, metadata, ids, indexes_unchanged)
+    return len(indexes_unchanged)
+
+
+
+@staged('reconcile')
+def keep_shared_chunks(vectorElastic:ElasticsearchStore, elastic_index_name:str, texts:list, metadata:list, ids:list, existing_chunks:dict, file_names:set, held_chunks:dict):
+    """
+    An id about to be rewritten with new text can hold a chunk that files besides the reconciled ones (file_names) list,
+    merged into it by elastic dedup or shared in an earlier run. Their sources move to the chunk the index holds for the
+    old text, or when the index holds none (or it is being rewritten too) the old chunk is copied to an id of one of those
+    files, appended to texts, metadata and ids to be uploaded with them. Returns the sources to add once they are indexed
+    """
+    from elasticsearch import helpers
+    new_hashes = {chunk_id: m[MD5HEXHASH] for m, chunk_id in zip(metadata, ids)}
+    sources_to_add = {}
+    copied_sources = {}
+    for chunk_id, new_hash in new_hashes.items():
+        if chunk_id not in existing_chunks:
+            continue
+        md5Hash, existing_source = existing_chunks[chunk_id]
+        other_source = [file_source for file_source in existing_source if file_source.get(FILE_NAME) not in file_names]
+        if len(other_source) == 0 or md5Hash == new_hash:
+            continue
+        held_id = held_chunks.get(md5Hash)
+        if held_id is not None and new_hashes.get(held_id, md5Hash) == md5Hash:
+            compute_new_source_value(sources_to_add.setdefault(held_id, []), other_source)
+        else:
+            copied_id, copied_source = copied_sources.setdefault(md5Hash, (chunk_id, []))
+            compute_new_source_value(copied_source, other_source)
+    if len(copied_sources) == 0:
+        return sources_to_add
+    copied_hashes = {chunk_id: md5Hash for md5Hash, (chunk_id, _) in copied_sources.items()}
+    for hit in helpers.scan(vectorElastic.client, index=elastic_index_name, query={'query': {'ids': {'values': list(copied_hashes)}}}, _source=[vectorElastic.query_field, 'metadata']):
+        md5Hash = copied_hashes[hit['_id']]
+        copied_source = copied_sources[md5Hash][1]
+        #the hash keeps the copy's id clear of the ids the file's own chunks get
+        copy_id = os.path.basename(copied_source[0][FILE_NAME]) + '.' + md5Hash
+        texts.append(hit['_source'][vectorElastic.query_field])
+        metadata.append({**hit['_source']['metadata'], SOURCE: copied_source})
+        ids.append(copy_id)
+        held_chunks[md5Hash] = copy_id
+    print(f'Copied {str(len(copied_hashes))} shared chunks being rewritten in {elastic_index_name}')
+    return sources_to_add
+
+
+
+@staged('reconcile')
+def delete_stale_chunks(vectorElastic:ElasticsearchStore, elastic_index_name:str, file_names:set, held_chunks:dict):
+    from elasticsearch import helpers
+    #chunks of the processed files that are not part of their new version are deleted, or just lose those files as a source if other files share them.
+    #held_chunks is what upload_to_indexes left the index holding for the new versions, any other chunk listing the files is stale
+    kept_ids = set(held_chunks.values())
+    stale_actions = []
+    sources_to_add = {}
+    for existing_id, (md5Hash, existing_source) in fetch_existing_chunks(vectorElastic, elastic_index_name, file_names).items():
+        if existing_id in kept_ids:
+            continue
+        removed_file_names = {file_source.get(FILE_NAME) for file_source in existing_source if file_source.get(FILE_NAME) in file_names}
+        remaining_source = [file_source for file_source in existing_source if file_source.get(FILE_NAME) not in file_names]
+        if md5Hash in held_chunks and len(remaining_source) > 0:
+            #the text is held by another chunk now, the other files that list it move there
+            compute_new_source_value(sources_to_add.setdefault(held_chunks[md5Hash], []), remaining_source)
+            removed_file_names.update(file_source.get(FILE_NAME) for file_source in remaining_source)
+        #files are removed by name, so a source another writer added since the chunk was read keeps it, a chunk left
+        #without sources is deleted. A chunk a concurrent writer already deleted is skipped
+        stale_actions.append(source_update_action(elastic_index_name, existing_id, None, removed_file_names))
+    #sources move before they are removed from the stale chunk, so they are listed somewhere throughout
+    update_sources_in_elastic(vectorElastic, elastic_index_name, sources_to_add)
+    if len(stale_actions) > 0:
+        helpers.bulk(vectorElastic.client, stale_actions, ignore_status=(404,))
+    print(f'Removed {str(len(stale_actions))} stale chunks from {elastic_index_name}')
+
+
+
+def upload_to_indexes(vector_stores:list, embedding, texts:list, metadata:list, ids:list, check_for_duplicates_in_elastic:bool, container_name:str, file_names:set = None, indexed_chunks:dict = None, run_file_names:set = None):
+    #vector_stores is a list of (vectorElastic, elastic_index_name) that all receive the same chunks
+    #file_names, when given, are the files these chunks came from and chunks already in elastic unchanged are skipped
+    #run_file_names are all the files the run reconciles when that is more than file_names (the other batches of a stream)
+    #indexed_chunks, when given, maps each index name to md5HexHash -> id of the chunk that index now holds for
+    #every hash uploaded, which can be an existing chunk (unchanged, or another one the chunk was merged into) rather than ids[i]
+    if indexed_chunks is None:
+        indexed_chunks = {}
+    if run_file_names is None:
+        run_file_names = file_names
+    index_uploads = []
+    for vectorElastic, elastic_index_name in vector_stores:
+        #each index gets its own copy of the lists since checking elastic removes chunks already in that index
+        index_texts, index_metadata, index_ids = list(texts), list(metadata), list(ids)
+        held_chunks = indexed_chunks.setdefault(elastic_index_name, {})
+        sources_to_add = {}
+        file_names_to_remove = {}
+        with attributes(index=elastic_index_name):
+            if file_names is not None:
+                existing_chunks = fetch_existing_chunks(vectorElastic, elastic_index_name, file_names)
+                unchanged_count = remove_unchanged_chunks(index_texts, index_metadata, index_ids, existing_chunks, held_chunks, run_file_names, file_names_to_remove)
+                print(f'Skipping {str(unchanged_count)} unchanged chunks already in {elastic_index_name}')
+            if check_for_duplicates_in_elastic:
+                check_elastic_for_duplicates(vectorElastic, elastic_index_name, index_metadata, index_texts, index_ids, held_chunks, run_file_names)
+            held_chunks.update((m[MD5HEXHASH], i) for m, i in zip(index_metadata, index_ids))
+            if file_names is not None:
+                sources_to_add = keep_shared_chunks(vectorElastic, elastic_index_name, index_texts, index_metadata, index_ids, existing_chunks, run_file_names, held_chunks)
+        index_uploads.append((vectorElastic, elastic_index_name, index_texts, index_metadata, index_ids, sources_to_add, file_names_to_remove))
+
+    #only embed chunks that at least one index still needs, and only once. Copies of shared chunks are embedded again, their
+    #vectors aren't read back from elastic
+    texts_by_id = {}
+    for _, _, index_texts, _, index_ids, _, _ in index_uploads:
+        texts_by_id.update(zip(index_ids, index_texts))
+    ids_for_vectors = [i for i in ids if i in texts_by_id]
+    embedded_ids = set(ids_for_vectors)
+    ids_for_vectors.extend(i for i in texts_by_id if i not in embedded_ids)
+    texts_to_embed = [texts_by_id[i] for i in ids_for_vectors]
+    print(f'Embedding {str(len(texts_to_embed))} chunks from {container_name}')
+    with stage('embed'):
+        vectors_by_id = dict(zip(ids_for_vectors, embed_texts(embedding, texts_to_embed)))
+        add(CHUNKS, len(texts_to_embed))
+
+    for vectorElastic, elastic_index_name, index_texts, index_metadata, index_ids, sources_to_add, file_names_to_remove in index_uploads:
+        #just to make sure we are hitting the right ones
+        uploading_message = f'Uploading {str(len(index_texts))} chunks, from {container_name} to {elastic_index_name}'
+        print(uploading_message)
+        logging.log(logging.INFO, uploading_message)
+        index_vectors = [vectors_by_id[i] for i in index_ids]
+        with attributes(index=elastic_index_name):
+            upload_to_elastic(vectorElastic, index_texts, index_metadata, index_ids, index_vectors)
+            #after the upload, sources can move onto a chunk uploaded with it
+            update_sources_in_elastic(vectorElastic, elastic_index_name, sources_to_add, file_names_to_remove)
+
+
+
+def create_vector_stores(product_area:str, embedding):
+    vector_stores = []
+    for elastic_index_name in PRODUCT_INDEXES[product_area]:
+        print('Elastic Index Name: ' + elastic_index_name)
+        vectorElastic = create_vector_store(elastic_index_name, embedding)
+        print(vectorElastic.index_name)
+        vector_stores.append((vectorElastic, elastic_index_name))
+    return vector_stores
+
+
+
+def add_chunk_ids_by_blob(chunk_ids_by_blob:dict, container_name:str, metadata:list, ids:list):
+    #source file_name is container_name/blob_name, a chunk shared by several files is listed under each of them
+    for m, i in zip(metadata, ids):
+        for file_source in m[SOURCE]:
+            chunk_ids_by_blob.setdefault(file_source[FILE_NAME][len(container_name) + 1:], set()).add(i)
+
+
+
+def add_held_chunk_ids_by_blob(chunk_ids_by_blob:dict, container_name:str, metadata:list, indexed_chunks:dict):
+    #the ids of the chunks each index holds for the metadata's hashes, an existing chunk's id where it was merged into one
+    for held_chunks in indexed_chunks.values():
+        add_chunk_ids_by_blob(chunk_ids_by_blob, container_name, metadata, [held_chunks[m[MD5HEXHASH]] for m in metadata])
+
+
+
+def record_processed_blobs(manifest, container_name:str, processed_blobs:list, chunk_ids_by_blob:dict, as_rows:bool = False):
+    #only called once the chunks are indexed so a failed run processes the same blobs again next time.
+    #as_rows writes each blob's entry on its own, for queue messages that run concurrently
+    if manifest is None or len(processed_blobs) == 0:
+        return
+    entries = {blob[NAME]: manifest_entry(blob[ETAG], blob[LAST_MODIFIED], sorted(chunk_ids_by_blob.get(blob[NAME], []))) for blob in processed_blobs}
+    if as_rows:
+        manifest.update_rows(container_name, entries)
+    else:
+        manifest.update(container_name, entries)
+    print(f'Recorded {str(len(processed_blobs))} processed blobs from {container_name} in ingestion manifest')
+
+
+
+def commit_blob_listings(blob_listings:list):
+    #moves the listing's high-water mark past what this run uploaded, a run that fails before this lists the same changes again
+    for blob_listing in blob_listings:
+        blob_listing.commit()
+
+
+
+def stream_upload_to_elastic(product_area:str, from_azure_container:bool, from_directory:bool, is_sample_questions:bool, check_for_duplicates_in_elastic:bool, last_processed_time:datetime, prefix:str = None):
+    #blobs -> documents -> chunks -> metadata -> embeddings -> index, one batch of STREAM_BATCH_SIZE chunks at a time.
+    #only the batch's texts, vectors and metadata are in memory, but what is kept across batches still grows with the container
+    #by a few short strings per chunk: the ids handed out, the hashes uploaded and the id each index holds for them, plus the
+    #changed blobs and the chunk ids of every blob when there is an ingestion manifest. Source lists are not kept, merges send
+    #only the sources to add
+    print('Product Area: ' + product_area)
+    container_name = PRODUCT_CONTAINERS[product_area]
+    print('Container Name: ' + container_name)
+    manifest = get_ingestion_manifest(get_azure_connection_string()) if from_azure_container else None
+    manifest_entries = manifest.get(container_name) if manifest is not None else None
+    processed_blobs = []
+    blob_listings = []
+    chunk_ids_by_blob = {}
+    embedding = get_embeddings()
+    vector_stores = create_vector_stores(product_area, embedding)
+    previous_ids = set()
+    previous_hashes = set()
+    indexed_chunks = {}
+    run_file_names = None
+    total_chunks = 0
+    #with reconciliation the changed blobs are all listed before the first batch, a chunk of a file that a later batch rewrites
+    #must not be merged into (see reconcile_hits). Directories aren't listed first, their later files aren't known
+    for split_documents in iter_split_document_batches(from_azure_container, from_directory, is_sample_questions, container_name, prefix, last_processed_time, STREAM_BATCH_SIZE, manifest_entries, processed_blobs, blob_listings, RECONCILE_CHUNKS):
+        texts, metadata, ids = update_metadata(split_documents, container_name, from_azure_container, previous_ids)
+        check_for_duplicates(texts, metadata, ids)
+        duplicates = check_for_duplicates_in_previous_batches(texts, metadata, ids, previous_hashes)
+        if len(texts) > 0:
+            file_names = get_file_names(container_name, [], metadata) if RECONCILE_CHUNKS else None
+            if RECONCILE_CHUNKS:
+                if run_file_names is None:
+                    run_file_names = get_file_names(container_name, processed_blobs, [])
+                run_file_names.update(file_names)
+            upload_to_indexes(vector_stores, embedding, texts, metadata, ids, check_for_duplicates_in_elastic, container_name, file_names, indexed_chunks, run_file_names)
+        for vectorElastic, elastic_index_name in vector_stores:
+            with attributes(index=elastic_index_name):
+                update_held_sources(vectorElastic, elastic_index_name, indexed_chunks[elastic_index_name], duplicates)
+        if manifest is not None:
+            #chunks dropped as duplicates of an earlier batch belong to the chunk held for their hash
+            add_held_chunk_ids_by_blob(chunk_ids_by_blob, container_name, metadata + duplicates, indexed_chunks)
+        total_chunks = total_chunks + len(texts)
+    print(f'Streamed {str(total_chunks)} chunks from {container_name}')
+    if RECONCILE_CHUNKS:
+        #a file's chunks can span batches so stale chunks are only removed once every batch is uploaded
+        file_names = get_file_names(container_name, processed_blobs, [])
+        for vectorElastic, elastic_index_name in vector_stores:
+            with attributes(index=elastic_index_name):
+                delete_stale_chunks(vectorElastic, elastic_index_name, file_names, indexed_chunks.get(elastic_index_name, {}))
+    record_processed_blobs(manifest, container_name, processed_blobs, chunk_ids_by_blob)
+    commit_blob_listings(blob_listings)
+    from EmbeddingCache import CachedEmbeddings
+    if isinstance(embedding, CachedEmbeddings):
+        embedding.log_stats()
+
+
+
+def upload_product_area(product_area:str, from_azure_container:bool, from_directory:bool, is_sample_questions:bool, check_for_duplicates_in_elastic:bool, last_processed_time:datetime, prefix:str = None, blob_names:list = None):
+    print('Product Area: ' + product_area)
+    container_name = PRODUCT_CONTAINERS[product_area]
+    print('Container Name: ' + container_name)
+    manifest = get_ingestion_manifest(get_azure_connection_string()) if from_azure_container else None
+    #blob_names come from queue messages, which only read and write the entries of their own blobs
+    manifest_entries = manifest.get(container_name, blob_names) if manifest is not None else None
+    processed_blobs = []
+    blob_listings = []
+    #load, split and hash the container once and fan the result out to every index for the product area
+    split_documents = load_documents(from_azure_container, from_directory, is_sample_questions, container_name, prefix, last_processed_time, manifest_entries, processed_blobs, blob_names, blob_listings)
+    texts, metadata, ids = update_metadata(split_documents, container_name, from_azure_container)
+    print('Number of documents to upload: ' + str(len(texts)))
+    check_for_duplicates(texts, metadata, ids)
+    print('Number of documents to upload after checking for duplicates: ' + str(len(texts)))
+    file_names = get_file_names(container_name, processed_blobs, metadata) if RECONCILE_CHUNKS else None
+    indexed_chunks = {}
+    if len(texts) > 0 or file_names:
+        embedding = get_embeddings()
+        vector_stores = create_vector_stores(product_area, embedding)
+        upload_to_indexes(vector_stores, embedding, texts, metadata, ids, check_for_duplicates_in_elastic, container_name, file_names, indexed_chunks)
+        if file_names:
+            for vectorElastic, elastic_index_name in vector_stores:
+                with attributes(index=elastic_index_name):
+                    delete_stale_chunks(vectorElastic, elastic_index_name, file_names, indexed_chunks[elastic_index_name])
+        from EmbeddingCache import CachedEmbeddings
+        if isinstance(embedding, CachedEmbeddings):
+            embedding.log_stats()
+    if manifest is not None:
+        chunk_ids_by_blob = {}
+        add_held_chunk_ids_by_blob(chunk_ids_by_blob, container_name, metadata, indexed_chunks)
+        record_processed_blobs(manifest, container_name, processed_blobs, chunk_ids_by_blob, blob_names is not None)
+    commit_blob_listings(blob_listings)
+
+
+
+def plan_product_area(product_area:str, last_processed_time:datetime, prefix:str = None):
+    """
+    What upload_product_area would do for the product area, without calling the embedding api or writing anything.
+    Changed blobs are downloaded, parsed (which fills the parse cache for the real run), split and de-duplicated,
+    and chunks already in elastic unchanged are left out like the upload does. Embedding cache hits aren't
+    counted so the chunks, tokens and requests are what the upload embeds at most
+    """
+    container_name = PRODUCT_CONTAINERS[product_area]
+    manifest = get_ingestion_manifest(get_azure_connection_string())
+    manifest_entries = manifest.get(container_name) if manifest is not None else None
+    processed_blobs = []
+    split_documents = load_documents(True, False, False, container_name, prefix, last_processed_time, manifest_entries, processed_blobs)
+    texts, metadata, ids = update_metadata(split_documents, container_name, True)
+    chunk_count = len(texts)
+    check_for_duplicates(texts, metadata, ids)
+    ids_to_embed = set()
+    if len(texts) > 0:
+        file_names = get_file_names(container_name, processed_blobs, metadata) if RECONCILE_CHUNKS else None
+        for vectorElastic, elastic_index_name in create_vector_stores(product_area, get_embeddings()):
+            index_texts, index_metadata, index_ids = list(texts), list(metadata), list(ids)
+            if file_names is not None:
+                remove_unchanged_chunks(index_texts, index_metadata, index_ids, fetch_existing_chunks(vectorElastic, elastic_index_name, file_names))
+            ids_to_embed.update(index_ids)
+    token_counts = [count_text_tokens(t) for t, i in zip(texts, ids) if i in ids_to_embed]
+    plan = {
+        'blobs': [blob[NAME] for blob in processed_blobs],
+        'chunks': chunk_count,
+        'unique_chunks': len(texts),
+        'chunks_to_embed': len(token_counts),
+        'tokens': sum(token_counts),
+        'embedding_requests': count_embedding_requests(token_counts),
+        #at the provisioned quota, when there is one
+        'embedding_minutes': sum(token_counts) / EMBEDDING_TPM_LIMIT if EMBEDDING_TPM_LIMIT > 0 else None,
+    }
+    for blob_name in plan['blobs']:
+        print(f'Changed blob: {container_name}/{blob_name}')
+    return plan
+
+
+
+def log_plan(plans:dict):
+    plan_lines = ['Upload plan:']
+    for product_area, plan in plans.items():
+        plan_line = f"  {product_area}: {len(plan['blobs'])} changed blobs, {plan['chunks']} chunks ({plan['unique_chunks']} unique), {plan['chunks_to_embed']} to embed, {plan['tokens']} tokens in {plan['embedding_requests']} embedding requests"
+        if plan['embedding_minutes'] is not None:
+            plan_line = plan_line + f", {plan['embedding_minutes']:.1f} minutes at {EMBEDDING_TPM_LIMIT} TPM"
+        plan_lines.append(plan_line)
+    plan_message = '\n'.join(plan_lines)
+    print(plan_message)
+    logging.log(logging.INFO, plan_message)
+
+
+
+def plan_upload_to_elastic(last_processed_time:datetime, prefix:str = None):
+    #dry run of run_upload_to_elastic, returns {product_area: plan} to size a run (e.g. a backfill with last_processed_time None) before starting it
+    plans = {}
+    start_parse_pool()
+    def plan_function(product_area:str):
+        plans[product_area] = plan_product_area(product_area, last_processed_time, prefix)
+    try:
+        run_for_product_areas('Upload plan', PRODUCT_AREAS, plan_function)
+    finally:
+        log_plan({product_area: plans[product_area] for product_area in PRODUCT_AREAS if product_area in plans})
+    return plans
 
 
 
-def check_elastic_for_duplicates(vectorElastic: ElasticsearchStore, elastic_index_name:str, metadata:list, texts:list, ids:list):
-    logging.log(logging.DEBUG, 'check_elastic_for_duplicates')
-    if check_elastic_for_duplicates:
-        indexes_in_elastic = []
-        for i, data in enumerate(metadata):
-            index_exists = vectorElastic.client.indices.exists(index=elastic_index_name)
-            if index_exists:
-                hexHash = data.get(MD5HEXHASH)
-                textExists = vectorElastic.client.search(index=elastic_index_name, q="metadata.md5HexHash: " + hexHash)
-                if len(textExists.body[HITS][HITS]) == 1:
-                    existing_id_with_hash = textExists.body[HITS][HITS][0]["_id"]
-                    if existing_id_with_hash != ids[i]:
-                        existing_source = textExists.body[HITS][HITS][0]['_source']['metadata'][SOURCE]  
-                        update_source_in_elastic(vectorElastic, existing_id_with_hash, elastic_index_name, existing_source, data.get(SOURCE))                
-                        indexes_in_elastic.append(i)
-                    
-        #now remove those whose hash already exists in elastic
-        indexes_in_elastic.reverse()
-        for elastic_index in indexes_in_elastic:
-            del texts[elastic_index]
-            del metadata[elastic_index]
-            del ids[elastic_index]
-
-
-
-
-def upload_to_elastic(vectorElastic:ElasticsearchStore, texts:list, metadata:list, ids:list):
-    #texts, metadata, and ids should all be the same length
-    #Azure currently accepts a max of 16 at a time so split them in to lists of 16 items 
-    #(Too many inputs. The max number of inputs is 16.  We hope to increase the number of inputs per request soon. Please contact us through an Azure)
-    chunk_range = 8
-    #if timeout or exceed call limit can update range start to be count * chunk_range
-    chunked_texts = [texts[x:x+chunk_range] for x in range(chunk_range*0, len(texts), chunk_range)]
-    chunked_metadata = [metadata[x:x+chunk_range] for x in range(chunk_range*0, len(metadata), chunk_range)]
-    chunked_ids = [ids[x:x+chunk_range] for x in range(chunk_range*0, len(ids), chunk_range)]
-    #only add_texts allows us to specify metadata and ids
-    count = 0
-    for t, m, i in zip(chunked_texts, chunked_metadata, chunked_ids):
-        vectorElastic.add_texts(
-            texts = t,
-            metadatas = m,
-            ids = i
-        )    
-        count = count + 1
-        print(count)
-        #time.sleep(1)
-
-
-
-def run_upload_to_elastic(from_azure_container:bool, from_directory:bool, is_sample_questions:bool, check_for_duplicates_in_elastic:bool, last_processed_time:datetime, prefix:str = None):
+def run_upload_to_elastic(from_azure_container:bool, from_directory:bool, is_sample_questions:bool, check_for_duplicates_in_elastic:bool, last_processed_time:datetime, prefix:str = None, stream:bool = False):
     #One of these needs to be set to true depending on where the source of documents is (Azure Container or Directory)    
-    logging.log(logging.INFO, 'from_azure_container: [' + str(from_azure_container) + ']\tfrom_directory: [' + str(from_directory) + ']\tis_sample_questions: [' + str(is_sample_questions) + ']\tcheck_elastic_for_duplicates: [' + str(check_elastic_for_duplicates) + ']')
+    logging.log(logging.INFO, 'from_azure_container: [' + str(from_azure_container) + ']\tfrom_directory: [' + str(from_directory) + ']\tis_sample_questions: [' + str(is_sample_questions) + ']\tcheck_elastic_for_duplicates: [' + str(check_elastic_for_duplicates) + ']\tstream: [' + str(stream) + ']')
+    upload_function = stream_upload_to_elastic if stream else upload_product_area
+    if from_azure_container:
+        start_parse_pool()
+    try:
+        #product areas run concurrently, one failing doesn't stop the others
+        return run_for_product_areas('Upload to elastic', PRODUCT_AREAS, lambda product_area: upload_function(product_area, from_azure_container, from_directory, is_sample_questions, check_for_duplicates_in_elastic, last_processed_time, prefix))
+    finally:
+        parse_cache = get_parse_cache(get_azure_connection_string(), get_loader_version())
+        if from_azure_container and parse_cache is not None:
+            parse_cache.log_stats()
+
+
+
+def list_changed_blob_messages(last_processed_time:datetime, prefix:str = None):
+    #queue mode: only lists what changed, one message per blob, the queue trigger does the rest
+    blob_messages = []
     for product_area in PRODUCT_AREAS:
-        indexes = PRODUCT_INDEXES[product_area]
-        print('Product Area: ' + product_area)
         container_name = PRODUCT_CONTAINERS[product_area]
-        for elastic_index_name in indexes:
-            print('Elastic Index Name: ' + elastic_index_name)
-            print('Container Name: ' + container_name)
-            split_documents = load_documents(from_azure_container, from_directory, is_sample_questions, container_name, prefix, last_processed_time)
-            texts, metadata, ids = update_metadata(split_documents, container_name, from_azure_container)
-            print('Number of documents to upload: ' + str(len(texts)))
-            check_for_duplicates(texts, metadata, ids)
-            print('Number of documents to upload after checking for duplicates: ' + str(len(texts)))
-            vectorElastic = create_vector_store(elastic_index_name)
-            print(vectorElastic.index_name)
-            if check_for_duplicates_in_elastic:
-                check_elastic_for_duplicates(vectorElastic, elastic_index_name, metadata, texts, ids)
-            #just to make sure we are hitting the right ones
-            uploading_message = f'Uploading {str(len(texts))} chunks, from {container_name} to {elastic_index_name}'
-            print(uploading_message)
-            logging.log(logging.INFO, uploading_message)
-            upload_to_elastic(vectorElastic, texts, metadata, ids)
-
+        manifest = get_ingestion_manifest(get_azure_connection_string())
+        manifest_entries = manifest.get(container_name) if manifest is not None else None
+        processed_blobs = []
+        azure_container = create_container_client(container_name)
+        blob_listing = BlobListing(azure_container, get_azure_connection_string(), prefix, last_processed_time, f'upload/{container_name}/{prefix or ""}')
+        with attributes(product_area=product_area):
+            blob_list = iterate('list', blob_listing.list_blobs(), BLOBS_LISTED)
+            for _ in iter_changed_blobs(blob_list, blob_listing.last_processed_time, manifest_entries, processed_blobs):
+                pass
+        blob_messages.extend(create_blob_message(product_area, blob[NAME], blob[ETAG]) for blob in processed_blobs)
+        #the queue trigger retries messages that fail, so the listing moves on once they are queued
+        blob_listing.commit()
+        print(f'Queueing {str(len(processed_blobs))} changed blobs from {container_name}')
+    return blob_messages
+
+
+
+def process_blob_message(message_body:str, check_for_duplicates_in_elastic:bool):
+    #downloads, chunks, embeds and indexes a single blob, chunk ids are deterministic so a retried message rewrites the same chunks
+    #with an ingestion manifest a message for a blob that was already processed at its current etag does nothing
+    message = parse_blob_message(message_body)
+    if message[PRODUCT_AREA] not in PRODUCT_CONTAINERS:
+        raise ValueError(f'Unknown product area in blob message: {message[PRODUCT_AREA]}')
+    with attributes(product_area=message[PRODUCT_AREA]), stage('Process blob message'):
+        upload_product_area(message[PRODUCT_AREA], True, False, False, check_for_duplicates_in_elastic, None, None, [message[BLOB_NAME]])
@@ -0,0 +1,104 @@
+"""
+Parity benchmark for the "Resolved Issues in Updates" Excel loader.
+
+Writes a synthetic workbook, loads it with the previous iterrows loader and with ExcelLoader, fails if the
+text differs in any way and reports the time of both.
+
+    python benchmarks/bench_excel.py --rows 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+import pandas as pd
+from ExcelLoader import load_excel_document
+
+COLUMNS = ['Issue ID', 'Product', 'Version', 'Summary', 'Resolution', 'Notes']
+WORDS = ['update', 'install', 'error', 'report', 'database', 'login', 'timeout', 'fixed', 'customer', 'invoice', 'sync', 'crash']
+
+
+def legacy_load_excel_document(full_file_name:str):
+    #the loader before it was vectorised, kept here as the reference output
+    excel_documents: list[Document] = []
+    df = pd.read_excel(full_file_name, sheet_name=None, dtype=str)
+    with pd.option_context('display.max_colwidth', 1000):
+        for frame in df:
+            df[frame]=df[frame].fillna('')
+            text = ''
+            for _, row in df[frame].iterrows():
+                text = text + row.to_string().replace("  ", "")+ '\n'
+            metadata = {}
+            metadata['source'] = full_file_name
+            excel_documents.append(Document(page_content=text, metadata=metadata))
+    return excel_documents
+
+
+def make_cell(random_generator:random.Random, column_index:int):
+    roll = random_generator.random()
+    if roll < 0.1:
+        return None
+    if roll < 0.12:
+        #long cells are truncated by to_string, multi-line cells have their line breaks escaped
+        return ' '.join(random_generator.choice(WORDS) for _ in range(250))
+    if roll < 0.15:
+        return 'first line\nsecond line\twith a tab'
+    word_count = 1 if column_index < 3 else random_generator.randint(1, 40)
+    return '  '.join(random_generator.choice(WORDS) for _ in range(word_count))
+
+
+def write_workbook(path:str, row_count:int, sheet_count:int, seed:int):
+    random_generator = random.Random(seed)
+    with pd.ExcelWriter(path) as writer:
+        for sheet_number in range(sheet_count):
+            rows = [[make_cell(random_generator, i) for i in range(len(COLUMNS))] for _ in range(row_count // sheet_count)]
+            pd.DataFrame(rows, columns=COLUMNS).to_excel(writer, sheet_name=f'Update {sheet_number}', index=False)
+        #a sheet with only a header row
+        pd.DataFrame([], columns=COLUMNS).to_excel(writer, sheet_name='Empty', index=False)
+
+
+def time_load(load_function, *args):
+    start = time.perf_counter()
+    documents = load_function(*args)
+    return documents, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--sheets', type=int, default=2)
+    parser.add_argument('--rows-per-document', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'Resolved Issues in Updates.xlsx')
+        write_workbook(path, args.rows, args.sheets, args.seed)
+        legacy_documents, legacy_seconds = time_load(legacy_load_excel_document, path)
+        documents, seconds = time_load(load_excel_document, path, 0)
+        row_group_documents, row_group_seconds = time_load(load_excel_document, path, args.rows_per_document)
+
+    legacy_texts = [document.page_content for document in legacy_documents]
+    print(f'iterrows loader     {legacy_seconds:8.3f}s  {len(legacy_documents)} documents')
+    print(f'vectorised loader   {seconds:8.3f}s  {len(documents)} documents  ({legacy_seconds / seconds:.1f}x faster)')
+    print(f'row groups of {args.rows_per_document:<5} {row_group_seconds:8.3f}s  {len(row_group_documents)} documents')
+
+    failed = False
+    if [document.page_content for document in documents] != legacy_texts:
+        print('FAIL: vectorised loader text differs from the iterrows loader')
+        failed = True
+    if ''.join(document.page_content for document in row_group_documents) != ''.join(legacy_texts):
+        print('FAIL: row group documents do not add up to the iterrows loader text')
+        failed = True
+    if not failed:
+        print('text matches the iterrows loader')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Cold import benchmark for the Functions app.
+
+Imports each entry module in a fresh interpreter with python -X importtime and with none of the required app
+settings set, so anything read from the environment at import fails the run. Fails if a module takes longer
+than its budget to import, or if it pulls in a heavy dependency that should only be imported by the code path
+that uses it (Unstructured, pandas, langchain, ...).
+
+    python benchmarks/bench_importtime.py --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#the timer schedules are part of the function definitions, these are the only settings needed at import
+IMPORT_SETTINGS = {'UPLOAD_INTERVAL_DAYS': '1', 'UPLOAD_INTERVAL_MINUTES': '0'}
+REQUIRED_SETTINGS = ['ELASTIC_CLOUD_ID', 'ELASTIC_USERNAME', 'ELASTIC_PASSWORD', 'OPEN_AI_KEY', 'OPEN_AI_DEPLOYMENT', 'OPEN_AI_MODEL',
+                     'OPEN_AI_BASE', 'OPEN_AI_TYPE', 'OPEN_AI_VERSION', 'askmaddiknowledgeset_STORAGE']
+
+LOADER_MODULES = ['pandas', 'unstructured', 'langchain', 'langchain_core', 'langchain_community', 'langchain_openai', 'langchain_text_splitters', 'ExcelLoader', 'JsonLoader', 'tiktoken']
+#OpenTelemetry is only loaded once telemetry is used, and not at all when it is off
+#(the elasticsearch client imports it when it is installed, so DeleteFromElastic isn't checked for it)
+TELEMETRY_MODULES = ['opentelemetry']
+#module: (default budget in ms, modules it must not import)
+IMPORT_BUDGETS = {
+    'function_app': (500, LOADER_MODULES + TELEMETRY_MODULES + ['UploadToElastic', 'DeleteFromElastic', 'elasticsearch']),
+    'UploadToElastic': (1200, LOADER_MODULES + TELEMETRY_MODULES),
+    'DeleteFromElastic': (1500, LOADER_MODULES + ['UploadToElastic']),
+}
+
+
+def import_module(module_name:str):
+    #returns the cumulative import time in ms and the names of every module imported
+    env = {name: value for name, value in os.environ.items() if name not in REQUIRED_SETTINGS}
+    env.update(IMPORT_SETTINGS)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'], cwd=REPO_DIRECTORY, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module_name} failed:\n{result.stderr[-2000:]}')
+    imported_modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        imported_modules[name.strip()] = int(cumulative) / 1000
+    return imported_modules[module_name], imported_modules.keys()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    #multiplies every budget, for slower machines
+    parser.add_argument('--budget-scale', type=float, default=1.0)
+    args = parser.parse_args()
+
+    failed = False
+    for module_name, (budget, forbidden_modules) in IMPORT_BUDGETS.items():
+        runs = [import_module(module_name) for _ in range(args.repeat)]
+        milliseconds = min(run[0] for run in runs)
+        budget = budget * args.budget_scale
+        heavy_modules = sorted(set(name.split('.')[0] for name in runs[0][1]) & set(forbidden_modules))
+        print(f'{module_name:<20} {milliseconds:8.1f}ms  (budget {budget:.0f}ms)')
+        if milliseconds > budget:
+            print(f'FAIL: import {module_name} is over budget')
+            failed = True
+        if len(heavy_modules) > 0:
+            print(f'FAIL: import {module_name} also imports {", ".join(heavy_modules)}')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
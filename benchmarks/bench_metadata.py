@@ -0,0 +1,67 @@
+"""
+Micro-benchmark for update_metadata and check_for_duplicates.
+
+Times both on synthetic chunks at increasing sizes and fails if the time per chunk grows with the
+number of chunks, which would mean id generation or de-duplication has gone back to being quadratic.
+
+    python benchmarks/bench_metadata.py --max-chunks 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from UploadToElastic import update_metadata, check_for_duplicates
+
+CONTAINER_NAME = 'benchmark'
+
+
+def make_chunks(chunk_count:int, duplicate_ratio:float = 0.1, chunks_per_page:int = 4, pages_per_file:int = 50):
+    #a share of the chunks repeat earlier text so de-duplication has work to do
+    unique_every = int(1 / duplicate_ratio) if duplicate_ratio > 0 else 0
+    documents = []
+    for i in range(chunk_count):
+        file_number = i // (chunks_per_page * pages_per_file)
+        page = (i // chunks_per_page) % pages_per_file
+        text_number = i // 2 if unique_every and i % unique_every == 0 else i
+        source = f'/tmp/{CONTAINER_NAME}/Internal/Application/folder/file{file_number}.pdf'
+        documents.append(Document(page_content=f'chunk text {text_number}', metadata={'source': source, 'page': page}))
+    return documents
+
+
+def time_chunks(chunk_count:int):
+    documents = make_chunks(chunk_count)
+    start = time.perf_counter()
+    texts, metadata, ids = update_metadata(documents, CONTAINER_NAME, True)
+    check_for_duplicates(texts, metadata, ids)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-chunks', type=int, default=1000000)
+    #allowed growth of time per chunk between the smallest and largest size before the run counts as non-linear
+    parser.add_argument('--max-slowdown', type=float, default=3.0)
+    args = parser.parse_args()
+
+    chunk_count = 10000
+    per_chunk_times = []
+    while chunk_count <= args.max_chunks:
+        seconds = time_chunks(chunk_count)
+        per_chunk_times.append(seconds / chunk_count)
+        print(f'{chunk_count:>10} chunks  {seconds:8.3f}s  {seconds / chunk_count * 1e6:8.2f}us per chunk')
+        chunk_count = chunk_count * 10
+
+    slowdown = per_chunk_times[-1] / per_chunk_times[0]
+    print(f'time per chunk grew {slowdown:.2f}x from smallest to largest run')
+    if slowdown > args.max_slowdown:
+        print(f'FAIL: expected linear scaling (at most {args.max_slowdown}x)')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
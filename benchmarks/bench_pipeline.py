@@ -0,0 +1,465 @@
+"""
+Offline end-to-end benchmark of the upload and delete pipelines.
+
+Generates a synthetic corpus (PDF, docx, Resolved Issues xlsx, Teams/Salesforce JSON and NDJSON bundles), serves
+it from an in-memory blob stand-in (or Azurite), embeds with a fake embeddings client with configurable latency
+and share of 429s, and indexes into a fake Elasticsearch served on localhost (or a real local cluster). Then runs
+run_upload_to_elastic and run_delete_for_all_product_areas (soft delete server and client side, hard delete) and
+reports throughput, p50/p99 of every stage and peak RSS. With --upload-mode queue the upload lists the changed blobs
+into an in-process queue and processes one message per blob like BlobQueueTrigger, plus a message that always fails
+and has to end up in poison. Between the two it checks that re-uploading a rewritten NDJSON
+bundle leaves the index holding exactly its new chunks. With --telemetry the pipeline's OpenTelemetry spans and
+metrics are recorded in memory, to measure what instrumentation costs and to report its counters.
+
+    python benchmarks/bench_pipeline.py --files 300 --output results.json
+    python benchmarks/bench_pipeline.py --files 300 --baseline results.json --max-regression 0.2
+
+Exits with 1 when the reconcile check fails or a metric is worse than the baseline by more than --max-regression.
+"""
+import argparse
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+#a sqlite manifest left by an earlier benchmark would skip the blobs this one uploads with the same etags
+STATE_DIRECTORY = tempfile.TemporaryDirectory(prefix='bench_pipeline_')
+
+#the pipeline modules read these at import, the worker caches would make repeated runs measure cache hits
+BENCHMARK_SETTINGS = {
+    'askmaddiknowledgeset_STORAGE': 'UseDevelopmentStorage=true',
+    'PARSE_CACHE': 'none',
+    'EMBEDDING_CACHE': 'none',
+    'INGESTION_MANIFEST': 'none',
+    'INGESTION_MANIFEST_PATH': os.path.join(STATE_DIRECTORY.name, 'ingestion_manifest.sqlite'),
+    'TASK_POLL_SECONDS': '0',
+}
+for setting, value in BENCHMARK_SETTINGS.items():
+    os.environ.setdefault(setting, value)
+
+from corpus import FORMATS, generate_corpus
+from standins import FakeElasticsearch, FakeEmbeddings, InMemoryBlobService
+
+ARCHIVE_CONTAINER = 'sf-archived'
+#queued with the changed blobs in --upload-mode queue, processing it fails until it is moved to poison
+FAILING_BLOB_MESSAGE_PRODUCT_AREA = 'NoSuchProductArea'
+#folder of the bundle check_reconcile rewrites, the upload is rerun with it as prefix so nothing else is reprocessed
+RECONCILE_PREFIX = 'Internal/ReconcileCheck/'
+#stages called fewer times than this in the baseline are only compared on p50
+P99_MIN_CALLS = 50
+#arguments that change what is measured, a baseline run with different values isn't comparable
+CONFIG_ARGUMENTS = ['files', 'formats', 'product_areas', 'text_size', 'duplicate_ratio', 'records_per_bundle', 'seed', 'upload_mode', 'stream', 'check_elastic_for_duplicates',
+                    'telemetry', 'blob_latency_ms', 'embedding_latency_ms', 'rate_limit_ratio', 'dimensions', 'elastic_latency_ms', 'elastic_url', 'azurite', 'archived_files', 'archived_chunks']
+
+
+class StageTimer:
+    """
+    Wall time of every call to the wrapped pipeline functions, by stage
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counts = {}
+
+    def record(self, stage:str, seconds:float, count:int = 0):
+        with self.lock:
+            self.timings.setdefault(stage, []).append(seconds)
+            self.counts[stage] = self.counts.get(stage, 0) + count
+
+    def wrap(self, module, function_name:str, stage:str, count = None):
+        #count(result, args) is the number of items the call handled, e.g. chunks
+        function = getattr(module, function_name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            self.record(stage, time.perf_counter() - start, count(result, args) if count is not None else 0)
+            return result
+        setattr(module, function_name, timed)
+
+    def summary(self):
+        stages = {}
+        for stage, timings in self.timings.items():
+            timings = sorted(timings)
+            stages[stage] = {
+                'calls': len(timings),
+                'items': self.counts.get(stage, 0),
+                'total_seconds': sum(timings),
+                'p50_ms': percentile(timings, 50) * 1000,
+                'p99_ms': percentile(timings, 99) * 1000,
+            }
+        return stages
+
+
+def percentile(sorted_values:list, percent:float):
+    if len(sorted_values) == 0:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(round((len(sorted_values) - 1) * percent / 100)))]
+
+
+def unstructured_available():
+    try:
+        import unstructured
+        return True
+    except ImportError:
+        return False
+
+
+def upload_corpus_to_azurite(connection_string:str, corpus:dict):
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.blob import ContainerClient
+    for container_name, blobs in corpus.items():
+        container_client = ContainerClient.from_connection_string(conn_str=connection_string, container_name=container_name)
+        try:
+            container_client.create_container()
+        except ResourceExistsError:
+            pass
+        for blob_name, content in blobs.items():
+            container_client.upload_blob(blob_name, content, overwrite=True)
+
+
+def instrument(timer:StageTimer):
+    import DeleteFromElastic
+    import EmbeddingExecutor
+    import UploadToElastic
+    timer.wrap(UploadToElastic, 'download_and_load_blob', 'download and parse', lambda result, args: 1)
+    timer.wrap(UploadToElastic, 'parse_document', 'parse')
+    timer.wrap(UploadToElastic, 'langchain_split_documents', 'split', lambda result, args: len(result))
+    timer.wrap(UploadToElastic, 'update_metadata', 'metadata', lambda result, args: len(result[0]))
+    timer.wrap(UploadToElastic, 'check_for_duplicates', 'duplicate check')
+    timer.wrap(UploadToElastic, 'check_elastic_for_duplicates', 'elastic duplicate check')
+    timer.wrap(UploadToElastic, 'fetch_existing_chunks', 'fetch existing chunks', lambda result, args: len(result))
+    timer.wrap(UploadToElastic, 'embed_texts', 'embed', lambda result, args: len(result))
+    timer.wrap(EmbeddingExecutor, 'embed_batch', 'embedding request', lambda result, args: len(result))
+    timer.wrap(UploadToElastic, 'upload_to_elastic', 'index', lambda result, args: len(args[1]))
+    timer.wrap(UploadToElastic, 'delete_stale_chunks', 'delete stale chunks')
+    timer.wrap(UploadToElastic, 'upload_product_area', 'upload product area')
+    timer.wrap(UploadToElastic, 'stream_upload_to_elastic', 'upload product area')
+    timer.wrap(DeleteFromElastic, 'run_delete', 'delete index')
+    timer.wrap(DeleteFromElastic, 'wait_for_task', 'delete task')
+
+
+def run_queue_upload(args):
+    #what the timer and BlobQueueTrigger do with UPLOAD_MODE=queue, messages are processed batchSize at a time
+    import UploadToElastic
+    from BlobQueue import InProcessBlobQueue, create_blob_message
+    blob_queue = InProcessBlobQueue()
+    blob_messages = UploadToElastic.list_changed_blob_messages(None)
+    blob_queue.set(blob_messages + [create_blob_message(FAILING_BLOB_MESSAGE_PRODUCT_AREA, 'missing.json', '"0x0"')])
+    processed_count = blob_queue.run(lambda message_body: UploadToElastic.process_blob_message(message_body, args.check_elastic_for_duplicates))
+    return {'messages': len(blob_messages), 'processed': processed_count, 'poison_messages': blob_queue.poison_messages}
+
+
+def check_reconcile(args, product_area:str):
+    """
+    Regression check of reconciliation: uploads an NDJSON bundle of records A, B, C and a file listed after it that also
+    holds A, so A is kept in the bundle's first chunk. The bundle is rewritten without A and uploaded again. Every record's
+    chunk id moves down one, so the index must end up holding exactly .1=B and .2=C for the bundle, and A must still be
+    indexed for the other file although the chunk it was kept in is rewritten, whatever --stream and
+    --check-elastic-for-duplicates are. Returns the problems found
+    """
+    import UploadToElastic
+    from elasticsearch import helpers
+    from ElasticClient import get_elastic_client
+    container_name = UploadToElastic.PRODUCT_CONTAINERS[product_area]
+    container_client = UploadToElastic.create_container_client(container_name)
+    blob_name = RECONCILE_PREFIX + 'reconcile_teams.ndjson'
+    shared_blob_name = RECONCILE_PREFIX + 'reconcile_with_a_teams.json'
+    record_texts = {record: f'Reconcile check record {record}, seed {args.seed}' for record in 'ABC'}
+    expected = {
+        f'{container_name}/{blob_name}': {'reconcile_teams.ndjson.1': record_texts['B'], 'reconcile_teams.ndjson.2': record_texts['C']},
+        f'{container_name}/{shared_blob_name}': [record_texts['A']],
+    }
+    container_client.upload_blob(shared_blob_name, json.dumps({'Conversation': record_texts['A']}).encode(), overwrite=True)
+    UploadToElastic.PRODUCT_AREAS = [product_area]
+    try:
+        for records in ('ABC', 'BC'):
+            container_client.upload_blob(blob_name, '\n'.join(json.dumps({'Conversation': record_texts[record]}) for record in records).encode(), overwrite=True)
+            with pipeline_output(args.verbose):
+                failed = UploadToElastic.run_upload_to_elastic(True, False, False, args.check_elastic_for_duplicates, None, RECONCILE_PREFIX, args.stream)
+            if failed[product_area]['status'] != 'succeeded':
+                return [f'upload of {records} failed: {failed[product_area]["error"]}']
+    finally:
+        UploadToElastic.PRODUCT_AREAS = args.product_areas
+    problems = []
+    for index_name in UploadToElastic.PRODUCT_INDEXES[product_area]:
+        for file_name, expected_chunks in expected.items():
+            held = {hit['_id']: hit['_source']['text'] for hit in helpers.scan(get_elastic_client(), index=index_name, query={'query': {'terms': {'metadata.source.file_name.keyword': [file_name]}}})}
+            #the shared file's chunk id depends on which chunk its text was kept in, only the texts are compared
+            if isinstance(expected_chunks, list):
+                held = sorted(held.values())
+            if held != expected_chunks:
+                problems.append(f'{index_name} holds {held} for {file_name}, expected {expected_chunks}')
+    return problems
+
+
+def seed_archived_chunks(archive_container, elastic_client, product_areas:list, files_per_product_area:int, chunks_per_file:int, dimensions:int):
+    #chunks whose source is an archived file, every other chunk is shared with a live file so soft delete both updates and deletes
+    from DeleteFromElastic import PRODUCT_INDEXES
+    from elasticsearch import helpers
+    actions = []
+    for product_area in product_areas:
+        for file_number in range(files_per_product_area):
+            blob_name = f'{product_area}/Archive/archived{file_number}_salesforce.json'
+            archive_container.upload_blob(blob_name, b'{}', overwrite=True)
+            file_name = f'{ARCHIVE_CONTAINER}/{blob_name}'
+            for chunk_number in range(chunks_per_file):
+                source = [{'file_name': file_name, 'page': -1, 'application': 'Archive'}]
+                if chunk_number % 2 == 1:
+                    source.append({'file_name': f'live/{product_area}/file{file_number}.json', 'page': -1, 'application': 'Live'})
+                for index_name in PRODUCT_INDEXES[product_area]:
+                    actions.append({'_op_type': 'index', '_index': index_name, '_id': f'archived{file_number}_salesforce.json.{chunk_number}',
+                        'text': f'archived chunk {chunk_number}', 'vector': [0.0] * dimensions,
+                        'metadata': {'source': source, 'md5HexHash': f'{product_area}-{file_number}-{chunk_number}'}})
+    helpers.bulk(elastic_client, actions, refresh=True)
+    return len(actions)
+
+
+def setup_in_memory_telemetry():
+    from opentelemetry import metrics, trace
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    os.environ['TELEMETRY'] = 'otel'
+    span_exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+    metric_reader = InMemoryMetricReader()
+    metrics.set_meter_provider(MeterProvider(metric_readers=[metric_reader]))
+    return span_exporter, metric_reader
+
+
+def summarize_telemetry(span_exporter, metric_reader):
+    #counter totals by stage, e.g. {'askmaddi.ingestion.chunks': {'split': 3241, 'embed': 3241, ...}}
+    counters = {}
+    for resource_metrics in metric_reader.get_metrics_data().resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                if metric.name.endswith('.stage.duration'):
+                    continue
+                for point in metric.data.data_points:
+                    stage = point.attributes.get('stage', '')
+                    counters.setdefault(metric.name, {})[stage] = counters.get(metric.name, {}).get(stage, 0) + point.value
+    return {'spans': len(span_exporter.get_finished_spans()), 'counters': counters}
+
+
+def pipeline_output(verbose:bool):
+    #the pipelines print every file and index they touch, only show it with --verbose
+    return nullcontext() if verbose else redirect_stdout(open(os.devnull, 'w'))
+
+
+def run_benchmark(args):
+    import DeleteFromElastic
+    import StorageBackends
+    import UploadToElastic
+    from ElasticClient import get_elastic_client
+
+    formats = args.formats
+    if not unstructured_available():
+        skipped_formats = [file_format for file_format in formats if file_format in ('pdf', 'docx')]
+        formats = [file_format for file_format in formats if file_format not in skipped_formats]
+        if len(skipped_formats) > 0:
+            print(f'Unstructured is not installed, skipping {", ".join(skipped_formats)} files')
+    product_areas = args.product_areas
+    container_names = [UploadToElastic.PRODUCT_CONTAINERS[product_area] for product_area in product_areas]
+    corpus = generate_corpus(container_names, args.files, formats, args.text_size, args.duplicate_ratio, args.records_per_bundle, args.seed)
+    corpus_bytes = sum(len(content) for blobs in corpus.values() for content in blobs.values())
+    print(f'Generated {args.files} files ({corpus_bytes / 1024 / 1024:.1f}MB) in {len(container_names)} containers')
+
+    if args.azurite:
+        os.environ['askmaddiknowledgeset_STORAGE'] = args.azurite
+        upload_corpus_to_azurite(args.azurite, corpus)
+        from azure.storage.blob import ContainerClient
+        archive_container = ContainerClient.from_connection_string(conn_str=args.azurite, container_name=ARCHIVE_CONTAINER)
+    else:
+        blob_service = InMemoryBlobService(args.blob_latency_ms / 1000)
+        blob_service.add_corpus(corpus)
+        UploadToElastic.create_container_client = blob_service.get_container_client
+        DeleteFromElastic.ContainerClient = blob_service
+        StorageBackends.ContainerClient = blob_service
+        archive_container = blob_service.get_container_client(ARCHIVE_CONTAINER)
+
+    embeddings = FakeEmbeddings(args.dimensions, args.embedding_latency_ms / 1000, args.rate_limit_ratio, seed=args.seed)
+    UploadToElastic.create_embeddings = lambda: embeddings
+    UploadToElastic._embeddings = None
+
+    timer = StageTimer()
+    instrument(timer)
+    UploadToElastic.PRODUCT_AREAS = product_areas
+    DeleteFromElastic.PRODUCT_AREAS = [product_area for product_area in product_areas if product_area in DeleteFromElastic.PRODUCT_INDEXES]
+    results = {'config': {argument: getattr(args, argument) for argument in CONFIG_ARGUMENTS}, 'files': args.files, 'corpus_bytes': corpus_bytes, 'formats': formats}
+
+    start = time.perf_counter()
+    with pipeline_output(args.verbose):
+        if args.upload_mode == 'queue':
+            results['queue'] = run_queue_upload(args)
+        else:
+            UploadToElastic.run_upload_to_elastic(True, False, False, args.check_elastic_for_duplicates, None, None, args.stream)
+    upload_seconds = time.perf_counter() - start
+    chunks = timer.counts.get('metadata', 0)
+    results['upload'] = {
+        'seconds': upload_seconds,
+        'files_per_second': args.files / upload_seconds,
+        'chunks_per_second': chunks / upload_seconds,
+        'mb_per_second': corpus_bytes / 1024 / 1024 / upload_seconds,
+        'chunks': chunks,
+        'embedding_requests': embeddings.requests,
+        'embedding_429s': embeddings.rate_limited,
+    }
+    results['reconcile_problems'] = check_reconcile(args, product_areas[0])
+    if args.upload_mode == 'queue':
+        queue = results['queue']
+        if queue['processed'] != queue['messages'] or [json.loads(message_body)['product_area'] for message_body in queue['poison_messages']] != [FAILING_BLOB_MESSAGE_PRODUCT_AREA]:
+            results['reconcile_problems'].append(f'{queue["processed"]} of {queue["messages"]} blob messages processed, poison: {queue["poison_messages"]}')
+
+    if not args.skip_delete:
+        elastic_client = get_elastic_client()
+        last_modified_date = datetime.now(timezone.utc) - timedelta(days=1)
+        results['delete'] = {}
+        for run_name, hard_delete, soft_delete_mode in [('soft_server', False, 'server'), ('soft_client', False, 'client'), ('hard', True, 'server')]:
+            seeded = seed_archived_chunks(archive_container, elastic_client, DeleteFromElastic.PRODUCT_AREAS, args.archived_files, args.archived_chunks, args.dimensions)
+            DeleteFromElastic.SOFT_DELETE_MODE = soft_delete_mode
+            start = time.perf_counter()
+            with pipeline_output(args.verbose):
+                DeleteFromElastic.run_delete_for_all_product_areas(last_modified_date, hard_delete)
+            delete_seconds = time.perf_counter() - start
+            results['delete'][run_name] = {'seconds': delete_seconds, 'seeded_chunks': seeded, 'chunks_per_second': seeded / delete_seconds}
+
+    #worker processes only count towards RUSAGE_CHILDREN once they have exited
+    if UploadToElastic._parse_pool is not None:
+        UploadToElastic._parse_pool.shutdown()
+        UploadToElastic._parse_pool = None
+    results['stages'] = timer.summary()
+    #ru_maxrss is in kilobytes on Linux
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results['peak_rss_children_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return results
+
+
+def print_report(results:dict):
+    upload = results['upload']
+    print()
+    print(f'Upload: {results["files"]} files, {upload["chunks"]} chunks in {upload["seconds"]:.2f}s  '
+          f'({upload["files_per_second"]:.1f} files/s, {upload["chunks_per_second"]:.1f} chunks/s, {upload["mb_per_second"]:.2f} MB/s)  '
+          f'{upload["embedding_requests"]} embedding requests, {upload["embedding_429s"]} throttled')
+    for run_name, delete in results.get('delete', {}).items():
+        print(f'Delete {run_name}: {delete["seeded_chunks"]} archived chunks in {delete["seconds"]:.2f}s ({delete["chunks_per_second"]:.1f} chunks/s)')
+    if 'queue' in results:
+        print(f'Queue: {results["queue"]["processed"]} of {results["queue"]["messages"]} blob messages processed, {len(results["queue"]["poison_messages"])} moved to poison')
+    print(f'Reconcile check: {"; ".join(results["reconcile_problems"]) or "ok"}')
+    print(f'Peak RSS: {results["peak_rss_mb"]:.0f}MB (parse workers {results["peak_rss_children_mb"]:.0f}MB)')
+    if 'telemetry' in results:
+        print(f'Telemetry: {results["telemetry"]["spans"]} spans')
+        for metric_name, by_stage in results['telemetry']['counters'].items():
+            print(f'  {metric_name}: ' + ', '.join(f'{stage} {value}' for stage, value in by_stage.items()))
+    print()
+    print(f'{"stage":<26}{"calls":>8}{"items":>9}{"total s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for stage, timing in results['stages'].items():
+        print(f'{stage:<26}{timing["calls"]:>8}{timing["items"]:>9}{timing["total_seconds"]:>10.2f}{timing["p50_ms"]:>10.1f}{timing["p99_ms"]:>10.1f}')
+
+
+def compare_to_baseline(results:dict, baseline:dict, max_regression:float, min_stage_ms:float):
+    #returns the regressions, higher is better for throughput and worse for latency and memory
+    comparisons = [('upload files/s', results['upload']['files_per_second'], baseline['upload']['files_per_second'], True),
+                   ('upload chunks/s', results['upload']['chunks_per_second'], baseline['upload']['chunks_per_second'], True),
+                   ('peak RSS MB', results['peak_rss_mb'], baseline['peak_rss_mb'], False),
+                   ('parse worker peak RSS MB', results['peak_rss_children_mb'], baseline['peak_rss_children_mb'], False)]
+    for run_name, delete in baseline.get('delete', {}).items():
+        if run_name in results.get('delete', {}):
+            comparisons.append((f'delete {run_name} chunks/s', results['delete'][run_name]['chunks_per_second'], delete['chunks_per_second'], True))
+    for stage, timing in baseline['stages'].items():
+        #very short stages are mostly noise, and so is the p99 of a stage with few calls
+        if stage in results['stages'] and timing['p50_ms'] >= min_stage_ms:
+            comparisons.append((f'{stage} p50 ms', results['stages'][stage]['p50_ms'], timing['p50_ms'], False))
+            if timing['calls'] >= P99_MIN_CALLS:
+                comparisons.append((f'{stage} p99 ms', results['stages'][stage]['p99_ms'], timing['p99_ms'], False))
+    regressions = []
+    for name, value, baseline_value, higher_is_better in comparisons:
+        if baseline_value == 0:
+            continue
+        change = (baseline_value - value) / baseline_value if higher_is_better else (value - baseline_value) / baseline_value
+        if change > max_regression:
+            regressions.append(f'{name}: {value:.1f} vs baseline {baseline_value:.1f} ({change:.0%} worse)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--formats', nargs='+', default=FORMATS, choices=FORMATS)
+    parser.add_argument('--product-areas', nargs='+', default=['ATO', 'Expert', 'Docketing'])
+    #characters of text in each pdf/docx, xlsx files get text_size / 100 rows
+    parser.add_argument('--text-size', type=int, default=6000)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    parser.add_argument('--records-per-bundle', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--upload-mode', choices=['timer', 'queue'], default='timer')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--check-elastic-for-duplicates', action='store_true')
+    parser.add_argument('--blob-latency-ms', type=float, default=5)
+    parser.add_argument('--embedding-latency-ms', type=float, default=50)
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.05)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--elastic-latency-ms', type=float, default=0)
+    parser.add_argument('--elastic-url', help='a local Elasticsearch to use instead of the fake, e.g. http://localhost:9200')
+    parser.add_argument('--azurite', metavar='CONNECTION_STRING', help='upload the corpus to Azurite and read it from there instead of memory')
+    parser.add_argument('--skip-delete', action='store_true')
+    parser.add_argument('--archived-files', type=int, default=50)
+    parser.add_argument('--archived-chunks', type=int, default=4)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='results json of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--min-stage-ms', type=float, default=5)
+    parser.add_argument('--telemetry', action='store_true', help='record the OpenTelemetry spans and metrics in memory')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    telemetry = setup_in_memory_telemetry() if args.telemetry else None
+    if args.elastic_url:
+        os.environ['ELASTIC_URL'] = args.elastic_url
+        results = run_benchmark(args)
+    else:
+        with FakeElasticsearch(args.elastic_latency_ms / 1000) as elastic:
+            os.environ['ELASTIC_URL'] = elastic.url
+            results = run_benchmark(args)
+            results['elastic_requests'] = elastic.request_counts
+    if telemetry is not None:
+        results['telemetry'] = summarize_telemetry(*telemetry)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if len(results['reconcile_problems']) > 0:
+        print('REGRESSION: reconciliation left the index out of step with the rewritten bundle')
+        return 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changed_arguments = [argument for argument in CONFIG_ARGUMENTS if baseline.get('config', {}).get(argument) != results['config'][argument]]
+        if len(changed_arguments) > 0:
+            print(f'WARNING: the baseline was run with different {", ".join(changed_arguments)}, the comparison may not be meaningful')
+        regressions = compare_to_baseline(results, baseline, args.max_regression, args.min_stage_ms)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if len(regressions) > 0:
+            return 1
+        print(f'No regressions over {args.max_regression:.0%} against {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
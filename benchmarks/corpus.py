@@ -0,0 +1,145 @@
+"""
+Synthetic corpus for the offline benchmarks: PDF, docx, Resolved Issues xlsx, Teams/Salesforce JSON records and
+NDJSON bundles, laid out the way the product area containers are (access level/application/folder/file).
+"""
+from io import BytesIO
+import json
+import random
+import zipfile
+
+FORMATS = ['pdf', 'docx', 'xlsx', 'teams', 'salesforce', 'ndjson']
+ACCESS_LEVELS = ['Internal', 'External']
+APPLICATIONS = ['Billing', 'Docketing', 'Reporting', 'Timekeeping']
+WORDS = ['invoice', 'matter', 'client', 'update', 'install', 'report', 'database', 'login', 'timeout', 'fixed', 'sync', 'crash',
+         'ledger', 'rate', 'approval', 'workflow', 'template', 'export', 'import', 'calendar', 'deadline', 'docket', 'court', 'rule']
+
+
+def make_sentence(random_generator:random.Random, word_count:int = 12):
+    words = [random_generator.choice(WORDS) for _ in range(word_count)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_paragraphs(random_generator:random.Random, size:int):
+    #about size characters of text in paragraphs of a few sentences
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = ' '.join(make_sentence(random_generator) for _ in range(random_generator.randint(2, 6)))
+        paragraphs.append(paragraph)
+        length = length + len(paragraph)
+    return paragraphs
+
+
+def pdf_escape(text:str):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(paragraphs:list, lines_per_page:int = 45):
+    #minimal PDF, one Helvetica text object per page, enough for pdfminer/Unstructured to extract the text
+    lines = []
+    for paragraph in paragraphs:
+        words = paragraph.split(' ')
+        for x in range(0, len(words), 12):
+            lines.append(' '.join(words[x:x+12]))
+        lines.append('')
+    pages = [lines[x:x+lines_per_page] for x in range(0, len(lines), lines_per_page)] or [['']]
+    objects = {1: b'<< /Type /Catalog /Pages 2 0 R >>', 3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'}
+    page_ids = []
+    for i, page_lines in enumerate(pages):
+        page_id, content_id = 4 + i * 2, 5 + i * 2
+        stream = 'BT /F1 10 Tf 50 780 Td 12 TL ' + ' '.join(f'({pdf_escape(line)}) Tj T*' for line in page_lines) + ' ET'
+        objects[content_id] = f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream'.encode('latin-1')
+        objects[page_id] = f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_id} 0 R /Resources << /Font << /F1 3 0 R >> >> >>'.encode()
+        page_ids.append(page_id)
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(f"{page_id} 0 R" for page_id in page_ids)}] /Count {len(page_ids)} >>'.encode()
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(pdf)
+        pdf.extend(f'{object_id} 0 obj\n'.encode() + objects[object_id] + b'\nendobj\n')
+    xref_offset = len(pdf)
+    pdf.extend(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    for object_id in sorted(objects):
+        pdf.extend(f'{offsets[object_id]:010d} 00000 n \n'.encode())
+    pdf.extend(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode())
+    return bytes(pdf)
+
+
+def xml_escape(text:str):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def make_docx(paragraphs:list):
+    #minimal WordprocessingML package with one run per paragraph
+    body = ''.join(f'<w:p><w:r><w:t>{xml_escape(paragraph)}</w:t></w:r></w:p>' for paragraph in paragraphs)
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        docx.writestr('_rels/.rels', '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+        docx.writestr('word/document.xml', '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>')
+    return buffer.getvalue()
+
+
+def make_xlsx(random_generator:random.Random, row_count:int):
+    import pandas as pd
+    rows = [{'Issue ID': str(100000 + i), 'Version': f'{random_generator.randint(1, 9)}.{random_generator.randint(0, 20)}',
+             'Summary': make_sentence(random_generator, random_generator.randint(4, 20)),
+             'Resolution': make_sentence(random_generator, random_generator.randint(4, 40)) if random_generator.random() > 0.1 else None}
+            for i in range(row_count)]
+    buffer = BytesIO()
+    pd.DataFrame(rows).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def make_teams_record(random_generator:random.Random, message_id:int):
+    return {'TeamId': 'team-1', 'ChannelId': f'channel-{message_id % 7}', 'MessageId': str(message_id), 'Date': '2024-01-01T00:00:00Z',
+            'Url': f'https://teams.example/{message_id}', 'Conversation': '\n'.join(make_paragraphs(random_generator, 600))}
+
+
+def make_salesforce_record(random_generator:random.Random, article_id:int):
+    return {'ID': f'ka0{article_id:08d}', 'TITLE': make_sentence(random_generator, 6), 'URLNAME': f'article-{article_id}',
+            'ARTICLENUMBER': str(article_id), 'SUMMARY': make_sentence(random_generator, 20), 'BODY': '\n'.join(make_paragraphs(random_generator, 1500))}
+
+
+def make_file(file_format:str, random_generator:random.Random, number:int, text_size:int, records_per_bundle:int):
+    #returns (file name, content)
+    if file_format == 'pdf':
+        return f'guide{number}.pdf', make_pdf(make_paragraphs(random_generator, text_size))
+    if file_format == 'docx':
+        return f'notes{number}.docx', make_docx(make_paragraphs(random_generator, text_size))
+    if file_format == 'xlsx':
+        return f'Resolved Issues in Updates {number}.xlsx', make_xlsx(random_generator, max(10, text_size // 100))
+    if file_format == 'teams':
+        return f'message{number}_teams.json', json.dumps(make_teams_record(random_generator, number)).encode()
+    if file_format == 'salesforce':
+        return f'article{number}_salesforce.json', json.dumps(make_salesforce_record(random_generator, number)).encode()
+    if file_format == 'ndjson':
+        records = [make_teams_record(random_generator, number * records_per_bundle + i) for i in range(records_per_bundle)]
+        return f'bundle{number}_teams.ndjson', '\n'.join(json.dumps(record) for record in records).encode()
+    raise ValueError(f'Unknown format: {file_format}')
+
+
+def generate_corpus(container_names:list, file_count:int, formats:list = FORMATS, text_size:int = 6000, duplicate_ratio:float = 0.05,
+                    records_per_bundle:int = 200, seed:int = 0):
+    """
+    Returns {container_name: {blob_name: content}} with file_count files spread over the containers and formats.
+    A share of the files (duplicate_ratio) are copies of earlier ones under another name so de-duplication has work to do
+    """
+    random_generator = random.Random(seed)
+    corpus = {container_name: {} for container_name in container_names}
+    generated = []
+    for number in range(file_count):
+        container_name = container_names[number % len(container_names)]
+        folder = f'{random_generator.choice(ACCESS_LEVELS)}/{random_generator.choice(APPLICATIONS)}/folder{number % 10}'
+        if generated and random_generator.random() < duplicate_ratio:
+            file_name, content = random_generator.choice(generated)
+            file_name = f'copy{number}_{file_name}'
+        else:
+            file_name, content = make_file(formats[number % len(formats)], random_generator, number, text_size, records_per_bundle)
+            generated.append((file_name, content))
+        corpus[container_name][f'{folder}/{file_name}'] = content
+    return corpus
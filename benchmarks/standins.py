@@ -0,0 +1,597 @@
+"""
+Local stand-ins for the services the pipeline talks to, so it can be benchmarked without Azure:
+
+- InMemoryBlobService: the ContainerClient calls the pipeline makes (list, find by tags, properties, download, upload, delete)
+- FakeEmbeddings: an embeddings client with configurable latency and share of 429 responses
+- FakeElasticsearch: a small Elasticsearch HTTP server holding documents in memory, it answers the requests the
+  real client and bulk helpers send for indexing, duplicate checks, reconciliation and deletes
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fnmatch import fnmatch
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+class BlobDownloader:
+    def __init__(self, content:bytes, properties):
+        self.content = content
+        self.properties = properties
+
+    def readall(self):
+        return self.content
+
+    def readinto(self, stream):
+        stream.write(self.content)
+        return len(self.content)
+
+
+class InMemoryBlobClient:
+    def __init__(self, container, blob_name:str):
+        self.container = container
+        self.blob_name = blob_name
+
+    def get_blob_properties(self):
+        from azure.core.exceptions import ResourceNotFoundError
+        if self.blob_name not in self.container.blobs:
+            raise ResourceNotFoundError(f'Blob not found: {self.blob_name}')
+        return self.container.properties[self.blob_name]
+
+    def download_blob(self):
+        properties = self.get_blob_properties()
+        self.container.wait()
+        return BlobDownloader(self.container.blobs[self.blob_name], properties)
+
+
+class InMemoryContainerClient:
+    """
+    Blobs are tagged with their upload time in modified like an uploader feeding BLOB_LISTING=tags would,
+    unless tags are passed to upload_blob
+    """
+    def __init__(self, container_name:str, latency_seconds:float = 0):
+        self.container_name = container_name
+        self.latency_seconds = latency_seconds
+        self.blobs = {}
+        self.properties = {}
+        self.tags = {}
+        self.lock = threading.Lock()
+        self.downloaded_bytes = 0
+
+    def wait(self):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+    def upload_blob(self, name:str, data, overwrite:bool = False, last_modified:datetime = None, tags:dict = None, etag:str = None, match_condition = None, metadata:dict = None, **kwargs):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+        content = data if isinstance(data, bytes) else data.encode() if isinstance(data, str) else data.read()
+        with self.lock:
+            if name in self.blobs and not overwrite:
+                raise ResourceExistsError(f'Blob already exists: {name}')
+            if match_condition == MatchConditions.IfNotModified and (name not in self.blobs or self.properties[name].etag != etag):
+                raise ResourceModifiedError(f'Blob was modified: {name}')
+            self.blobs[name] = content
+            content_md5 = bytearray(hashlib.md5(content).digest())
+            last_modified = last_modified or datetime.now(timezone.utc)
+            self.properties[name] = SimpleNamespace(name=name, size=len(content), etag=f'"0x{hashlib.md5(content).hexdigest()[:16]}"',
+                last_modified=last_modified, content_settings=SimpleNamespace(content_md5=content_md5), metadata=metadata or {})
+            self.tags[name] = tags if tags is not None else {'modified': last_modified.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    def delete_blob(self, name:str, **kwargs):
+        from azure.core.exceptions import ResourceNotFoundError
+        with self.lock:
+            if name not in self.blobs:
+                raise ResourceNotFoundError(f'Blob not found: {name}')
+            del self.blobs[name], self.properties[name], self.tags[name]
+
+    def create_container(self):
+        pass
+
+    def list_blobs(self, name_starts_with:str = None, **kwargs):
+        self.wait()
+        with self.lock:
+            blob_properties = sorted(self.properties.items())
+        return [properties for name, properties in blob_properties if name_starts_with is None or name.startswith(name_starts_with)]
+
+    def find_blobs_by_tags(self, filter_expression:str, **kwargs):
+        #only single comparisons like "modified" >= '2024-05-01T12:00:00Z'
+        tag_name, operator, value = re.fullmatch(r'"(\w+)"\s*(=|>=|>|<=|<)\s*\'([^\']*)\'', filter_expression.strip()).groups()
+        compare = {'=': str.__eq__, '>=': str.__ge__, '>': str.__gt__, '<=': str.__le__, '<': str.__lt__}[operator]
+        self.wait()
+        return [SimpleNamespace(name=name, container_name=self.container_name, tags={tag_name: tags[tag_name]})
+                for name, tags in sorted(self.tags.items()) if tag_name in tags and compare(tags[tag_name], value)]
+
+    def get_blob_client(self, blob_name:str):
+        return InMemoryBlobClient(self, blob_name)
+
+    def download_blob(self, blob_name:str):
+        return self.get_blob_client(blob_name).download_blob()
+
+
+class InMemoryBlobService:
+    """
+    Containers by name, get_container_client can stand in for UploadToElastic.create_container_client and
+    from_connection_string for ContainerClient.from_connection_string
+    """
+    def __init__(self, latency_seconds:float = 0):
+        self.latency_seconds = latency_seconds
+        self.containers = {}
+        self.lock = threading.Lock()
+
+    def get_container_client(self, container_name:str, connection_string:str = None):
+        with self.lock:
+            if container_name not in self.containers:
+                self.containers[container_name] = InMemoryContainerClient(container_name, self.latency_seconds)
+            return self.containers[container_name]
+
+    def from_connection_string(self, conn_str:str = None, container_name:str = None, **kwargs):
+        return self.get_container_client(container_name)
+
+    def add_corpus(self, corpus:dict):
+        for container_name, blobs in corpus.items():
+            container = self.get_container_client(container_name)
+            for blob_name, content in blobs.items():
+                container.upload_blob(blob_name, content, overwrite=True)
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after_ms:int):
+        super().__init__('Rate limit is exceeded. Try again later.')
+        self.response = SimpleNamespace(status_code=429, headers={'retry-after-ms': str(retry_after_ms)})
+
+
+class FakeEmbeddings:
+    """
+    Deterministic vectors (same text, same vector) after latency_seconds per request, and a rate_limit_ratio
+    share of requests rejected with a 429 the same way the OpenAI client raises it
+    """
+    def __init__(self, dimensions:int = 1536, latency_seconds:float = 0.05, rate_limit_ratio:float = 0, retry_after_ms:int = 100, seed:int = 0):
+        self.dimensions = dimensions
+        self.latency_seconds = latency_seconds
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after_ms = retry_after_ms
+        self.random_generator = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.texts = 0
+
+    def embed_text(self, text:str):
+        random_generator = random.Random(hashlib.md5(text.encode()).digest())
+        return [random_generator.uniform(-1, 1) for _ in range(self.dimensions)]
+
+    def embed_documents(self, texts:list):
+        time.sleep(self.latency_seconds)
+        with self.lock:
+            self.requests = self.requests + 1
+            rate_limited = self.random_generator.random() < self.rate_limit_ratio
+            if rate_limited:
+                self.rate_limited = self.rate_limited + 1
+            else:
+                self.texts = self.texts + len(texts)
+        if rate_limited:
+            raise FakeRateLimitError(self.retry_after_ms)
+        return [self.embed_text(text) for text in texts]
+
+    def embed_query(self, text:str):
+        return self.embed_text(text)
+
+
+def get_field_values(document:dict, field:str):
+    #values of a dotted field, lists (like metadata.source) are flattened, a .keyword suffix is the field itself
+    if field.endswith('.keyword'):
+        field = field[:-len('.keyword')]
+    values = [document]
+    for part in field.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                next_values.extend(item.get(part) for item in value if isinstance(item, dict))
+            elif isinstance(value, dict):
+                next_values.append(value.get(part))
+        values = [value for value in next_values if value is not None]
+    flattened = []
+    for value in values:
+        flattened.extend(value if isinstance(value, list) else [value])
+    return flattened
+
+
+class FakeIndex:
+    #documents in insertion order plus a lookup for the keyword fields the pipeline queries on
+    INDEXED_FIELDS = ['metadata.md5HexHash', 'metadata.source.file_name']
+
+    def __init__(self, mappings:dict = None):
+        self.mappings = mappings or {}
+        self.documents = OrderedDict()
+        self.field_values = {field: {} for field in self.INDEXED_FIELDS}
+
+    def unindex(self, document_id:str):
+        document = self.documents.pop(document_id, None)
+        if document is None:
+            return False
+        for field, ids_by_value in self.field_values.items():
+            for value in get_field_values(document, field):
+                ids_by_value.get(value, set()).discard(document_id)
+        return True
+
+    def put(self, document_id:str, document:dict):
+        self.unindex(document_id)
+        self.documents[document_id] = document
+        for field, ids_by_value in self.field_values.items():
+            for value in get_field_values(document, field):
+                ids_by_value.setdefault(value, set()).add(document_id)
+
+    def keyword_ignore_above(self, field:str):
+        #longer values are left out of field's keyword sub-field, dynamic mappings keep 256 characters
+        mapping = self.mappings
+        for part in field.split('.'):
+            mapping = mapping.get('properties', {}).get(part, {})
+        return mapping.get('fields', {}).get('keyword', {}).get('ignore_above', 256)
+
+    def match(self, query:dict):
+        #ids matching the query, in insertion order
+        if query is None or 'match_all' in query:
+            return list(self.documents.keys())
+        if 'ids' in query:
+            return [document_id for document_id in query['ids']['values'] if document_id in self.documents]
+        if 'terms' in query or 'term' in query:
+            field, values = next(iter((query.get('terms') or query.get('term')).items()))
+            values = values if isinstance(values, list) else [values.get('value') if isinstance(values, dict) else values]
+            field_name = field[:-len('.keyword')] if field.endswith('.keyword') else field
+            if field.endswith('.keyword'):
+                ignore_above = self.keyword_ignore_above(field_name)
+                values = [value for value in values if len(str(value)) <= ignore_above]
+            if field_name in self.field_values:
+                matched = set()
+                for value in values:
+                    matched.update(self.field_values[field_name].get(value, ()))
+                return [document_id for document_id in self.documents if document_id in matched]
+            return [document_id for document_id, document in self.documents.items() if set(get_field_values(document, field)) & set(values)]
+        if 'query_string' in query:
+            #the delete queries are a quoted phrase on one field, treated as a substring match
+            field = query['query_string']['default_field']
+            phrase = query['query_string']['query'].strip('"')
+            if field in self.field_values:
+                matched = set()
+                for value, document_ids in self.field_values[field].items():
+                    if phrase in value:
+                        matched.update(document_ids)
+                return [document_id for document_id in self.documents if document_id in matched]
+            return [document_id for document_id, document in self.documents.items() if any(phrase in str(value) for value in get_field_values(document, field))]
+        raise ValueError(f'Query not supported by the fake: {json.dumps(query)}')
+
+
+#the single shard every fake index has, scan and scroll responses are checked for it
+SHARDS = {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0}
+
+
+class FakeElasticsearch:
+    """
+    Elasticsearch stand-in served over HTTP on localhost, point the real client at url. Supports the subset of the
+    API the pipeline uses: index exists/create/refresh, _bulk, _search (with scroll and point in time paging),
+    _update_by_query with the remove-source script, _delete_by_query, _update and tasks, plus the index
+    templates, _reindex and aliases of ElasticIndexes
+    """
+    def __init__(self, latency_seconds:float = 0):
+        self.latency_seconds = latency_seconds
+        #by index and alias name, an alias refers to the same FakeIndex as its index
+        self.indices = {}
+        self.aliases = {}
+        self.index_templates = {}
+        self.lock = threading.RLock()
+        self.scrolls = {}
+        self.tasks = {}
+        self.ids = itertools.count(1)
+        self.request_counts = {}
+        handler = type('FakeElasticsearchHandler', (FakeElasticsearchHandler,), {'elastic': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def document_count(self, index_name:str = None):
+        with self.lock:
+            if index_name is not None:
+                return len(self.indices[index_name].documents) if index_name in self.indices else 0
+            return sum(len(index.documents) for name, index in self.indices.items() if name not in self.aliases)
+
+    def count_request(self, name:str):
+        with self.lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def get_index(self, index_name:str):
+        index = self.indices.get(index_name)
+        if index is None:
+            raise KeyError(index_name)
+        return index
+
+    def hit(self, index_name:str, document_id:str, document:dict, source_fields = None, sort = None):
+        source = {key: value for key, value in document.items() if key != 'vector'}
+        hit = {'_index': index_name, '_id': document_id, '_score': 1.0, '_source': source}
+        if sort is not None:
+            hit['sort'] = sort
+        return hit
+
+    def search(self, index_name:str, body:dict, params:dict):
+        index = self.get_index(index_name)
+        size = int(body.get('size', params.get('size', 10)))
+        matched = index.match(body.get('query'))
+        hits = [self.hit(index_name, document_id, index.documents[document_id]) for document_id in matched]
+        response = {'took': 1, 'timed_out': False, '_shards': SHARDS, 'hits': {'total': {'value': len(hits), 'relation': 'eq'}, 'max_score': 1.0}}
+        if 'scroll' in params or 'scroll' in body:
+            scroll_id = f'scroll-{next(self.ids)}'
+            self.scrolls[scroll_id] = hits[size:]
+            response['_scroll_id'] = scroll_id
+        response['hits']['hits'] = hits[:size]
+        return response
+
+    def pit_search(self, body:dict):
+        index_name = self.scrolls[body['pit']['id']]
+        index = self.get_index(index_name)
+        size = int(body.get('size', 10))
+        start = body.get('search_after', [0])[0] if body.get('search_after') else 0
+        positions = {document_id: position for position, document_id in enumerate(index.documents, start=1)}
+        matched = [document_id for document_id in index.match(body.get('query')) if positions[document_id] > start][:size]
+        hits = [self.hit(index_name, document_id, index.documents[document_id], sort=[positions[document_id]]) for document_id in matched]
+        return {'took': 1, 'timed_out': False, '_shards': SHARDS, 'pit_id': body['pit']['id'], 'hits': {'total': {'value': len(hits), 'relation': 'eq'}, 'hits': hits}}
+
+    def scroll(self, body:dict, params:dict):
+        scroll_id = body.get('scroll_id') or params.get('scroll_id')
+        remaining = self.scrolls.get(scroll_id, [])
+        size = 1000
+        self.scrolls[scroll_id] = remaining[size:]
+        return {'_scroll_id': scroll_id, 'took': 1, 'timed_out': False, '_shards': SHARDS, 'hits': {'total': {'value': len(remaining), 'relation': 'eq'}, 'hits': remaining[:size]}}
+
+    def apply_script(self, document:dict, script:dict):
+        #the scripts the pipeline sends: remove files from metadata.source (search_text or file_names) and add sources
+        #to it, delete the chunk when no source is left
+        params = script.get('params', {})
+        sources = document.get('metadata', {}).get('source')
+        if sources is None or not any(key in params for key in ('search_text', 'file_names', 'sources')):
+            raise ValueError(f'Script not supported by the fake: {json.dumps(script)}')
+        file_names = params.get('file_names') or ([params['search_text']] if 'search_text' in params else [])
+        remaining = [source for source in sources if source.get('file_name') not in file_names]
+        for source in params.get('sources', []):
+            if source not in remaining:
+                remaining.append(source)
+        if len(remaining) == 0:
+            return 'delete'
+        if remaining == sources:
+            return 'noop'
+        document['metadata']['source'] = remaining
+        return 'updated'
+
+    def bulk(self, lines:list, default_index:str = None):
+        items = []
+        errors = False
+        position = 0
+        while position < len(lines):
+            action_line = json.loads(lines[position])
+            (op_type, meta), = action_line.items()
+            index_name = meta.get('_index', default_index)
+            document_id = meta.get('_id') or str(next(self.ids))
+            body = json.loads(lines[position + 1]) if op_type != 'delete' else None
+            position = position + (1 if op_type == 'delete' else 2)
+            index = self.indices.setdefault(index_name, FakeIndex())
+            status, result = 200, 'updated'
+            if op_type in ('index', 'create'):
+                if op_type == 'create' and document_id in index.documents:
+                    status, result = 409, 'conflict'
+                else:
+                    status, result = (200, 'updated') if document_id in index.documents else (201, 'created')
+                    index.put(document_id, body)
+            elif op_type == 'delete':
+                status, result = (200, 'deleted') if index.unindex(document_id) else (404, 'not_found')
+            elif op_type == 'update':
+                document = index.documents.get(document_id)
+                if document is None:
+                    status, result = 404, 'document_missing_exception'
+                else:
+                    document = json.loads(json.dumps(document))
+                    if 'doc' in body:
+                        document.update(body['doc'])
+                    else:
+                        result = self.apply_script(document, body['script'])
+                    if result == 'delete':
+                        index.unindex(document_id)
+                        result = 'deleted'
+                    else:
+                        index.put(document_id, document)
+            item = {'_index': index_name, '_id': document_id, 'status': status, 'result': result}
+            if status >= 300 and status != 404:
+                errors = True
+                item['error'] = {'type': result, 'reason': result}
+            elif status == 404 and op_type == 'update':
+                errors = True
+                item['error'] = {'type': result, 'reason': result}
+            items.append({op_type: item})
+        return {'took': 1, 'errors': errors, 'items': items}
+
+    def by_query(self, index_name:str, body:dict, params:dict, delete:bool):
+        index = self.get_index(index_name)
+        counts = {'total': 0, 'updated': 0, 'deleted': 0, 'noops': 0}
+        for document_id in index.match(body.get('query')):
+            counts['total'] = counts['total'] + 1
+            if delete:
+                index.unindex(document_id)
+                counts['deleted'] = counts['deleted'] + 1
+                continue
+            document = index.documents[document_id]
+            result = self.apply_script(document, body['script'])
+            if result == 'delete':
+                index.unindex(document_id)
+                counts['deleted'] = counts['deleted'] + 1
+            elif result == 'updated':
+                index.put(document_id, document)
+                counts['updated'] = counts['updated'] + 1
+            else:
+                counts['noops'] = counts['noops'] + 1
+        response = {'took': 1, 'timed_out': False, 'failures': [], **counts}
+        if params.get('wait_for_completion') == 'false':
+            task_id = f'fake:{next(self.ids)}'
+            self.tasks[task_id] = {'completed': True, 'task': {'status': counts}, 'response': response}
+            return {'task': task_id}
+        return response
+
+    def template_mappings(self, index_name:str):
+        #mappings of the highest priority index template matching the index name
+        templates = [template for template in self.index_templates.values() if any(fnmatch(index_name, pattern) for pattern in template.get('index_patterns', []))]
+        if len(templates) == 0:
+            return None
+        return max(templates, key=lambda template: template.get('priority', 0)).get('template', {}).get('mappings')
+
+    def reindex(self, body:dict, params:dict):
+        source_index = self.get_index(body['source']['index'])
+        dest_index = self.get_index(body['dest']['index'])
+        for document_id, document in source_index.documents.items():
+            dest_index.put(document_id, json.loads(json.dumps(document)))
+        status = {'total': len(source_index.documents), 'created': len(source_index.documents), 'updated': 0}
+        response = {'took': 1, 'timed_out': False, 'failures': [], **status}
+        if params.get('wait_for_completion') == 'false':
+            task_id = f'fake:{next(self.ids)}'
+            self.tasks[task_id] = {'completed': True, 'task': {'status': status}, 'response': response}
+            return {'task': task_id}
+        return response
+
+    def update_aliases(self, body:dict):
+        #the alias can take the name of the index removed in the same request, so removals go first
+        for action in sorted(body['actions'], key=lambda action: 'remove_index' not in action):
+            if 'add' in action:
+                self.indices[action['add']['alias']] = self.get_index(action['add']['index'])
+                self.aliases[action['add']['alias']] = action['add']['index']
+            elif 'remove_index' in action:
+                index_name = action['remove_index']['index']
+                self.get_index(index_name)
+                del self.indices[index_name]
+                for alias in [alias for alias, alias_index in self.aliases.items() if alias_index == index_name]:
+                    del self.indices[alias]
+                    del self.aliases[alias]
+        return {'acknowledged': True}
+
+    def handle(self, method:str, path:str, params:dict, raw_body:bytes):
+        #returns (status, response body or None)
+        parts = [unquote(part) for part in path.split('/') if part]
+        body = {}
+        if raw_body and not (parts and parts[-1] == '_bulk'):
+            body = json.loads(raw_body)
+        with self.lock:
+            if len(parts) == 0:
+                return 200, {'name': 'fake', 'cluster_name': 'fake', 'version': {'number': '8.13.0', 'build_flavor': 'default'}, 'tagline': 'You Know, for Search'}
+            if parts[-1] == '_bulk':
+                self.count_request('bulk')
+                return 200, self.bulk(raw_body.decode().splitlines(), parts[0] if len(parts) > 1 else None)
+            if parts[0] == '_search' and len(parts) > 1 and parts[1] == 'scroll':
+                if method == 'DELETE':
+                    self.scrolls.pop(body.get('scroll_id', [None])[0] if isinstance(body.get('scroll_id'), list) else body.get('scroll_id'), None)
+                    return 200, {'succeeded': True, 'num_freed': 1}
+                self.count_request('scroll')
+                return 200, self.scroll(body, params)
+            if parts[0] == '_search':
+                self.count_request('search')
+                return 200, self.pit_search(body)
+            if parts[0] == '_pit':
+                self.scrolls.pop(body.get('id'), None)
+                return 200, {'succeeded': True, 'num_freed': 1}
+            if parts[0] == '_tasks':
+                return 200, self.tasks[parts[1]]
+            if parts[0] == '_index_template':
+                self.index_templates[parts[1]] = body
+                return 200, {'acknowledged': True}
+            if parts[0] == '_reindex':
+                self.count_request('reindex')
+                return 200, self.reindex(body, params)
+            if parts[0] == '_aliases':
+                return 200, self.update_aliases(body)
+            if parts[0] == '_alias':
+                if parts[1] not in self.aliases:
+                    return 404, {'error': f'alias [{parts[1]}] missing', 'status': 404}
+                return 200, {self.aliases[parts[1]]: {'aliases': {parts[1]: {}}}}
+            index_name = parts[0]
+            if len(parts) == 1:
+                if method == 'HEAD':
+                    return (200 if index_name in self.indices else 404), None
+                if method == 'PUT':
+                    if index_name in self.indices:
+                        return 400, {'error': {'type': 'resource_already_exists_exception', 'reason': f'index [{index_name}] already exists'}, 'status': 400}
+                    self.indices[index_name] = FakeIndex(body.get('mappings') or self.template_mappings(index_name))
+                    return 200, {'acknowledged': True, 'shards_acknowledged': True, 'index': index_name}
+                if method == 'DELETE':
+                    self.indices.pop(index_name, None)
+                    return 200, {'acknowledged': True}
+            if index_name not in self.indices and parts[1] != '_update':
+                return 404, {'error': {'type': 'index_not_found_exception', 'reason': f'no such index [{index_name}]'}, 'status': 404}
+            if parts[1] == '_refresh':
+                return 200, {'_shards': SHARDS}
+            if parts[1] in ('_block', '_settings'):
+                return 200, {'acknowledged': True}
+            if parts[1] == '_mapping':
+                return 200, {self.aliases.get(index_name, index_name): {'mappings': self.indices[index_name].mappings}}
+            if parts[1] == '_count':
+                return 200, {'count': len(self.indices[index_name].documents), '_shards': SHARDS}
+            if parts[1] == '_search':
+                self.count_request('search')
+                return 200, self.search(index_name, body, params)
+            if parts[1] == '_pit':
+                pit_id = f'pit-{next(self.ids)}'
+                self.scrolls[pit_id] = index_name
+                return 200, {'id': pit_id}
+            if parts[1] == '_update_by_query':
+                self.count_request('update_by_query')
+                return 200, self.by_query(index_name, body, params, delete=False)
+            if parts[1] == '_delete_by_query':
+                self.count_request('delete_by_query')
+                return 200, self.by_query(index_name, body, params, delete=True)
+            if parts[1] == '_update':
+                self.count_request('update')
+                response = self.bulk([json.dumps({'update': {'_index': index_name, '_id': parts[2]}}), json.dumps(body)])
+                return 200, response['items'][0]['update']
+        return 400, {'error': {'type': 'unsupported', 'reason': f'{method} {path} is not supported by the fake'}, 'status': 400}
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    #headers and body are written separately, without this every response waits on a delayed ack
+    disable_nagle_algorithm = True
+    elastic = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        raw_body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        if self.elastic.latency_seconds > 0:
+            time.sleep(self.elastic.latency_seconds)
+        try:
+            status, response = self.elastic.handle(self.command, url.path, params, raw_body)
+        except KeyError as e:
+            status, response = 404, {'error': {'type': 'not_found', 'reason': str(e)}, 'status': 404}
+        data = json.dumps(response).encode() if response is not None else b''
+        self.send_response(status)
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = respond
@@ -1,12 +1,20 @@
 import azure.functions as func
 import logging
 import os
+import typing
 from datetime import datetime, timedelta
-from UploadToElastic import run_upload_to_elastic
-from DeleteFromElastic import run_delete_for_all_product_areas, single_delete_run
+from BlobQueue import BLOB_INGESTION_QUEUE, MAX_DEQUEUE_COUNT
+# Telemetry only loads OpenTelemetry the first time a trigger records something
+from Telemetry import stage
+# UploadToElastic and DeleteFromElastic are imported by the triggers that use them so the host indexes
+# the functions without loading either pipeline, and the delete trigger never loads the upload stack
 
 app = func.FunctionApp()
 
+# timer (default) processes every changed blob in the timer invocation, queue only lists them and queues one message per blob,
+# plan only reports the chunks, tokens and embedding requests the changed blobs would take without uploading anything
+UPLOAD_MODE = os.environ.get('UPLOAD_MODE', 'timer').lower()
+
 def get_cron_expression():
     """
     Generate NCRONTAB expression based on days or minutes interval.
@@ -57,16 +65,25 @@ def get_time_delta():
         return timedelta(days=7)
     
 
+def get_check_for_duplicates_in_elastic():
+    return os.environ.get('CHECK_FOR_DUPLICATES_IN_ELASTIC', 'true').lower() == 'true'
+
 @app.timer_trigger(
     schedule=get_cron_expression(),  # {second} {minute} {hour} {day} {month} {day_of_week}
     arg_name="myTimer",
     run_on_startup=False,
     use_monitor=False
 )
-def TimerTrigger(myTimer: func.TimerRequest) -> None:
+@app.queue_output(
+    arg_name="blobQueue",
+    queue_name=BLOB_INGESTION_QUEUE,
+    connection="askmaddiknowledgeset_STORAGE"
+)
+def TimerTrigger(myTimer: func.TimerRequest, blobQueue: func.Out[typing.List[str]]) -> None:
     """
     Timer trigger function that runs based on the interval specified in 
     UPLOAD_INTERVAL_DAYS and UPLOAD_INTERVAL_MINUTES.
+    With UPLOAD_MODE set to queue it only queues one message per changed blob for BlobQueueTrigger.
     """
     if myTimer.past_due:
         logging.info('The timer is past due!')
@@ -74,26 +91,64 @@ def TimerTrigger(myTimer: func.TimerRequest) -> None:
     logging.info('Starting elastic upload process...')
     
     try:
-        # Get appropriate time delta based on configuration
-        time_delta = get_time_delta()
-        last_processed_time = datetime.now() - time_delta
+        with stage('Upload timer', upload_mode=UPLOAD_MODE):
+            # Get appropriate time delta based on configuration
+            time_delta = get_time_delta()
+            last_processed_time = datetime.now() - time_delta
         
-        # Call your existing function
-        run_upload_to_elastic(
-            from_azure_container=True,
-            from_directory=False,
-            is_sample_questions=False,
-            check_for_duplicates_in_elastic=False,
-            last_processed_time=last_processed_time,
-            prefix=None
-        )
+            if UPLOAD_MODE == 'queue':
+                from UploadToElastic import list_changed_blob_messages
+                blob_messages = list_changed_blob_messages(last_processed_time=last_processed_time)
+                blobQueue.set(blob_messages)
+                logging.info(f"Queued {len(blob_messages)} blobs for upload to Elastic")
+                return
+
+            if UPLOAD_MODE == 'plan':
+                from UploadToElastic import plan_upload_to_elastic
+                plan_upload_to_elastic(last_processed_time=last_processed_time)
+                return
+
+            # Call your existing function
+            from UploadToElastic import run_upload_to_elastic
+            run_upload_to_elastic(
+                from_azure_container=True,
+                from_directory=False,
+                is_sample_questions=False,
+                check_for_duplicates_in_elastic=get_check_for_duplicates_in_elastic(),
+                last_processed_time=last_processed_time,
+                prefix=None,
+                stream=os.environ.get('STREAM_UPLOAD', 'false').lower() == 'true'
+            )
         
-        logging.info("Upload to Elastic completed successfully")
+            logging.info("Upload to Elastic completed successfully")
         
     except Exception as e:
         logging.error(f"Error in timer triggered function: {str(e)}")
         raise
 
+@app.queue_trigger(
+    arg_name="blobMessage",
+    queue_name=BLOB_INGESTION_QUEUE,
+    connection="askmaddiknowledgeset_STORAGE"
+)
+def BlobQueueTrigger(blobMessage: func.QueueMessage) -> None:
+    """
+    Queue trigger function that downloads, chunks, embeds and indexes the single blob named in the message.
+    Failed messages are retried and moved to the poison queue by the runtime after maxDequeueCount attempts
+    (host.json), the number of messages handled at once is set by extensions.queues.batchSize.
+    """
+    message_body = blobMessage.get_body().decode('utf-8')
+    if blobMessage.dequeue_count > 1:
+        logging.warning(f'Retrying blob message (attempt {blobMessage.dequeue_count} of {MAX_DEQUEUE_COUNT}): {message_body}')
+
+    try:
+        with stage('Blob queue trigger', dequeue_count=blobMessage.dequeue_count):
+            from UploadToElastic import process_blob_message
+            process_blob_message(message_body, check_for_duplicates_in_elastic=get_check_for_duplicates_in_elastic())
+    except Exception as e:
+        logging.error(f"Error in blob queue triggered function: {str(e)}")
+        raise
+
 @app.timer_trigger(
     schedule=get_cron_expression(),
     arg_name="deleteTimer",
@@ -111,36 +166,38 @@ def DeleteTimerTrigger(deleteTimer: func.TimerRequest) -> None:
     logging.info('Starting elastic delete process...')
     
     try:
-        # Calculate the time window for deletion
-        time_window = get_time_delta()
-        last_modified_date = datetime.now() - time_window
+        with stage('Delete timer'):
+            from DeleteFromElastic import run_delete_for_all_product_areas, single_delete_run
+            # Calculate the time window for deletion
+            time_window = get_time_delta()
+            last_modified_date = datetime.now() - time_window
         
-        # Configure deletion parameters
-        hard_delete = os.environ['HARD_DELETE']
-        run_for_all_products = os.environ['RUN_FOR_ALL_PRODUCTS']
+            # Configure deletion parameters
+            hard_delete = os.environ['HARD_DELETE'].lower() == 'true'
+            run_for_all_products = os.environ['RUN_FOR_ALL_PRODUCTS'].lower() == 'true'
         
-        if run_for_all_products:
-            logging.info(f'Running delete for all product areas with hard_delete={hard_delete}')
-            run_delete_for_all_product_areas(
-                last_modified_date=last_modified_date,
-                hard_delete=hard_delete
-            )
-        else:
-            # Single product deletion
-            index_to_delete_from = os.environ['INDEX_TO_DELETE_FROM']
+            if run_for_all_products:
+                logging.info(f'Running delete for all product areas with hard_delete={hard_delete}')
+                run_delete_for_all_product_areas(
+                    last_modified_date=last_modified_date,
+                    hard_delete=hard_delete
+                )
+            else:
+                # Single product deletion
+                index_to_delete_from = os.environ['INDEX_TO_DELETE_FROM']
             
-            if not index_to_delete_from:
-                raise ValueError("INDEX_TO_DELETE_FROM environment variable is required for single product deletion")
+                if not index_to_delete_from:
+                    raise ValueError("INDEX_TO_DELETE_FROM environment variable is required for single product deletion")
                 
-            logging.info(f'Running single delete for index {index_to_delete_from}')
+                logging.info(f'Running single delete for index {index_to_delete_from}')
 
-            single_delete_run(
-                product_area=index_to_delete_from,
-                hard_delete=hard_delete,
-                last_modified_date=last_modified_date
-            )
+                single_delete_run(
+                    product_area=index_to_delete_from,
+                    hard_delete=hard_delete,
+                    last_modified_date=last_modified_date
+                )
         
-        logging.info("Delete from Elastic completed successfully")
+            logging.info("Delete from Elastic completed successfully")
         
     except Exception as e:
         logging.error(f"Error in delete timer triggered function: {str(e)}")
@@ -0,0 +1,115 @@
+"""
+Fixtures running the upload and delete pipelines against the benchmark stand-ins: blobs in memory, a fake
+Elasticsearch served on localhost and deterministic fake embeddings. Nothing is installed or reached outside the process.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+sys.path.insert(0, os.path.join(REPO_DIRECTORY, 'benchmarks'))
+
+#the pipeline modules read these at import, the worker caches and the parse pool are left out so every test starts clean
+TEST_SETTINGS = {
+    'askmaddiknowledgeset_STORAGE': 'UseDevelopmentStorage=true',
+    'PARSE_CACHE': 'none',
+    'EMBEDDING_CACHE': 'none',
+    'INGESTION_MANIFEST': 'none',
+    'DOCUMENT_PARSE_WORKERS': '0',
+    'TASK_POLL_SECONDS': '0',
+}
+os.environ.update(TEST_SETTINGS)
+
+from standins import FakeElasticsearch, FakeEmbeddings, InMemoryBlobService
+
+PRODUCT_AREA = 'ATO'
+CONTAINER_NAME = 'ato'
+INDEX_NAME = 'ato'
+
+
+class Pipeline:
+    """
+    One product area (ATO) whose container is served from memory and indexed into the fake Elasticsearch
+    """
+    def __init__(self, elastic:FakeElasticsearch, blob_service:InMemoryBlobService, embeddings:FakeEmbeddings):
+        self.elastic = elastic
+        self.blob_service = blob_service
+        self.embeddings = embeddings
+        self.container_client = blob_service.get_container_client(CONTAINER_NAME)
+
+    def upload_record(self, blob_name:str, text:str):
+        #a Teams conversation, blob_name has to end with teams.json
+        self.container_client.upload_blob(blob_name, json.dumps({'Conversation': text}).encode(), overwrite=True)
+
+    def upload_bundle(self, blob_name:str, texts:list):
+        #a Teams NDJSON bundle, one chunk per record
+        self.container_client.upload_blob(blob_name, '\n'.join(json.dumps({'Conversation': text}) for text in texts).encode(), overwrite=True)
+
+    def run_upload(self, stream:bool = False, check_for_duplicates_in_elastic:bool = False, prefix:str = None):
+        import UploadToElastic
+        results = UploadToElastic.run_upload_to_elastic(True, False, False, check_for_duplicates_in_elastic, None, prefix, stream)
+        assert results[PRODUCT_AREA]['status'] == 'succeeded', results[PRODUCT_AREA].get('error')
+        return results
+
+    def chunks(self, index_name:str = INDEX_NAME):
+        #_source of every chunk by id
+        index = self.elastic.indices.get(index_name)
+        return {} if index is None else {document_id: document for document_id, document in index.documents.items()}
+
+    def texts_by_id(self, file_name:str, index_name:str = INDEX_NAME):
+        #chunks listing file_name (container_name/blob_name)
+        return {document_id: document['text'] for document_id, document in self.chunks(index_name).items()
+                if file_name in [file_source.get('file_name') for file_source in document['metadata']['source']]}
+
+    def file_names(self, document_id:str, index_name:str = INDEX_NAME):
+        return [file_source.get('file_name') for file_source in self.chunks(index_name)[document_id]['metadata']['source']]
+
+
+@pytest.fixture(scope='session')
+def elastic():
+    with FakeElasticsearch() as fake_elastic:
+        #the shared client is created on first use from ELASTIC_URL
+        os.environ['ELASTIC_URL'] = fake_elastic.url
+        yield fake_elastic
+
+
+@pytest.fixture
+def manifest_kind():
+    #ingestion manifest of the pipeline fixture, tests parametrize manifest_kind to run with none or blob
+    return 'sqlite'
+
+
+@pytest.fixture
+def pipeline(elastic, manifest_kind, monkeypatch, tmp_path):
+    import DeleteFromElastic
+    import ElasticIndexes
+    import IngestionManifest
+    import StorageBackends
+    import UploadToElastic
+    with elastic.lock:
+        elastic.indices.clear()
+        elastic.aliases.clear()
+        elastic.index_templates.clear()
+    monkeypatch.setattr(ElasticIndexes, '_ensured_indexes', set())
+    monkeypatch.setattr(ElasticIndexes, '_exact_file_name_indexes', set())
+    blob_service = InMemoryBlobService()
+    monkeypatch.setattr(UploadToElastic, 'create_container_client', blob_service.get_container_client)
+    monkeypatch.setattr(DeleteFromElastic, 'ContainerClient', blob_service)
+    monkeypatch.setattr(StorageBackends, 'ContainerClient', blob_service)
+
+    def create_ingestion_manifest(connection_string:str):
+        if manifest_kind == 'none':
+            return None
+        if manifest_kind == 'blob':
+            return IngestionManifest.BlobIngestionManifest(connection_string)
+        return IngestionManifest.SqliteIngestionManifest(str(tmp_path / 'ingestion_manifest.sqlite'))
+    monkeypatch.setattr(IngestionManifest, '_ingestion_manifest', StorageBackends.WorkerSingleton(create_ingestion_manifest))
+    embeddings = FakeEmbeddings(dimensions=8, latency_seconds=0)
+    monkeypatch.setattr(UploadToElastic, 'create_embeddings', lambda: embeddings)
+    monkeypatch.setattr(UploadToElastic, '_embeddings', None)
+    monkeypatch.setattr(UploadToElastic, 'PRODUCT_AREAS', [PRODUCT_AREA])
+    monkeypatch.setattr(DeleteFromElastic, 'PRODUCT_AREAS', [PRODUCT_AREA])
+    return Pipeline(elastic, blob_service, embeddings)
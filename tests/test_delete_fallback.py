@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import CONTAINER_NAME, INDEX_NAME
+
+#over the 256 characters a dynamic keyword mapping keeps
+LONG_BLOB_NAME = 'Internal/' + 'l' * 280 + '_teams.json'
+LONG_FILE_NAME = f'{CONTAINER_NAME}/{LONG_BLOB_NAME}'
+SHORT_BLOB_NAME = 'Internal/short_teams.json'
+SHORT_FILE_NAME = f'{CONTAINER_NAME}/{SHORT_BLOB_NAME}'
+
+
+@pytest.fixture(params=[True, False], ids=['template', 'unmigrated'])
+def managed_templates(request, monkeypatch):
+    #without managed templates the index gets langchain's mapping and dynamic keyword sub-fields, like indexes never migrated
+    import ElasticIndexes
+    monkeypatch.setattr(ElasticIndexes, 'MANAGE_INDEX_TEMPLATES', request.param)
+    return request.param
+
+
+@pytest.fixture
+def indexed_files(pipeline, managed_templates):
+    pipeline.upload_record(LONG_BLOB_NAME, 'long file name text')
+    pipeline.upload_record(SHORT_BLOB_NAME, 'short file name text')
+    pipeline.run_upload()
+    assert len(pipeline.chunks()) == 2
+    return pipeline
+
+
+def test_source_filename_query():
+    from DeleteFromElastic import source_filename_query
+    assert source_filename_query(SHORT_FILE_NAME, False) == {'term': {'metadata.source.file_name.keyword': SHORT_FILE_NAME}}
+    assert source_filename_query(LONG_FILE_NAME, True) == {'term': {'metadata.source.file_name.keyword': LONG_FILE_NAME}}
+    assert 'query_string' in source_filename_query(LONG_FILE_NAME, False)
+
+
+def test_exact_file_names_follow_the_mapping(indexed_files, managed_templates):
+    from ElasticClient import get_elastic_client
+    from ElasticIndexes import has_exact_file_names
+    assert has_exact_file_names(get_elastic_client(), INDEX_NAME) == managed_templates
+    #what the fallback is for, the keyword sub-field of an unmigrated index doesn't have the long name
+    response = get_elastic_client().search(index=INDEX_NAME, query={'term': {'metadata.source.file_name.keyword': LONG_FILE_NAME}})
+    assert len(response.body['hits']['hits']) == (1 if managed_templates else 0)
+
+
+def test_missing_index_is_not_exact_and_not_created(pipeline):
+    from ElasticClient import get_elastic_client
+    from ElasticIndexes import has_exact_file_names
+    assert not has_exact_file_names(get_elastic_client(), 'missing')
+    assert 'missing' not in pipeline.elastic.indices
+    assert pipeline.elastic.index_templates == {}
+
+
+def test_hard_delete_removes_long_file_names(indexed_files):
+    from DeleteFromElastic import delete_from_elastic_by_source_filenames
+    from ElasticClient import get_elastic_client
+    delete_from_elastic_by_source_filenames([LONG_FILE_NAME, SHORT_FILE_NAME], INDEX_NAME, get_elastic_client())
+    get_elastic_client().indices.refresh(index=INDEX_NAME)
+    assert indexed_files.chunks() == {}
+
+
+@pytest.mark.parametrize('soft_delete_mode', ['server', 'client'])
+def test_soft_delete_removes_long_file_names(indexed_files, soft_delete_mode, monkeypatch):
+    import DeleteFromElastic
+    from ElasticClient import get_elastic_client
+    monkeypatch.setattr(DeleteFromElastic, 'SOFT_DELETE_MODE', soft_delete_mode)
+    DeleteFromElastic.update_or_remove_from_elastic(LONG_FILE_NAME, INDEX_NAME, get_elastic_client())
+    assert indexed_files.texts_by_id(LONG_FILE_NAME) == {}
+    assert list(indexed_files.texts_by_id(SHORT_FILE_NAME).values()) == ['short file name text']
@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import CONTAINER_NAME
+
+
+@pytest.fixture
+def changed_blobs(monkeypatch):
+    #names of the blobs every upload run found changed and loaded
+    import UploadToElastic
+    blob_names = []
+    iter_changed_blobs = UploadToElastic.iter_changed_blobs
+
+    def record_changed_blobs(*args, **kwargs):
+        for blob in iter_changed_blobs(*args, **kwargs):
+            blob_names.append(blob.name)
+            yield blob
+    monkeypatch.setattr(UploadToElastic, 'iter_changed_blobs', record_changed_blobs)
+    return blob_names
+
+
+def test_is_blob_changed():
+    from IngestionManifest import is_blob_changed, manifest_entry
+    manifest_entries = {'known.json': manifest_entry('"0x1"', None, [])}
+    assert is_blob_changed(manifest_entries, 'new.json', '"0x1"')
+    assert not is_blob_changed(manifest_entries, 'known.json', '"0x1"')
+    assert is_blob_changed(manifest_entries, 'known.json', '"0x2"')
+
+
+@pytest.mark.parametrize('manifest_kind', ['sqlite', 'blob'])
+@pytest.mark.parametrize('stream', [False, True], ids=['batch', 'stream'])
+def test_only_new_and_modified_blobs_are_loaded_again(pipeline, changed_blobs, stream):
+    pipeline.upload_record('Internal/first_teams.json', 'first text')
+    pipeline.upload_record('Internal/second_teams.json', 'second text')
+    pipeline.run_upload(stream)
+    assert sorted(changed_blobs) == ['Internal/first_teams.json', 'Internal/second_teams.json']
+
+    changed_blobs.clear()
+    pipeline.run_upload(stream)
+    assert changed_blobs == []
+
+    pipeline.upload_record('Internal/second_teams.json', 'second text, edited')
+    pipeline.upload_record('Internal/third_teams.json', 'third text')
+    pipeline.run_upload(stream)
+    assert sorted(changed_blobs) == ['Internal/second_teams.json', 'Internal/third_teams.json']
+    assert sorted(document['text'] for document in pipeline.chunks().values()) == ['first text', 'second text, edited', 'third text']
+
+
+@pytest.mark.parametrize('manifest_kind', ['sqlite', 'blob'])
+def test_manifest_records_etags_and_chunk_ids(pipeline):
+    from IngestionManifest import get_ingestion_manifest, CHUNK_IDS, ETAG
+    pipeline.upload_bundle('Internal/bundle_teams.ndjson', ['record A', 'record B'])
+    pipeline.run_upload()
+    entry = get_ingestion_manifest('UseDevelopmentStorage=true').get(CONTAINER_NAME)['Internal/bundle_teams.ndjson']
+    assert entry[ETAG] == pipeline.container_client.properties['Internal/bundle_teams.ndjson'].etag
+    assert entry[CHUNK_IDS] == ['bundle_teams.ndjson.1', 'bundle_teams.ndjson.2']
+
+
+@pytest.mark.parametrize('manifest_kind', ['none'])
+def test_without_a_manifest_every_blob_is_loaded(pipeline, changed_blobs):
+    pipeline.upload_record('Internal/first_teams.json', 'first text')
+    pipeline.run_upload()
+    pipeline.run_upload()
+    assert changed_blobs == ['Internal/first_teams.json', 'Internal/first_teams.json']
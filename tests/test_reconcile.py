@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import CONTAINER_NAME
+
+MODES = [(False, False), (False, True), (True, False), (True, True)]
+MODE_IDS = ['batch', 'batch-check-duplicates', 'stream', 'stream-check-duplicates']
+
+
+@pytest.mark.parametrize('stream,check_for_duplicates_in_elastic', MODES, ids=MODE_IDS)
+def test_rewritten_bundle_holds_exactly_its_new_chunks(pipeline, stream, check_for_duplicates_in_elastic):
+    #every record's chunk id moves down one when the first record is removed
+    pipeline.upload_bundle('Internal/reconcile_teams.ndjson', ['record A', 'record B', 'record C'])
+    pipeline.run_upload(stream, check_for_duplicates_in_elastic)
+    pipeline.upload_bundle('Internal/reconcile_teams.ndjson', ['record B', 'record C'])
+    pipeline.run_upload(stream, check_for_duplicates_in_elastic)
+    assert pipeline.texts_by_id(f'{CONTAINER_NAME}/Internal/reconcile_teams.ndjson') == {'reconcile_teams.ndjson.1': 'record B', 'reconcile_teams.ndjson.2': 'record C'}
+    assert len(pipeline.chunks()) == 2
+
+
+@pytest.mark.parametrize('stream,check_for_duplicates_in_elastic', MODES, ids=MODE_IDS)
+def test_text_shared_with_another_file_survives_the_rewrite_of_its_chunk(pipeline, stream, check_for_duplicates_in_elastic):
+    #the other file is listed after the bundle, so record A is kept in the bundle's first chunk and listed there for both.
+    #The manifest leaves the other file out of the second run, only the bundle's chunks are rewritten
+    pipeline.upload_bundle('Internal/reconcile_teams.ndjson', ['record A', 'record B', 'record C'])
+    pipeline.upload_record('Internal/reconcile_with_a_teams.json', 'record A')
+    pipeline.run_upload(stream, check_for_duplicates_in_elastic)
+    pipeline.upload_bundle('Internal/reconcile_teams.ndjson', ['record B', 'record C'])
+    pipeline.run_upload(stream, check_for_duplicates_in_elastic)
+    assert pipeline.texts_by_id(f'{CONTAINER_NAME}/Internal/reconcile_teams.ndjson') == {'reconcile_teams.ndjson.1': 'record B', 'reconcile_teams.ndjson.2': 'record C'}
+    assert sorted(pipeline.texts_by_id(f'{CONTAINER_NAME}/Internal/reconcile_with_a_teams.json').values()) == ['record A']
+
+
+def test_unchanged_chunks_are_not_embedded_again(pipeline):
+    pipeline.upload_bundle('Internal/reconcile_teams.ndjson', ['record A', 'record B'])
+    pipeline.run_upload()
+    embedded_texts = pipeline.embeddings.texts
+    pipeline.upload_bundle('Internal/reconcile_teams.ndjson', ['record A', 'record B', 'record C'])
+    pipeline.run_upload()
+    assert pipeline.embeddings.texts == embedded_texts + 1
+    assert sorted(pipeline.texts_by_id(f'{CONTAINER_NAME}/Internal/reconcile_teams.ndjson').values()) == ['record A', 'record B', 'record C']
+
+
+def test_removed_file_text_leaves_no_stale_chunk(pipeline):
+    pipeline.upload_record('Internal/first_teams.json', 'first version')
+    pipeline.run_upload()
+    pipeline.upload_record('Internal/first_teams.json', 'second version')
+    pipeline.run_upload()
+    assert [document['text'] for document in pipeline.chunks().values()] == ['second version']
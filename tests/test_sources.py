@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import CONTAINER_NAME, INDEX_NAME
+
+
+def index_chunk(pipeline, document_id:str, file_names:list):
+    from elasticsearch import helpers
+    from ElasticClient import get_elastic_client
+    from ElasticIndexes import ensure_index
+    ensure_index(get_elastic_client(), INDEX_NAME, 8)
+    helpers.bulk(get_elastic_client(), [{'_index': INDEX_NAME, '_id': document_id, 'text': document_id, 'vector': [0.0] * 8,
+        'metadata': {'source': [{'file_name': file_name, 'page': 1} for file_name in file_names]}}], refresh=True)
+
+
+def create_vector_store(pipeline):
+    import UploadToElastic
+    return UploadToElastic.create_vector_store(INDEX_NAME, pipeline.embeddings)
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['batch', 'stream'])
+def test_text_in_two_files_is_one_chunk_listing_both(pipeline, stream):
+    pipeline.upload_record('Internal/first_teams.json', 'shared text')
+    pipeline.run_upload(stream, True)
+    pipeline.upload_record('Internal/second_teams.json', 'shared text')
+    pipeline.run_upload(stream, True)
+    chunks = pipeline.chunks()
+    assert len(chunks) == 1
+    assert sorted(pipeline.file_names(next(iter(chunks)))) == [f'{CONTAINER_NAME}/Internal/first_teams.json', f'{CONTAINER_NAME}/Internal/second_teams.json']
+
+
+def test_concurrent_source_updates_keep_every_source(pipeline):
+    #what queue messages for different files holding the same text do at the same time
+    import UploadToElastic
+    index_chunk(pipeline, 'shared.1', ['ato/first'])
+    vector_store = create_vector_store(pipeline)
+    added_file_names = [f'ato/message_{i}' for i in range(16)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda file_name: UploadToElastic.update_sources_in_elastic(vector_store, INDEX_NAME, {'shared.1': [{'file_name': file_name, 'page': 1}]}), added_file_names))
+    assert sorted(pipeline.file_names('shared.1')) == sorted(['ato/first'] + added_file_names)
+
+
+def test_adding_a_listed_source_again_changes_nothing(pipeline):
+    import UploadToElastic
+    index_chunk(pipeline, 'shared.1', ['ato/first'])
+    UploadToElastic.update_sources_in_elastic(create_vector_store(pipeline), INDEX_NAME, {'shared.1': [{'file_name': 'ato/first', 'page': 1}]})
+    assert pipeline.file_names('shared.1') == ['ato/first']
+
+
+def test_removing_sources_deletes_the_chunk_once_none_is_left(pipeline):
+    import UploadToElastic
+    index_chunk(pipeline, 'shared.1', ['ato/first', 'ato/second'])
+    vector_store = create_vector_store(pipeline)
+    UploadToElastic.update_sources_in_elastic(vector_store, INDEX_NAME, {}, {'shared.1': {'ato/first'}})
+    assert pipeline.file_names('shared.1') == ['ato/second']
+    UploadToElastic.update_sources_in_elastic(vector_store, INDEX_NAME, {}, {'shared.1': {'ato/second'}})
+    assert 'shared.1' not in pipeline.chunks()